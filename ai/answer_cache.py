@@ -0,0 +1,160 @@
+"""
+Semantic answer cache for non-personalised chat replies
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+import faiss
+
+
+class SemanticAnswerCache:
+    """Cache of recent replies looked up by embedding similarity.
+
+    Stores (query embedding -> reply) for generic intents such as FAQ,
+    location and timings. A new message whose embedding is within
+    max_distance (cosine distance, 1 - cos) of a cached query with the same
+    intent gets the stored reply back. The key carries no entities, so only
+    replies that do not depend on them (or on database rows) may be stored;
+    the caller is responsible for that check. Booking, cancellation and
+    services (listed from the database) are never cached.
+    """
+
+    CACHEABLE_INTENTS = ('faq', 'location', 'timings')
+
+    def __init__(self, max_entries: int = 256, max_distance: float = 0.08,
+                 ttl_seconds: Optional[float] = 3600):
+        """Initialize the answer cache."""
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.ttl_seconds = ttl_seconds
+        self.index = None
+        self.entries: "OrderedDict[int, Dict]" = OrderedDict()
+        self.knowledge_version = None
+        self._next_id = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def is_cacheable_intent(self, intent: str) -> bool:
+        """Check if replies for this intent may be served from the cache."""
+        return intent in self.CACHEABLE_INTENTS
+
+    @staticmethod
+    def _as_query(vector: np.ndarray) -> np.ndarray:
+        """Return a normalized (1, dim) float32 copy of vector."""
+        query = np.array(vector, dtype='float32', copy=True).reshape(1, -1)
+        faiss.normalize_L2(query)
+        return query
+
+    def _remove(self, entry_id: int):
+        """Remove one entry from the index and the entry table (lock held)."""
+        self.index.remove_ids(np.array([entry_id], dtype='int64'))
+        self.entries.pop(entry_id, None)
+
+    def lookup(self, vector: np.ndarray, intent: str) -> Optional[str]:
+        """Return a cached reply for a semantically equivalent query, if any."""
+        if not self.is_cacheable_intent(intent):
+            return None
+
+        with self._lock:
+            if self.index is None or self.index.ntotal == 0:
+                self.misses += 1
+                return None
+
+            query = self._as_query(vector)
+            k = min(4, self.index.ntotal)
+            scores, ids = self.index.search(query, k)
+            now = time.monotonic()
+
+            for score, entry_id in zip(scores[0], ids[0]):
+                if entry_id < 0 or 1.0 - score > self.max_distance:
+                    break
+                entry = self.entries.get(int(entry_id))
+                if entry is None:
+                    continue
+                if self.ttl_seconds is not None and now - entry['stored_at'] > self.ttl_seconds:
+                    self._remove(int(entry_id))
+                    self.evictions += 1
+                    continue
+                if entry['intent'] != intent:
+                    continue
+
+                self.entries.move_to_end(int(entry_id))
+                self.hits += 1
+                return entry['reply']
+
+            self.misses += 1
+            return None
+
+    def store(self, vector: np.ndarray, intent: str, query: str, reply: str,
+              knowledge_version=None):
+        """Cache a reply for a query embedding (ignored for non-cacheable intents).
+
+        knowledge_version is the knowledge base version the reply was
+        generated against (as passed to sync_knowledge_version() before the
+        lookup). If the cache has since moved to another version, the reply
+        may be stale and is not stored.
+        """
+        if not self.is_cacheable_intent(intent) or not reply or self.max_entries <= 0:
+            return
+
+        with self._lock:
+            if knowledge_version is not None and knowledge_version != self.knowledge_version:
+                return
+
+            query_vector = self._as_query(vector)
+            if self.index is None:
+                self.index = faiss.IndexIDMap(faiss.IndexFlatIP(query_vector.shape[1]))
+
+            entry_id = self._next_id
+            self._next_id += 1
+            self.index.add_with_ids(query_vector, np.array([entry_id], dtype='int64'))
+            self.entries[entry_id] = {
+                'query': query,
+                'intent': intent,
+                'reply': reply,
+                'stored_at': time.monotonic()
+            }
+
+            # Least recently used entries go first
+            while len(self.entries) > self.max_entries:
+                oldest_id = next(iter(self.entries))
+                self._remove(oldest_id)
+                self.evictions += 1
+
+    def invalidate(self):
+        """Drop every cached reply (e.g. after the knowledge base is re-ingested)."""
+        with self._lock:
+            self.index = None
+            self.entries.clear()
+            self.invalidations += 1
+
+    def sync_knowledge_version(self, version):
+        """Invalidate the cache if the knowledge base version has changed."""
+        with self._lock:
+            if version == self.knowledge_version:
+                return
+            if self.knowledge_version is not None:
+                self.invalidate()
+            self.knowledge_version = version
+
+    def get_stats(self) -> Dict:
+        """Return cache size and hit/miss/eviction counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_entries': self.max_entries,
+                'max_distance': self.max_distance,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
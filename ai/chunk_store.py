@@ -0,0 +1,175 @@
+"""
+Memory-mapped chunk text store for the RAG engine
+"""
+
+import mmap
+import os
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+
+class ChunkStore:
+    """Read-only, memory-mapped store of chunk texts addressed by integer id.
+
+    Texts are concatenated as UTF-8 in chunks.bin; chunks_offsets.npy holds
+    n + 1 int64 byte offsets so chunk i is data[offsets[i]:offsets[i + 1]].
+    Both files are memory-mapped, so texts are read on demand and several
+    worker processes on one host share the same page cache. Other per-chunk
+    records (e.g. JSON metadata) use the same layout under another name.
+    """
+
+    DEFAULT_NAME = "chunks"
+    # Per-chunk JSON metadata (source, offsets, section, ...) kept alongside the texts
+    METADATA_NAME = "chunks_meta"
+
+    def __init__(self, directory: str, name: str = DEFAULT_NAME):
+        """Open an existing chunk store."""
+        self.directory = directory
+        self.name = name
+        self._file = None
+        self._data = None
+        data_path, offsets_path = self.paths(directory, name)
+        self.offsets = np.load(offsets_path, mmap_mode='r')
+
+        if os.path.getsize(data_path) > 0:
+            self._file = open(data_path, 'rb')
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def file_names(name: str = DEFAULT_NAME) -> Tuple[str, str]:
+        """Data and offsets file names for a store called name."""
+        return f"{name}.bin", f"{name}_offsets.npy"
+
+    @classmethod
+    def paths(cls, directory: str, name: str = DEFAULT_NAME) -> Tuple[str, str]:
+        """Data and offsets file paths for a store called name in directory."""
+        data_file, offsets_file = cls.file_names(name)
+        return os.path.join(directory, data_file), os.path.join(directory, offsets_file)
+
+    @classmethod
+    def exists(cls, directory: str, name: str = DEFAULT_NAME) -> bool:
+        """Check if a chunk store has been written to directory."""
+        return all(os.path.exists(path) for path in cls.paths(directory, name))
+
+    @classmethod
+    def write(cls, directory: str, texts: Iterable[str], name: str = DEFAULT_NAME) -> "ChunkStore":
+        """Write texts to a new chunk store in directory and open it.
+
+        Files are written under temporary names and renamed into place, so a
+        store that is still memory-mapped elsewhere is never truncated.
+        """
+        os.makedirs(directory, exist_ok=True)
+        data_path, offsets_path = cls.paths(directory, name)
+
+        offsets: List[int] = [0]
+        with open(data_path + '.tmp', 'wb') as f:
+            for text in texts:
+                encoded = text.encode('utf-8')
+                f.write(encoded)
+                offsets.append(offsets[-1] + len(encoded))
+        with open(offsets_path + '.tmp', 'wb') as f:
+            np.save(f, np.asarray(offsets, dtype=np.int64))
+
+        os.replace(data_path + '.tmp', data_path)
+        os.replace(offsets_path + '.tmp', offsets_path)
+        return cls(directory, name)
+
+    @classmethod
+    def append(cls, directory: str, texts: Iterable[str], name: str = DEFAULT_NAME) -> range:
+        """Append texts to an existing store and return their new chunk ids.
+
+        The data file only grows, so existing memory maps stay valid; the
+        offsets file is rewritten via a temporary file and rename. Open
+        ChunkStore instances must be reopened to see the new chunks.
+        """
+        writer = ChunkStoreWriter(directory, name=name)
+        try:
+            return writer.append(texts)
+        finally:
+            writer.close()
+
+    def __len__(self) -> int:
+        return max(len(self.offsets) - 1, 0)
+
+    def __getitem__(self, chunk_id: int) -> str:
+        if not 0 <= chunk_id < len(self):
+            raise IndexError(f"chunk id {chunk_id} out of range")
+        start = int(self.offsets[chunk_id])
+        end = int(self.offsets[chunk_id + 1])
+        if start == end:
+            return ""
+        return self._data[start:end].decode('utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        for chunk_id in range(len(self)):
+            yield self[chunk_id]
+
+    def close(self):
+        """Release the memory maps."""
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ChunkStoreWriter:
+    """Append-only writer for a ChunkStore, used for streaming ingestion.
+
+    Texts are appended to chunks.bin as they arrive; only the small offsets
+    array is kept in memory. flush() makes everything written so far durable
+    and visible to newly opened ChunkStore readers.
+    """
+
+    def __init__(self, directory: str, keep: Optional[int] = None, name: str = ChunkStore.DEFAULT_NAME):
+        """Open (or create) the store in directory for appending.
+
+        If keep is given, the store is first truncated to its first keep
+        chunks, discarding anything written after the last checkpoint. Only
+        truncate stores that no reader has memory-mapped.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.data_path, self.offsets_path = ChunkStore.paths(directory, name)
+
+        if ChunkStore.exists(directory, name):
+            self.offsets: List[int] = np.load(self.offsets_path).tolist()
+        else:
+            self.offsets = [0]
+            open(self.data_path, 'wb').close()
+
+        if keep is not None:
+            self.offsets = self.offsets[:keep + 1]
+            with open(self.data_path, 'r+b') as f:
+                f.truncate(self.offsets[-1])
+
+        self._file = open(self.data_path, 'ab')
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def append(self, texts: Iterable[str]) -> range:
+        """Append texts and return their chunk ids."""
+        first_id = len(self)
+        for text in texts:
+            encoded = text.encode('utf-8')
+            self._file.write(encoded)
+            self.offsets.append(self.offsets[-1] + len(encoded))
+        return range(first_id, len(self))
+
+    def flush(self):
+        """Persist appended texts and the offsets array."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        with open(self.offsets_path + '.tmp', 'wb') as f:
+            np.save(f, np.asarray(self.offsets, dtype=np.int64))
+        os.replace(self.offsets_path + '.tmp', self.offsets_path)
+
+    def close(self):
+        """Flush and close the data file."""
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
@@ -0,0 +1,200 @@
+"""
+Token-aware sentence/heading chunker for knowledge base ingestion
+"""
+
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+# Suppress HuggingFace verbosity
+os.environ['TRANSFORMERS_VERBOSITY'] = 'error'
+os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+
+from ai.model_registry import DEFAULT_EMBEDDING_MODEL
+
+# all-MiniLM-L6-v2 truncates input at 256 word-pieces
+DEFAULT_MAX_TOKENS = 256
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+(?=[A-Z0-9"\'(])')
+_MARKDOWN_HEADING = re.compile(r'^#{1,6}\s+\S')
+_DASH_SEPARATOR = re.compile(r'\s[-\u2013\u2014]\s')
+_APPROX_TOKEN = re.compile(r'\w+|[^\w\s]')
+
+
+def is_heading(line: str) -> bool:
+    """Detect section headings: markdown '#' lines and short ALL-CAPS lines ending in ':' like 'CARDIOLOGY:'.
+
+    ALL-CAPS content lines such as 'OPD: 9 AM - 5 PM', 'A: YES' or
+    'DR. JOHN SMITH - CARDIOLOGIST' are not headings: they lack the trailing
+    colon, contain digits or use a ' - ' separator.
+    """
+    line = line.strip()
+    if not line:
+        return False
+    if _MARKDOWN_HEADING.match(line):
+        return True
+    if len(line) > 80 or not line.endswith(':') or line.startswith('-'):
+        return False
+    if any(c.isdigit() for c in line) or _DASH_SEPARATOR.search(line):
+        return False
+    return any(c.isalpha() for c in line) and line.upper() == line
+
+
+class TokenAwareChunker:
+    """Split documents into chunks that fit the embedding model's token budget.
+
+    Chunks are packed from whole sentences (and list items), never cross a
+    section heading, and carry character offsets into the source text plus
+    the section they belong to. Token counts come from the model's own
+    tokenizer; if it cannot be loaded, a word-piece estimate is used.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_EMBEDDING_MODEL, max_tokens: Optional[int] = None):
+        """Initialize the chunker (the tokenizer is loaded on first use)."""
+        self.model_name = model_name
+        self.max_tokens = max_tokens or int(os.getenv('CHUNK_MAX_TOKENS', str(DEFAULT_MAX_TOKENS)))
+        self._tokenizer = None
+        self._tokenizer_loaded = False
+
+    @property
+    def tokenizer(self):
+        """The model's fast tokenizer, or None if unavailable."""
+        if not self._tokenizer_loaded:
+            self._tokenizer_loaded = True
+            try:
+                from transformers import AutoTokenizer
+                repo_id = self.model_name if '/' in self.model_name else f"sentence-transformers/{self.model_name}"
+                self._tokenizer = AutoTokenizer.from_pretrained(repo_id)
+            except Exception as e:
+                print(f"ℹ️ Note: tokenizer for {self.model_name} not loaded ({e}); estimating token counts")
+                self._tokenizer = None
+        return self._tokenizer
+
+    @property
+    def budget(self) -> int:
+        """Tokens available for text (room left for [CLS] and [SEP])."""
+        return max(self.max_tokens - 2, 8)
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        """Count word-pieces for each text."""
+        if not texts:
+            return []
+        if self.tokenizer is not None:
+            encoded = self.tokenizer(texts, add_special_tokens=False)['input_ids']
+            return [len(ids) for ids in encoded]
+        return [len(_APPROX_TOKEN.findall(text)) for text in texts]
+
+    def _split_long(self, text: str, start: int) -> List[Tuple[int, int]]:
+        """Cut an over-budget sentence into spans at token boundaries."""
+        spans = []
+        if self.tokenizer is not None:
+            offsets = self.tokenizer(text, add_special_tokens=False,
+                                     return_offsets_mapping=True)['offset_mapping']
+            for i in range(0, len(offsets), self.budget):
+                window = offsets[i:i + self.budget]
+                spans.append((start + window[0][0], start + window[-1][1]))
+            return spans
+
+        words = [(m.start(), m.end()) for m in re.finditer(r'\S+', text)]
+        # Words are at least one token, so this never exceeds the budget by much
+        step = max(self.budget * 3 // 4, 1)
+        for i in range(0, len(words), step):
+            window = words[i:i + step]
+            spans.append((start + window[0][0], start + window[-1][1]))
+        return spans
+
+    def _units(self, text: str) -> List[Dict]:
+        """Split text into heading and sentence units with character offsets."""
+        units = []
+        position = 0
+        for line in text.splitlines(keepends=True):
+            line_start = position
+            position += len(line)
+            stripped = line.strip()
+            if not stripped:
+                continue
+
+            offset = line_start + line.index(stripped[0])
+            if is_heading(stripped):
+                units.append({'start': offset, 'end': offset + len(stripped),
+                              'heading': stripped.lstrip('#').strip().rstrip(':')})
+                continue
+
+            # List items stay whole; prose is split into sentences
+            pieces = [stripped] if stripped.startswith(('-', '*', '•')) else _SENTENCE_END.split(stripped)
+            cursor = offset
+            for piece in pieces:
+                piece_start = text.index(piece, cursor)
+                units.append({'start': piece_start, 'end': piece_start + len(piece), 'heading': None})
+                cursor = piece_start + len(piece)
+        return units
+
+    def chunk(self, text: str) -> List[Dict]:
+        """Chunk text; each chunk has 'text', 'start', 'end', 'section' and 'tokens'."""
+        units = self._units(text)
+        token_counts = self.count_tokens([text[u['start']:u['end']] for u in units])
+
+        chunks: List[Dict] = []
+        section = None
+        current: List[Tuple[int, int]] = []
+        current_tokens = 0
+        current_section = None
+        has_body = False
+
+        def flush():
+            nonlocal current, current_tokens, has_body
+            if current and has_body:
+                start, end = current[0][0], current[-1][1]
+                chunks.append({
+                    'text': text[start:end],
+                    'start': start,
+                    'end': end,
+                    'section': current_section,
+                    'tokens': current_tokens
+                })
+            current, current_tokens, has_body = [], 0, False
+
+        for unit, tokens in zip(units, token_counts):
+            if unit['heading'] is not None:
+                # A heading starts a new chunk (consecutive headings stay together)
+                if has_body:
+                    flush()
+                section = unit['heading']
+                current_section = section
+                current.append((unit['start'], unit['end']))
+                current_tokens += tokens
+                continue
+
+            spans = [(unit['start'], unit['end'])]
+            if tokens > self.budget:
+                spans = self._split_long(text[unit['start']:unit['end']], unit['start'])
+                span_tokens = self.count_tokens([text[s:e] for s, e in spans])
+            else:
+                span_tokens = [tokens]
+
+            for span, count in zip(spans, span_tokens):
+                if has_body and current_tokens + count > self.budget:
+                    flush()
+                if not current:
+                    current_section = section
+                elif current_tokens + count > self.budget:
+                    # Only headings so far and they do not fit with this span; drop them
+                    current, current_tokens = [], 0
+                current.append(span)
+                current_tokens += count
+                has_body = True
+
+        flush()
+        return chunks
+
+
+_chunkers: Dict[Tuple[str, int], TokenAwareChunker] = {}
+
+
+def get_chunker(model_name: str = DEFAULT_EMBEDDING_MODEL, max_tokens: Optional[int] = None) -> TokenAwareChunker:
+    """Return a per-process chunker (the tokenizer is loaded once per process)."""
+    max_tokens = max_tokens or int(os.getenv('CHUNK_MAX_TOKENS', str(DEFAULT_MAX_TOKENS)))
+    key = (model_name, max_tokens)
+    if key not in _chunkers:
+        _chunkers[key] = TokenAwareChunker(model_name, max_tokens)
+    return _chunkers[key]
@@ -0,0 +1,399 @@
+"""
+Near-duplicate chunk detection (MinHash + LSH) for knowledge base ingestion
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import zlib
+from collections import defaultdict
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_WORD = re.compile(r'\w+')
+
+
+class NearDuplicateFilter:
+    """Drop chunks whose text is (nearly) identical to one already kept.
+
+    Exact duplicates are caught by a hash of the normalized text. Near
+    duplicates (copy-pasted sections with small edits, overlapping windows)
+    are found with MinHash signatures over word shingles and LSH banding, so
+    each chunk is only compared against a handful of candidates; a candidate
+    counts as a duplicate when its estimated Jaccard similarity is at least
+    threshold. Every kept chunk is registered under a key (e.g. its source
+    file) so callers can tell which document a dropped chunk duplicated.
+
+    The hashes, buckets and signatures (about 4 KB per kept chunk) live in
+    memory until persist() moves them to an SQLite file, after which memory
+    stays flat and lookups cost a few indexed queries per chunk. Chunks are
+    registered at consecutive positions; callers that register them in
+    chunk id order can later remove() or remap() them by chunk id, and
+    reopen() the database for the next incremental update.
+    """
+
+    def __init__(self, threshold: Optional[float] = None, num_perm: int = 64,
+                 bands: int = 16, shingle_size: int = 3, seed: int = 1):
+        """Initialize the filter (threshold defaults to INGEST_DEDUP_THRESHOLD)."""
+        if threshold is None:
+            threshold = float(os.getenv('INGEST_DEDUP_THRESHOLD', '0.8'))
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.seed = seed
+
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+        self._store = _MemoryStore()
+        self._registered = 0
+
+        self.checked = 0
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+
+    def _shingles(self, text: str) -> np.ndarray:
+        """32-bit hashes of the word shingles in text."""
+        words = _WORD.findall(text.lower())
+        size = min(self.shingle_size, len(words)) or 1
+        shingles = {' '.join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+        return np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles),
+                           dtype=np.uint64, count=len(shingles))
+
+    def signature(self, text: str) -> np.ndarray:
+        """MinHash signature of text (num_perm uint32 values)."""
+        hashes = self._shingles(text)
+        # Universal hashing (a * h + b) mod p; uint64 overflow only perturbs the permutation
+        permuted = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+    @staticmethod
+    def _exact_key(text: str) -> str:
+        """Hash of the case- and whitespace-normalized text."""
+        normalized = re.sub(r'\s+', ' ', text.lower()).strip()
+        return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+    def _band_keys(self, signature: np.ndarray) -> List[Tuple[int, bytes]]:
+        """LSH bucket keys, one per band."""
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+                for band in range(self.bands)]
+
+    @property
+    def registered(self) -> int:
+        """Kept chunks registered so far."""
+        return self._registered
+
+    def persist(self, path: str, keep: Optional[int] = None) -> bool:
+        """Keep the filter's state in an SQLite database at path from now on.
+
+        Call it before registering any chunk; keys must then be strings (or
+        None). Without keep the database starts empty. With keep, the state
+        of an earlier filter that committed at least keep registered chunks
+        is reopened and cut back to its first keep chunks; if the database
+        does not have that many, it is cleared and False is returned.
+        """
+        self._store = _SQLiteStore(path)
+        self._registered = 0
+        if keep is not None and self._store.truncate(keep):
+            self._registered = keep
+            return True
+        self._store.truncate(0)
+        return keep is None
+
+    def reopen(self, path: str, version, next_position: int) -> bool:
+        """Continue from the database an earlier run committed at path.
+
+        It is reused if it was committed for index version version, with
+        this filter's settings, and its positions end at next_position.
+        Otherwise it is cleared and False is returned, and the caller must
+        re-register the chunks it keeps with add(..., position=chunk_id).
+        Either way new chunks are registered from next_position on.
+        """
+        self._store = _SQLiteStore(path)
+        expected = dict(self._settings(), registered=next_position, version=version)
+        state = self._store.state()
+        reused = version is not None and all(state.get(name) == value for name, value in expected.items())
+        if not reused:
+            self._store.truncate(0)
+        self._registered = next_position
+        return reused
+
+    def remove(self, positions: Iterable[int]):
+        """Forget the chunks registered at positions (e.g. removed chunk ids)."""
+        self._store.remove([int(position) for position in positions])
+
+    def remap(self, id_map: np.ndarray):
+        """Renumber positions through id_map (old -> new, -1 drops the chunk), e.g. after compaction."""
+        id_map = np.asarray(id_map, dtype=np.int64)
+        self._store.remap(id_map)
+        self._registered = int(id_map.max()) + 1 if len(id_map) else 0
+
+    def _settings(self) -> Dict[str, int]:
+        """Parameters the stored signatures depend on."""
+        return {'num_perm': self.num_perm, 'bands': self.bands, 'shingle_size': self.shingle_size,
+                'seed': self.seed, 'signatures': int(self.threshold < 1.0)}
+
+    def commit(self, version=None):
+        """Make the registered chunks durable, recording the index version they belong to (no-op in memory)."""
+        self._store.commit(self._registered, dict(self._settings(), version=version))
+
+    def close(self):
+        """Close the database opened by persist(), if any."""
+        self._store.close()
+
+    def _register(self, exact_key: str, key: Hashable, signature: Optional[np.ndarray] = None,
+                  band_keys: Optional[List[Tuple[int, bytes]]] = None, position: Optional[int] = None):
+        """Record a kept chunk at position (default: the next one)."""
+        if position is None:
+            position = self._registered
+            self._registered += 1
+        self._store.add_exact(exact_key, key, position)
+        if signature is not None:
+            self._store.add_signature(position, key, signature, band_keys)
+
+    def add(self, text: str, key: Hashable = None, position: Optional[int] = None):
+        """Register a kept chunk without checking it (at position, if given)."""
+        if self.threshold >= 1.0:
+            self._register(self._exact_key(text), key, position=position)
+            return
+        signature = self.signature(text)
+        self._register(self._exact_key(text), key, signature, self._band_keys(signature), position)
+
+    def check(self, text: str, key: Hashable = None) -> Tuple[bool, Hashable]:
+        """Check a chunk and keep it if it is new.
+
+        Returns (is_duplicate, key the duplicate was registered under).
+        """
+        self.checked += 1
+        exact_key = self._exact_key(text)
+        found, original = self._store.get_exact(exact_key)
+        if found:
+            self.exact_duplicates += 1
+            return True, original
+        if self.threshold >= 1.0:
+            self._register(exact_key, key)
+            return False, None
+
+        signature = self.signature(text)
+        band_keys = self._band_keys(signature)
+        for candidate, original in self._store.candidates(band_keys):
+            if np.mean(candidate == signature) >= self.threshold:
+                self.near_duplicates += 1
+                return True, original
+
+        self._register(exact_key, key, signature, band_keys)
+        return False, None
+
+    def filter(self, texts: Iterable[str], key: Hashable = None) -> Tuple[List[int], Set[Hashable]]:
+        """Check a document's chunks in order.
+
+        Returns the positions of the chunks to keep and the keys of the other
+        documents that dropped chunks duplicated.
+        """
+        kept: List[int] = []
+        duplicate_of: Set[Hashable] = set()
+        for position, text in enumerate(texts):
+            is_duplicate, original = self.check(text, key)
+            if not is_duplicate:
+                kept.append(position)
+            elif original != key:
+                duplicate_of.add(original)
+        return kept, duplicate_of
+
+    @property
+    def removed(self) -> int:
+        """Chunks dropped so far."""
+        return self.exact_duplicates + self.near_duplicates
+
+    def get_stats(self) -> Dict:
+        """Return how many chunks were checked and dropped."""
+        return {
+            'threshold': self.threshold,
+            'checked': self.checked,
+            'kept': self.checked - self.removed,
+            'exact_duplicates': self.exact_duplicates,
+            'near_duplicates': self.near_duplicates,
+            'removed': self.removed
+        }
+
+    def report(self) -> str:
+        """One-line summary for ingest output."""
+        if not self.checked:
+            return "No chunks checked for duplicates"
+        return (f"🧹 Removed {self.removed}/{self.checked} duplicate chunks "
+                f"({self.exact_duplicates} exact, {self.near_duplicates} near-duplicate "
+                f"at Jaccard ≥ {self.threshold:g}; {100 * self.removed / self.checked:.1f}% of the corpus)")
+
+
+class _MemoryStore:
+    """Exact hashes, LSH buckets and signatures held in dicts."""
+
+    def __init__(self):
+        self._exact: Dict[str, Tuple[Hashable, int]] = {}
+        self._buckets: Dict[Tuple[int, bytes], List[int]] = defaultdict(list)
+        self._signatures: Dict[int, Tuple[np.ndarray, Hashable]] = {}
+
+    def get_exact(self, exact_key: str) -> Tuple[bool, Hashable]:
+        """(found, key) for an exact-duplicate hash."""
+        found = self._exact.get(exact_key)
+        return found is not None, found[0] if found else None
+
+    def add_exact(self, exact_key: str, key: Hashable, position: int):
+        """Register a hash unless it is already known."""
+        self._exact.setdefault(exact_key, (key, position))
+
+    def candidates(self, band_keys: List[Tuple[int, bytes]]) -> Iterable[Tuple[np.ndarray, Hashable]]:
+        """(signature, key) of the chunks sharing a bucket with band_keys."""
+        positions: Set[int] = set()
+        for band_key in band_keys:
+            positions.update(self._buckets.get(band_key, ()))
+        return (self._signatures[position] for position in positions)
+
+    def add_signature(self, position: int, key: Hashable, signature: np.ndarray,
+                      band_keys: List[Tuple[int, bytes]]):
+        """Register a signature under its bucket keys."""
+        self._signatures[position] = (signature, key)
+        for band_key in band_keys:
+            self._buckets[band_key].append(position)
+
+    def remove(self, positions: List[int]):
+        """Drop the rows of chunks at positions."""
+        removed = set(positions)
+        self._renumber(lambda position: -1 if position in removed else position)
+
+    def remap(self, id_map: np.ndarray):
+        """Renumber positions through id_map (-1 drops the chunk)."""
+        self._renumber(lambda position: int(id_map[position]) if position < len(id_map) else -1)
+
+    def _renumber(self, new_position):
+        """Apply new_position to every row, dropping rows mapped to -1."""
+        self._exact = {exact_key: (key, new_position(position))
+                       for exact_key, (key, position) in self._exact.items() if new_position(position) >= 0}
+        self._signatures = {new_position(position): entry
+                            for position, entry in self._signatures.items() if new_position(position) >= 0}
+        buckets = defaultdict(list)
+        for band_key, positions in self._buckets.items():
+            kept = [new_position(position) for position in positions if new_position(position) >= 0]
+            if kept:
+                buckets[band_key] = kept
+        self._buckets = buckets
+
+    def commit(self, registered: int, state: Dict):
+        """Nothing to make durable."""
+
+    def close(self):
+        """Nothing to release."""
+
+
+class _SQLiteStore:
+    """Exact hashes, LSH buckets and signatures in an SQLite database.
+
+    Rows carry the position of the chunk that added them so a resumed build
+    can drop whatever was written after its last checkpoint and an
+    incremental update can drop removed chunks. Bucket keys are folded to
+    64-bit integers to keep the bucket index small.
+    """
+
+    TABLES = ('exact', 'signatures', 'buckets')
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA cache_size=-16384")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS exact (hash TEXT PRIMARY KEY, key TEXT, position INTEGER);
+            CREATE TABLE IF NOT EXISTS signatures (position INTEGER PRIMARY KEY, key TEXT, signature BLOB);
+            CREATE TABLE IF NOT EXISTS buckets (bucket INTEGER, position INTEGER);
+            CREATE INDEX IF NOT EXISTS buckets_bucket ON buckets (bucket);
+            CREATE INDEX IF NOT EXISTS buckets_position ON buckets (position);
+            CREATE INDEX IF NOT EXISTS exact_position ON exact (position);
+            CREATE TABLE IF NOT EXISTS state (name TEXT PRIMARY KEY, value);
+        """)
+
+    @staticmethod
+    def _bucket(band_key: Tuple[int, bytes]) -> int:
+        """64-bit bucket id for a (band, band bytes) key."""
+        band, values = band_key
+        digest = hashlib.blake2b(bytes([band]) + values, digest_size=8).digest()
+        return int.from_bytes(digest, 'little', signed=True)
+
+    def truncate(self, keep: int) -> bool:
+        """Drop rows of chunks after the first keep; False if fewer were committed."""
+        row = self.conn.execute("SELECT value FROM state WHERE name = 'registered'").fetchone()
+        if keep and (row is None or row[0] < keep):
+            return False
+        for table in self.TABLES:
+            self.conn.execute(f"DELETE FROM {table} WHERE position >= ?", (keep,))
+        self.commit(keep, {})
+        return True
+
+    def state(self) -> Dict:
+        """Values recorded by the last commit()."""
+        return dict(self.conn.execute("SELECT name, value FROM state"))
+
+    def remove(self, positions: List[int]):
+        """Drop the rows of chunks at positions."""
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS removed (position INTEGER PRIMARY KEY)")
+        self.conn.execute("DELETE FROM removed")
+        self.conn.executemany("INSERT OR IGNORE INTO removed VALUES (?)", ((position,) for position in positions))
+        for table in self.TABLES:
+            self.conn.execute(f"DELETE FROM {table} WHERE position IN (SELECT position FROM removed)")
+
+    def remap(self, id_map: np.ndarray):
+        """Renumber positions through id_map (-1 drops the chunk)."""
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS id_map (old INTEGER PRIMARY KEY, new INTEGER)")
+        self.conn.execute("DELETE FROM id_map")
+        self.conn.executemany("INSERT INTO id_map VALUES (?, ?)",
+                              ((old, new) for old, new in enumerate(id_map.tolist()) if new >= 0))
+        for table in self.TABLES:
+            self.conn.execute(f"DELETE FROM {table} WHERE position NOT IN (SELECT old FROM id_map)")
+            # Via negative values so renumbered positions never collide with ones not yet updated
+            self.conn.execute(f"UPDATE {table} SET position = -1 - "
+                              f"(SELECT new FROM id_map WHERE old = {table}.position)")
+            self.conn.execute(f"UPDATE {table} SET position = -1 - position")
+
+    def get_exact(self, exact_key: str) -> Tuple[bool, Hashable]:
+        """(found, key) for an exact-duplicate hash."""
+        row = self.conn.execute("SELECT key FROM exact WHERE hash = ?", (exact_key,)).fetchone()
+        return row is not None, row[0] if row else None
+
+    def add_exact(self, exact_key: str, key: Hashable, position: int):
+        """Register a hash unless it is already known."""
+        self.conn.execute("INSERT OR IGNORE INTO exact VALUES (?, ?, ?)", (exact_key, key, position))
+
+    def candidates(self, band_keys: List[Tuple[int, bytes]]) -> Iterable[Tuple[np.ndarray, Hashable]]:
+        """(signature, key) of the chunks sharing a bucket with band_keys."""
+        buckets = [self._bucket(band_key) for band_key in band_keys]
+        rows = self.conn.execute(
+            "SELECT signature, key FROM signatures WHERE position IN "
+            f"(SELECT position FROM buckets WHERE bucket IN ({','.join('?' * len(buckets))}))",
+            buckets
+        ).fetchall()
+        return ((np.frombuffer(signature, dtype=np.uint32), key) for signature, key in rows)
+
+    def add_signature(self, position: int, key: Hashable, signature: np.ndarray,
+                      band_keys: List[Tuple[int, bytes]]):
+        """Register a signature under its bucket keys."""
+        self.conn.execute("INSERT INTO signatures VALUES (?, ?, ?)", (position, key, signature.tobytes()))
+        self.conn.executemany("INSERT INTO buckets VALUES (?, ?)",
+                              ((self._bucket(band_key), position) for band_key in band_keys))
+
+    def commit(self, registered: int, state: Dict):
+        """Commit everything registered so far along with the state values."""
+        self.conn.execute("DELETE FROM state")
+        self.conn.executemany("INSERT INTO state VALUES (?, ?)",
+                              [('registered', registered)] + list(state.items()))
+        self.conn.commit()
+
+    def close(self):
+        """Close the connection."""
+        self.conn.close()
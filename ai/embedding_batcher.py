@@ -0,0 +1,150 @@
+"""
+Cross-request micro-batching of embedding model calls
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ai.model_registry import get_embedding_model, DEFAULT_EMBEDDING_MODEL
+
+
+class EmbeddingBatcher:
+    """Coalesce concurrent encode requests into batched forward passes.
+
+    Request threads submit texts and get a Future back. A single worker
+    thread takes the first pending text, keeps collecting for up to
+    window_ms (or until max_batch_size texts are pending), encodes them in
+    one model.encode() call and resolves every caller's future. Under load
+    the cost per text falls with the batch size instead of growing with the
+    number of concurrent requests; an idle server adds at most window_ms.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_EMBEDDING_MODEL, window_ms: float = 2.0,
+                 max_batch_size: int = 32):
+        """Create the batcher; the worker thread starts on the first submit."""
+        self.model_name = model_name
+        self.window_ms = window_ms
+        self.max_batch_size = max(max_batch_size, 1)
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._pid = None
+
+        self.requests = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self.encode_seconds = 0.0
+
+    def _ensure_worker(self):
+        """Start the worker thread (again in a forked child, where it does not survive)."""
+        if self._worker is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._worker = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+                self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        """Queue one text for encoding; the future resolves to its 1-D float32 embedding."""
+        self._ensure_worker()
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def encode(self, texts: Sequence[str], timeout: Optional[float] = 30.0) -> np.ndarray:
+        """Encode texts through the shared batches and wait for them; returns a (n, dim) matrix."""
+        futures = [self.submit(text) for text in texts]
+        return np.vstack([future.result(timeout=timeout) for future in futures])
+
+    def _collect(self) -> List[Tuple[str, Future]]:
+        """Block for the first request, then gather more until the window closes or the batch is full."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    # Window closed: still take whatever is already waiting
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        """Worker loop: one model.encode() per collected batch."""
+        while True:
+            batch = self._collect()
+            # Skip callers that gave up (cancelled futures)
+            batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                # Concurrent identical messages are encoded once
+                unique = list(dict.fromkeys(text for text, _ in batch))
+                model = get_embedding_model(self.model_name, track_consumer=False)
+                start = time.perf_counter()
+                vectors = np.asarray(model.encode(unique, batch_size=len(unique), show_progress_bar=False),
+                                     dtype='float32')
+                elapsed = time.perf_counter() - start
+                by_text = dict(zip(unique, vectors))
+                with self._lock:
+                    self.requests += len(batch)
+                    self.batches += 1
+                    self.largest_batch = max(self.largest_batch, len(unique))
+                    self.encode_seconds += elapsed
+                for text, future in batch:
+                    future.set_result(by_text[text])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+    def get_stats(self) -> Dict:
+        """Return request/batch counters and the average batch size."""
+        with self._lock:
+            return {
+                'window_ms': self.window_ms,
+                'max_batch_size': self.max_batch_size,
+                'requests': self.requests,
+                'batches': self.batches,
+                'avg_batch_size': round(self.requests / self.batches, 2) if self.batches else 0.0,
+                'largest_batch': self.largest_batch,
+                'avg_encode_ms': round(1000 * self.encode_seconds / self.batches, 3) if self.batches else 0.0
+            }
+
+
+_batchers: Dict[str, EmbeddingBatcher] = {}
+_batchers_lock = threading.Lock()
+
+
+def get_embedding_batcher(model_name: str = DEFAULT_EMBEDDING_MODEL) -> Optional[EmbeddingBatcher]:
+    """Return the process-wide batcher for model_name, or None if disabled.
+
+    Configured with EMBEDDING_BATCH_WINDOW_MS (0 disables batching) and
+    EMBEDDING_BATCH_MAX_SIZE.
+    """
+    window_ms = float(os.getenv('EMBEDDING_BATCH_WINDOW_MS', '2'))
+    if window_ms <= 0:
+        return None
+    with _batchers_lock:
+        batcher = _batchers.get(model_name)
+        if batcher is None:
+            batcher = EmbeddingBatcher(model_name, window_ms=window_ms,
+                                       max_batch_size=int(os.getenv('EMBEDDING_BATCH_MAX_SIZE', '32')))
+            _batchers[model_name] = batcher
+        return batcher
+
+
+def get_batcher_stats() -> Dict[str, Dict]:
+    """Stats of every batcher created in this process, by model name."""
+    with _batchers_lock:
+        return {model_name: batcher.get_stats() for model_name, batcher in _batchers.items()}
@@ -0,0 +1,398 @@
+"""
+Embedding caches: in-process LRU for queries, persistent SQLite cache by content hash
+"""
+
+import atexit
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ai.model_registry import get_embedding_model, embedding_key, DEFAULT_EMBEDDING_MODEL
+from ai.embedding_batcher import get_embedding_batcher
+
+
+def normalize_query(text: str) -> str:
+    """Normalize text for cache lookups (case and whitespace insensitive)."""
+    return re.sub(r'\s+', ' ', text.lower()).strip()
+
+
+class QueryEmbeddingCache:
+    """Bounded, thread-safe LRU cache of query embeddings.
+
+    Keys are (model_name, normalized text); values are read-only float32
+    vectors. Entries older than ttl_seconds (if set) are treated as misses.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: Optional[float] = None):
+        """Initialize the cache."""
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[np.ndarray, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, model_name: str, text: str) -> Optional[np.ndarray]:
+        """Return the cached embedding, or None on a miss."""
+        key = (model_name, normalize_query(text))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            vector, stored_at = entry
+            if self.ttl_seconds is not None and time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, model_name: str, text: str, vector: np.ndarray) -> np.ndarray:
+        """Store an embedding and return the cached (read-only) copy."""
+        if self.max_size <= 0:
+            return vector
+
+        key = (model_name, normalize_query(text))
+        vector = np.array(vector, dtype='float32', copy=True).reshape(-1)
+        vector.setflags(write=False)
+        with self._lock:
+            self._entries[key] = (vector, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return vector
+
+    def clear(self):
+        """Drop all cached embeddings (counters are kept)."""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict:
+        """Return hit/miss/eviction counters and current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+class DiskEmbeddingCache:
+    """Persistent embedding cache keyed by (model_name, sha256(text)).
+
+    model_name is the embedding_key(), which includes the encoder backend
+    when it is not the full-precision reference.
+
+    Backed by SQLite (WAL mode, synchronous=NORMAL, safe across worker
+    processes). Vectors are stored as float32 blobs. When the cache grows
+    past max_entries the least recently used entries are evicted.
+
+    Lookups never write: recency of hits is collected in memory and applied
+    with the next write. Request-path stores (defer=True) are buffered and
+    flushed in one transaction every flush_size entries or flush_interval
+    seconds, with a short busy timeout so a request never waits on another
+    process's write lock (a flush that cannot get it is retried later). The
+    entry count is tracked in memory and only recounted when it suggests
+    eviction is due.
+    """
+
+    BUSY_TIMEOUT_SECONDS = 30
+    # Request-path flushes give up quickly and retry on a later store
+    DEFERRED_BUSY_TIMEOUT_MS = 50
+
+    def __init__(self, path: str, max_entries: int = 500000, flush_size: int = 256,
+                 flush_interval: float = 30.0):
+        """Open (or create) the cache database."""
+        self.path = path
+        self.max_entries = max_entries
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        # Buffered request-path rows, by (model_name, text_hash), and unsaved hit times
+        self._pending: "OrderedDict[Tuple[str, str], Tuple]" = OrderedDict()
+        self._touched: Dict[Tuple[str, str], float] = {}
+        self._last_flush = time.monotonic()
+        self._retry_after = 0.0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=self.BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        # WAL + NORMAL: commits do not fsync; a power loss can only drop recent cache entries
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model_name TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model_name, text_hash)
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)')
+        self._conn.commit()
+        self._count = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        """Content hash used as the cache key."""
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get_many(self, model_name: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Look up embeddings for texts; missing entries come back as None (read-only)."""
+        hashes = [self.text_hash(text) for text in texts]
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            unique = list(dict.fromkeys(hashes))
+            for text_hash in unique:
+                row = self._pending.get((model_name, text_hash))
+                if row is not None:
+                    found[text_hash] = np.frombuffer(row[3], dtype='float32', count=row[2])
+            missing = [text_hash for text_hash in unique if text_hash not in found]
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(missing), 500):
+                batch = missing[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows = self._conn.execute(
+                    f'SELECT text_hash, dim, vector FROM embeddings '
+                    f'WHERE model_name = ? AND text_hash IN ({placeholders})',
+                    [model_name] + batch
+                ).fetchall()
+                for text_hash, dim, blob in rows:
+                    found[text_hash] = np.frombuffer(blob, dtype='float32', count=dim)
+            if found:
+                # Recency is saved with the next write instead of a transaction per lookup
+                now = time.time()
+                for text_hash in found:
+                    self._touched[(model_name, text_hash)] = now
+
+            results = [found.get(text_hash) for text_hash in hashes]
+            hits = sum(1 for vector in results if vector is not None)
+            self.hits += hits
+            self.misses += len(results) - hits
+        return results
+
+    def put_many(self, model_name: str, texts: Sequence[str], vectors: np.ndarray, defer: bool = False):
+        """Store embeddings for texts and evict old entries if over the limit.
+
+        With defer=True (request path) the rows are buffered and written with
+        a later batch instead of in a transaction of their own.
+        """
+        if self.max_entries <= 0 or len(texts) == 0:
+            return
+        vectors = np.asarray(vectors, dtype='float32')
+        now = time.time()
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                text_hash = self.text_hash(text)
+                self._pending[(model_name, text_hash)] = (model_name, text_hash, int(vector.shape[0]),
+                                                          vector.tobytes(), now)
+            if defer:
+                now_monotonic = time.monotonic()
+                if now_monotonic < self._retry_after or (
+                        len(self._pending) < self.flush_size and
+                        now_monotonic - self._last_flush < self.flush_interval):
+                    return
+                self._flush(self.DEFERRED_BUSY_TIMEOUT_MS)
+            else:
+                self._flush()
+
+    def flush(self):
+        """Write buffered entries and hit times now."""
+        with self._lock:
+            self._flush()
+
+    def _flush(self, busy_timeout_ms: Optional[int] = None):
+        """Write buffered rows and recency in one transaction, evicting if needed (lock held)."""
+        self._last_flush = time.monotonic()
+        if not self._pending and not self._touched:
+            return
+        if busy_timeout_ms is not None:
+            self._conn.execute(f'PRAGMA busy_timeout={int(busy_timeout_ms)}')
+        try:
+            rows = list(self._pending.values())
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO embeddings (model_name, text_hash, dim, vector, last_used) '
+                'VALUES (?, ?, ?, ?, ?)', rows
+            )
+            self._conn.executemany(
+                'UPDATE embeddings SET last_used = ? WHERE model_name = ? AND text_hash = ?',
+                [(used, model_name, text_hash) for (model_name, text_hash), used in self._touched.items()
+                 if (model_name, text_hash) not in self._pending]
+            )
+
+            # Counted in memory (replaced rows and other writers make it approximate);
+            # recount only when it suggests eviction is due
+            self._count += len(rows)
+            if self._count > self.max_entries * 1.1:
+                self._count = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+                # Evict in bulk once 10% over the limit so inserts stay cheap
+                if self._count > self.max_entries * 1.1:
+                    excess = self._count - self.max_entries
+                    self._conn.execute(
+                        'DELETE FROM embeddings WHERE rowid IN '
+                        '(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)', (excess,)
+                    )
+                    self.evictions += excess
+                    self._count -= excess
+            self._conn.commit()
+            self.writes += len(rows)
+            self._pending.clear()
+            self._touched.clear()
+        except sqlite3.OperationalError as e:
+            self._conn.rollback()
+            if busy_timeout_ms is None:
+                raise
+            # Another process holds the write lock; keep the buffer (bounded) for the next flush
+            while len(self._pending) > 4 * self.flush_size:
+                self._pending.popitem(last=False)
+            if len(self._touched) > 4 * self.flush_size:
+                self._touched.clear()
+            self._retry_after = time.monotonic() + self.flush_interval
+            print(f"ℹ️ Note: Deferred embedding cache write postponed: {e}")
+        finally:
+            if busy_timeout_ms is not None:
+                self._conn.execute(f'PRAGMA busy_timeout={self.BUSY_TIMEOUT_SECONDS * 1000}')
+
+    def get_stats(self) -> Dict:
+        """Return cache size, hit/miss counters and on-disk size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'path': self.path,
+                'size': self._count + len(self._pending),
+                'max_entries': self.max_entries,
+                'pending_writes': len(self._pending),
+                'hits': self.hits,
+                'misses': self.misses,
+                'writes': self.writes,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'file_mb': round(os.path.getsize(self.path) / (1024 * 1024), 2) if os.path.exists(self.path) else 0.0
+            }
+
+
+_ttl = os.getenv('QUERY_CACHE_TTL_SECONDS')
+query_embedding_cache = QueryEmbeddingCache(
+    max_size=int(os.getenv('QUERY_CACHE_SIZE', '1024')),
+    ttl_seconds=float(_ttl) if _ttl else None
+)
+
+
+_disk_cache: Optional[DiskEmbeddingCache] = None
+_disk_cache_failed = False
+_disk_cache_lock = threading.Lock()
+
+
+def get_disk_cache() -> Optional[DiskEmbeddingCache]:
+    """Return the process-wide persistent cache, or None if disabled.
+
+    Configured with EMBEDDING_CACHE_PATH (empty disables it) and
+    EMBEDDING_CACHE_MAX_ENTRIES.
+    """
+    global _disk_cache, _disk_cache_failed
+    path = os.getenv('EMBEDDING_CACHE_PATH', './data/embedding_cache.db')
+    if not path or _disk_cache_failed:
+        return None
+    with _disk_cache_lock:
+        if _disk_cache is None and not _disk_cache_failed:
+            try:
+                _disk_cache = DiskEmbeddingCache(
+                    path, max_entries=int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', '500000'))
+                )
+                # Buffered request-path entries are written on a clean exit
+                atexit.register(_disk_cache.flush)
+            except Exception as e:
+                print(f"⚠️ Warning: Could not open embedding cache at {path}: {e}")
+                _disk_cache_failed = True
+        return _disk_cache
+
+
+def encode_texts(texts: Sequence[str], model_name: str = DEFAULT_EMBEDDING_MODEL,
+                 batch_size: int = 64, show_progress_bar: bool = False, batched: bool = False) -> np.ndarray:
+    """Encode texts as a (n, dim) float32 matrix, reusing persisted embeddings.
+
+    Only texts missing from the on-disk cache go through the model; their
+    embeddings are written back for the next run. Cache entries are keyed by
+    model and encoder backend. With batched=True (request-path encodes) the
+    missing texts join the cross-request micro-batches of the shared
+    EmbeddingBatcher instead of calling the model directly, and their cache
+    entries are buffered and written in batches off the request's critical
+    path.
+    """
+    texts = list(texts)
+    if not texts:
+        return np.zeros((0, 0), dtype='float32')
+
+    cache_key = embedding_key(model_name)
+    disk_cache = get_disk_cache()
+    cached: List[Optional[np.ndarray]] = [None] * len(texts)
+    if disk_cache:
+        try:
+            cached = disk_cache.get_many(cache_key, texts)
+        except Exception as e:
+            print(f"⚠️ Warning: Could not read embedding cache: {e}")
+    missing = [i for i, vector in enumerate(cached) if vector is None]
+
+    if missing:
+        # Encode each distinct missing text once
+        missing_texts = list(dict.fromkeys(texts[i] for i in missing))
+        batcher = get_embedding_batcher(model_name) if batched else None
+        if batcher is not None:
+            encoded = batcher.encode(missing_texts)
+        else:
+            model = get_embedding_model(model_name, track_consumer=False)
+            encoded = np.asarray(model.encode(missing_texts, batch_size=batch_size,
+                                              show_progress_bar=show_progress_bar), dtype='float32')
+        if disk_cache:
+            try:
+                disk_cache.put_many(cache_key, missing_texts, encoded, defer=batched)
+            except Exception as e:
+                print(f"⚠️ Warning: Could not write embedding cache: {e}")
+        by_text = dict(zip(missing_texts, encoded))
+        for i in missing:
+            cached[i] = by_text[texts[i]]
+
+    return np.vstack(cached).astype('float32', copy=False)
+
+
+def encode_query(text: str, model_name: str = DEFAULT_EMBEDDING_MODEL) -> np.ndarray:
+    """Encode a single query through the process-wide LRU and persistent caches.
+
+    Returns a read-only 1-D float32 vector; repeated queries skip the model
+    and the rest are micro-batched with concurrent requests.
+    """
+    cache_key = embedding_key(model_name)
+    vector = query_embedding_cache.get(cache_key, text)
+    if vector is not None:
+        return vector
+
+    embedding = encode_texts([text], model_name, batched=True)
+    return query_embedding_cache.put(cache_key, text, embedding)
@@ -0,0 +1,45 @@
+"""
+Per-request encoded message shared across semantic stages
+"""
+
+import numpy as np
+from typing import Optional
+
+from ai.model_registry import DEFAULT_EMBEDDING_MODEL
+from ai.embedding_cache import encode_query
+
+
+class EncodedMessage:
+    """A user message whose embedding is computed at most once per request.
+
+    Create one per chat turn and pass it to every stage that needs the
+    message embedding (intent classification, RAG search, ...). The vector is
+    encoded lazily on first access, so turns that never reach a semantic
+    stage pay nothing.
+    """
+
+    def __init__(self, text: str, model_name: str = DEFAULT_EMBEDDING_MODEL):
+        """Wrap a message for lazy, single encoding."""
+        self.text = text
+        self.model_name = model_name
+        self._vector: Optional[np.ndarray] = None
+
+    @property
+    def vector(self) -> np.ndarray:
+        """1-D float32 embedding of the message (read-only, may be cached)."""
+        if self._vector is None:
+            self._vector = encode_query(self.text, self.model_name)
+        return self._vector
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Embedding as a (1, dim) float32 matrix, ready for FAISS search."""
+        return self.vector.reshape(1, -1)
+
+    def is_encoded(self) -> bool:
+        """Check if the embedding has already been computed."""
+        return self._vector is not None
+
+    def matches(self, model_name: str) -> bool:
+        """Check if this embedding can be reused by a stage using model_name."""
+        return self.model_name == model_name
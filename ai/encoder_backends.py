@@ -0,0 +1,294 @@
+"""
+Pluggable CPU inference backends for the sentence embedding model
+"""
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import warnings
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Torch backends need sentence-transformers; ONNX backends only need these two at runtime
+try:
+    import onnxruntime
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
+    onnxruntime = None
+
+try:
+    from transformers import AutoTokenizer
+    TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    TRANSFORMERS_AVAILABLE = False
+    AutoTokenizer = None
+
+# 'torch' is the full-precision SentenceTransformer (the reference);
+# 'torch-int8' quantizes its Linear layers dynamically to int8;
+# 'onnx' / 'onnx-int8' run an exported graph (fp32 / int8 weights) in ONNX Runtime
+ENCODER_BACKENDS = ('torch', 'torch-int8', 'onnx', 'onnx-int8')
+DEFAULT_ENCODER_BACKEND = os.getenv('EMBEDDING_BACKEND', 'torch')
+
+
+def backend_available(backend: str) -> bool:
+    """Check if a backend's runtime dependencies are installed (without loading anything)."""
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend '{backend}', expected one of {ENCODER_BACKENDS}")
+    if backend.startswith('onnx'):
+        return ONNXRUNTIME_AVAILABLE and TRANSFORMERS_AVAILABLE
+    return True
+
+
+def resolve_backend(backend: Optional[str] = None) -> str:
+    """The backend that will actually run: the configured one, or 'torch' if it is unavailable."""
+    backend = backend or DEFAULT_ENCODER_BACKEND
+    if backend_available(backend):
+        return backend
+    print(f"ℹ️ Note: encoder backend '{backend}' needs onnxruntime and transformers; using 'torch'")
+    return 'torch'
+
+
+def _load_sentence_transformer(model_name: str):
+    """Load the reference SentenceTransformer on CPU."""
+    from sentence_transformers import SentenceTransformer
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return SentenceTransformer(model_name, device='cpu')
+
+
+def _state_dict_bytes(model) -> int:
+    """Serialized size of a torch module's weights (counts packed int8 weights too)."""
+    import torch
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def load_torch_int8(model_name: str):
+    """Reference model with every Linear layer dynamically quantized to int8.
+
+    Weights are stored as int8 and activations are quantized on the fly, so
+    no calibration data is needed; the attention and feed-forward matmuls,
+    which dominate MiniLM's CPU time, run as int8 GEMMs.
+    """
+    import torch
+    model = _load_sentence_transformer(model_name)
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class OnnxEncoder:
+    """SentenceTransformer-compatible encode() over an exported ONNX graph.
+
+    The transformer runs in ONNX Runtime; pooling and normalization (read
+    from the original model's modules at export time) are done in NumPy, so
+    serving needs neither torch nor sentence-transformers once exported.
+    """
+
+    CONFIG_FILE = "encoder.json"
+
+    def __init__(self, export_dir: str, quantized: bool = False):
+        """Open an exported model (see export_onnx)."""
+        with open(os.path.join(export_dir, self.CONFIG_FILE), 'r', encoding='utf-8') as f:
+            self.config = json.load(f)
+        model_file = self.config['int8_file' if quantized else 'model_file']
+        self.model_path = os.path.join(export_dir, model_file)
+        self.tokenizer = AutoTokenizer.from_pretrained(export_dir)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(self.model_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.max_seq_length = self.config['max_seq_length']
+
+    @property
+    def size_bytes(self) -> int:
+        return os.path.getsize(self.model_path)
+
+    def _pool(self, hidden: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        """Apply the original model's pooling (and normalization) to token embeddings."""
+        mode = self.config['pooling']
+        if mode == 'cls':
+            pooled = hidden[:, 0]
+        elif mode == 'max':
+            masked = np.where(attention_mask[..., None] > 0, hidden, -1e9)
+            pooled = masked.max(axis=1)
+        else:
+            mask = attention_mask[..., None].astype('float32')
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.config['normalize']:
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype('float32')
+
+    def encode(self, sentences, batch_size: int = 32, show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        """Encode one text or a list of texts like SentenceTransformer.encode."""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            tokens = self.tokenizer(texts[start:start + batch_size], padding=True, truncation=True,
+                                    max_length=self.max_seq_length, return_tensors='np')
+            feeds = {name: tokens[name].astype('int64') for name in self.input_names}
+            hidden = self.session.run(None, feeds)[0]
+            batches.append(self._pool(hidden, tokens['attention_mask']))
+        embeddings = np.vstack(batches) if batches else np.zeros((0, 0), dtype='float32')
+        return embeddings[0] if single else embeddings
+
+
+def onnx_export_dir(model_name: str) -> str:
+    """Where the ONNX export of model_name is kept (EMBEDDING_ONNX_DIR)."""
+    root = os.getenv('EMBEDDING_ONNX_DIR', './data/onnx')
+    return os.path.join(root, model_name.replace('/', '__'))
+
+
+def export_onnx(model_name: str, export_dir: Optional[str] = None) -> str:
+    """Export model_name's transformer to ONNX (fp32 and int8) once; return the directory.
+
+    Needs torch and sentence-transformers; later processes only load the
+    files. Each call writes to its own temporary directory and renames the
+    files into place, so concurrent workers never read or clobber a
+    partial export.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    export_dir = export_dir or onnx_export_dir(model_name)
+    if os.path.exists(os.path.join(export_dir, OnnxEncoder.CONFIG_FILE)):
+        return export_dir
+    os.makedirs(export_dir, exist_ok=True)
+
+    model = _load_sentence_transformer(model_name)
+    transformer = model[0].auto_model.eval()
+    tokenizer = model.tokenizer
+    sample = tokenizer(["export sample"], return_tensors='pt')
+    # Positional order of BERT-style forward(input_ids, attention_mask, token_type_ids)
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names + ['last_hidden_state']}
+
+    # Each process exports into its own staging directory and renames the
+    # finished files into place, the config last
+    staging = tempfile.mkdtemp(prefix='.export-', dir=export_dir)
+    try:
+        model_path = os.path.join(staging, "model.onnx")
+        int8_path = os.path.join(staging, "model-int8.onnx")
+        with torch.no_grad():
+            torch.onnx.export(transformer, tuple(sample[name] for name in input_names), model_path,
+                              input_names=input_names, output_names=['last_hidden_state'],
+                              dynamic_axes=dynamic_axes, opset_version=17, dynamo=False)
+        quantize_dynamic(model_path, int8_path, weight_type=QuantType.QInt8)
+        tokenizer.save_pretrained(staging)
+
+        pooling = model[1].get_pooling_mode_str() if len(model) > 1 else 'mean'
+        config = {
+            'model_name': model_name,
+            'model_file': os.path.basename(model_path),
+            'int8_file': os.path.basename(int8_path),
+            'max_seq_length': model.max_seq_length,
+            'pooling': pooling if pooling in ('cls', 'max') else 'mean',
+            'normalize': any(type(module).__name__ == 'Normalize' for module in model)
+        }
+        with open(os.path.join(staging, OnnxEncoder.CONFIG_FILE), 'w', encoding='utf-8') as f:
+            json.dump(config, f, indent=2)
+        for name in sorted(os.listdir(staging), key=lambda name: name == OnnxEncoder.CONFIG_FILE):
+            os.replace(os.path.join(staging, name), os.path.join(export_dir, name))
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    print(f"📦 Exported '{model_name}' to ONNX in {export_dir}")
+    return export_dir
+
+
+def load_encoder(model_name: str, backend: str) -> Tuple[object, int]:
+    """Load model_name with a backend; return (encoder, weight bytes).
+
+    Every encoder has a SentenceTransformer-compatible encode().
+    """
+    if backend == 'torch':
+        model = _load_sentence_transformer(model_name)
+        size = sum(p.numel() * p.element_size() for p in model.parameters())
+    elif backend == 'torch-int8':
+        model = load_torch_int8(model_name)
+        size = _state_dict_bytes(model)
+    elif backend in ('onnx', 'onnx-int8'):
+        model = OnnxEncoder(export_onnx(model_name), quantized=backend == 'onnx-int8')
+        size = model.size_bytes
+    else:
+        raise ValueError(f"Unknown encoder backend '{backend}', expected one of {ENCODER_BACKENDS}")
+    return model, size
+
+
+def _timed(encode, texts: Sequence[str], batch_size: int, repeats: int) -> Tuple[np.ndarray, float]:
+    """Run encode repeats times after a warm-up; return the embeddings and the best time."""
+    embeddings = np.asarray(encode(list(texts), batch_size=batch_size), dtype='float32')
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        encode(list(texts), batch_size=batch_size)
+        best = min(best, time.perf_counter() - start)
+    return embeddings, best
+
+
+def compare_encoders(model_name: str, texts: Sequence[str], backends: Sequence[str] = ENCODER_BACKENDS,
+                     batch_size: int = 32, repeats: int = 3, queries: int = 50) -> Dict[str, Dict]:
+    """Parity and latency of each backend against the full-precision 'torch' reference.
+
+    Parity: per-text cosine similarity between the backend's and the
+    reference embedding (mean and worst), and how often each text's nearest
+    neighbour among texts is unchanged. Latency: best-of-repeats wall time
+    for encoding texts in batches and for queries single-text encodes.
+    Raises RuntimeError if the 'torch' reference cannot be loaded, since no
+    other backend can stand in for it.
+    """
+    def normalize(matrix: np.ndarray) -> np.ndarray:
+        return matrix / np.clip(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12, None)
+
+    def nearest(matrix: np.ndarray) -> np.ndarray:
+        similarities = matrix @ matrix.T
+        np.fill_diagonal(similarities, -np.inf)
+        return similarities.argmax(axis=1)
+
+    texts = list(texts)
+    single = texts[:queries]
+    report: Dict[str, Dict] = {}
+    reference: Optional[np.ndarray] = None
+    for backend in ['torch'] + [b for b in backends if b != 'torch']:
+        if not backend_available(backend):
+            report[backend] = {'error': 'backend dependencies not installed'}
+        else:
+            try:
+                encoder, size = load_encoder(model_name, backend)
+            except Exception as e:
+                report[backend] = {'error': str(e)}
+        if backend in report:
+            if backend == 'torch':
+                raise RuntimeError(f"The 'torch' reference backend is unavailable ({report[backend]['error']}); "
+                                   f"parity cannot be measured without it")
+            continue
+        embeddings, batch_seconds = _timed(encoder.encode, texts, batch_size, repeats)
+        single_seconds = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for text in single:
+                encoder.encode([text])
+            single_seconds = min(single_seconds, time.perf_counter() - start)
+
+        embeddings = normalize(embeddings)
+        if backend == 'torch':
+            reference = embeddings
+        cosines = np.sum(embeddings * reference, axis=1)
+        report[backend] = {
+            'size_mb': round(size / (1024 * 1024), 1),
+            'batch_ms_per_text': round(1000 * batch_seconds / len(texts), 3),
+            'query_ms': round(1000 * single_seconds / len(single), 3),
+            'cosine_mean': round(float(cosines.mean()), 5),
+            'cosine_min': round(float(cosines.min()), 5),
+            'nearest_neighbour_agreement': round(float(np.mean(nearest(embeddings) == nearest(reference))), 4)
+        }
+    base = report['torch']
+    for stats in report.values():
+        if 'error' not in stats:
+            stats['batch_speedup'] = round(base['batch_ms_per_text'] / stats['batch_ms_per_text'], 2)
+            stats['query_speedup'] = round(base['query_ms'] / stats['query_ms'], 2)
+    return report
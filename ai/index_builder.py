@@ -0,0 +1,296 @@
+"""
+Streaming, checkpointed index builder for the RAG engine
+"""
+
+import json
+import os
+import shutil
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import faiss
+
+from ai.chunk_store import ChunkStore, ChunkStoreWriter
+from ai.embedding_cache import encode_texts
+from ai.model_registry import embedding_key
+from ai.lexical_index import BM25Builder
+from ai.vector_store import VectorStore
+
+
+class StreamingIndexBuilder:
+    """Build a RAG index file by file with bounded memory.
+
+    Chunks are appended to the chunk store as they arrive, embedded in
+    fixed-size batches and added to the FAISS index, so memory holds at most
+    one batch of texts (plus the IVF training sample) regardless of corpus
+    size. Everything is written to a staging directory and checkpointed
+    every checkpoint_every chunks; an interrupted build resumes from the
+    last checkpoint. finish() moves the finished files into vector_db_path.
+
+    With a deduplicator (NearDuplicateFilter), chunks that repeat one already
+    in the build are dropped before they are stored or embedded; its hashes
+    and signatures are kept in an SQLite file in the staging directory,
+    registered at their chunk ids, and finish() installs that file as
+    vector_db_path/DEDUP_FILE for later incremental updates. A
+    BM25 inverted index over the same chunk ids is built alongside the
+    vectors; its postings are spilled to the staging directory at every
+    checkpoint and merged by finish(). What stays in memory across
+    checkpoints is the BM25 vocabulary (O(distinct terms)) and the file map
+    (a few bytes per chunk id).
+
+    With quantization ('sq8' or 'pq') the index holds compressed codes and
+    the full-precision vectors are appended to a VectorStore for re-ranking;
+    like IVF, quantized indexes are trained on the first ivf_train_size
+    vectors before anything is added.
+    """
+
+    STAGING_DIR = ".staging"
+    CHECKPOINT_FILE = "checkpoint.json"
+    BM25_SPILL_DIR = "bm25_runs"
+    DEDUP_FILE = "dedup.sqlite"
+
+    def __init__(self, rag_engine, index_type: str = 'flat', batch_size: int = 256,
+                 checkpoint_every: int = 2048, nlist: Optional[int] = None,
+                 hnsw_m: int = 32, ivf_train_size: int = 10000, resume: bool = True,
+                 deduplicator=None, quantization: str = 'none', pq_m: Optional[int] = None):
+        """Prepare a staging area, resuming a matching checkpoint if present."""
+        self.rag_engine = rag_engine
+        self.index_type = index_type
+        self.batch_size = batch_size
+        self.checkpoint_every = checkpoint_every
+        self.nlist = nlist
+        self.hnsw_m = hnsw_m
+        self.quantization = quantization
+        self.pq_m = pq_m
+        self.ivf_train_size = ivf_train_size
+        self.deduplicator = deduplicator
+        self.staging_path = os.path.join(rag_engine.vector_db_path, self.STAGING_DIR)
+
+        self.index = None
+        self.index_meta: Dict = {}
+        # Completed files: rel_path -> {'sha256', 'chunk_ids'}
+        self.files: Dict[str, Dict] = {}
+        self._pending_ids: List[int] = []
+        self._pending_texts: List[str] = []
+        self._train_ids: List[np.ndarray] = []
+        self._train_vectors: List[np.ndarray] = []
+        self._since_checkpoint = 0
+        self.lexical = BM25Builder(spill_dir=os.path.join(self.staging_path, self.BM25_SPILL_DIR))
+
+        checkpoint = self._load_checkpoint() if resume else None
+        if checkpoint is None:
+            shutil.rmtree(self.staging_path, ignore_errors=True)
+            os.makedirs(self.staging_path, exist_ok=True)
+            self.chunks = ChunkStoreWriter(self.staging_path)
+            self.metadata = ChunkStoreWriter(self.staging_path, name=ChunkStore.METADATA_NAME)
+            if self.deduplicator is not None:
+                self.deduplicator.persist(os.path.join(self.staging_path, self.DEDUP_FILE))
+        else:
+            self.index = faiss.read_index(os.path.join(self.staging_path, "index.faiss"))
+            self.index_meta = checkpoint['index_meta']
+            self.files = checkpoint['files']
+            self.chunks = ChunkStoreWriter(self.staging_path, keep=checkpoint['count'])
+            self.metadata = ChunkStoreWriter(self.staging_path, keep=checkpoint['count'],
+                                             name=ChunkStore.METADATA_NAME)
+            if self.quantization != 'none':
+                VectorStore.truncate(self.staging_path, self.index_meta['dimension'], checkpoint['count'])
+            print(f"↩️ Resuming ingest from checkpoint: {len(self.files)} files, "
+                  f"{checkpoint['count']} chunks already indexed")
+            # Spilled postings and the dedup database are cut back to the checkpoint
+            restore_lexical = 'bm25_runs' not in checkpoint or not self.lexical.restore(
+                checkpoint['bm25_runs'], checkpoint['bm25_terms'])
+            restore_dedup = False
+            if self.deduplicator is not None:
+                keep = checkpoint.get('dedup_registered')
+                restored = self.deduplicator.persist(os.path.join(self.staging_path, self.DEDUP_FILE), keep=keep)
+                restore_dedup = keep is None or not restored
+            if restore_lexical or restore_dedup:
+                self._restore_staged_chunks(restore_lexical, restore_dedup)
+
+    def _restore_staged_chunks(self, lexical: bool, dedup: bool):
+        """Re-register chunks restored from a checkpoint whose spilled state was missing."""
+        self.chunks.flush()
+        store = ChunkStore(self.staging_path)
+        try:
+            for rel_path, entry in self.files.items():
+                for chunk_id in entry['chunk_ids']:
+                    text = store[chunk_id]
+                    if lexical:
+                        self.lexical.add(chunk_id, text)
+                    if dedup:
+                        self.deduplicator.add(text, rel_path)
+        finally:
+            store.close()
+
+    def _load_checkpoint(self) -> Optional[Dict]:
+        """Return a checkpoint compatible with this build, or None."""
+        checkpoint_path = os.path.join(self.staging_path, self.CHECKPOINT_FILE)
+        if not os.path.exists(checkpoint_path):
+            return None
+        try:
+            with open(checkpoint_path, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        except Exception as e:
+            print(f"⚠️ Ignoring unreadable ingest checkpoint: {e}")
+            return None
+        meta = checkpoint.get('index_meta', {})
+        if (meta.get('index_type') != self.index_type or
+                meta.get('quantization', 'none') != self.quantization or
+                meta.get('model_name') != self.rag_engine.model_name or
+                meta.get('encoder', self.rag_engine.model_name) != embedding_key(self.rag_engine.model_name)):
+            print("ℹ️ Ingest checkpoint was made with different settings; starting over")
+            return None
+        return checkpoint
+
+    @property
+    def completed_files(self) -> Dict[str, Dict]:
+        """Files already indexed (from a resumed checkpoint or this run)."""
+        return self.files
+
+    def add_file(self, rel_path: str, sha256: Optional[str], chunks: List[str],
+                 metadata: Optional[List[Dict]] = None):
+        """Stream one file's chunks (and optional per-chunk metadata) into the store and index."""
+        if metadata is None:
+            metadata = [{} for _ in chunks]
+        duplicate_of = set()
+        if self.deduplicator is not None:
+            kept, duplicate_of = self.deduplicator.filter(chunks, rel_path)
+            chunks = [chunks[i] for i in kept]
+            metadata = [metadata[i] for i in kept]
+        chunk_ids = list(self.chunks.append(chunks))
+        self.lexical.add_many(zip(chunk_ids, chunks))
+        self.metadata.append(json.dumps(entry) for entry in metadata)
+        self._pending_ids.extend(chunk_ids)
+        self._pending_texts.extend(chunks)
+        while len(self._pending_texts) >= self.batch_size:
+            self._embed_batch(self.batch_size)
+
+        self.files[rel_path] = {'sha256': sha256, 'chunk_ids': chunk_ids}
+        if duplicate_of:
+            # Files whose chunks stand in for this one's dropped duplicates
+            self.files[rel_path]['duplicates_of'] = sorted(duplicate_of)
+        self._since_checkpoint += len(chunks)
+        if self._since_checkpoint >= self.checkpoint_every:
+            self.checkpoint()
+
+    def _embed_batch(self, size: int):
+        """Embed the first size pending chunks and add them to the index."""
+        texts = self._pending_texts[:size]
+        ids = np.asarray(self._pending_ids[:size], dtype='int64')
+        del self._pending_texts[:size]
+        del self._pending_ids[:size]
+
+        embeddings = self.rag_engine._normalize(encode_texts(texts, self.rag_engine.model_name))
+        if self.quantization != 'none':
+            # Pending chunks are embedded in id order, so row i is chunk i
+            VectorStore.append(self.staging_path, embeddings)
+        if self.index is None:
+            self.index, self.index_meta = self._create_index(embeddings.shape[1], self.ivf_train_size)
+
+        if not self.index.is_trained:
+            # IVF / quantizers: collect a bounded training sample before adding anything
+            self._train_ids.append(ids)
+            self._train_vectors.append(embeddings)
+            if sum(len(v) for v in self._train_vectors) >= self.ivf_train_size:
+                self._train_index()
+            return
+        self._add(embeddings, ids)
+
+    def _create_index(self, dimension: int, num_vectors: int):
+        """Create an empty index for this build's settings."""
+        index, index_meta = self.rag_engine._create_index(
+            dimension, num_vectors, self.index_type, nlist=self.nlist, hnsw_m=self.hnsw_m,
+            quantization=self.quantization, pq_m=self.pq_m
+        )
+        index_meta['model_name'] = self.rag_engine.model_name
+        index_meta['encoder'] = embedding_key(self.rag_engine.model_name)
+        return index, index_meta
+
+    def _train_index(self):
+        """Train the IVF / vector quantizer on the collected sample, then index it."""
+        vectors = np.vstack(self._train_vectors)
+        ids = np.concatenate(self._train_ids)
+        self._train_vectors, self._train_ids = [], []
+
+        # Re-size the coarse quantizer / PQ codebooks to the sample actually collected
+        self.index, self.index_meta = self._create_index(vectors.shape[1], len(vectors))
+        self.index.train(vectors)
+        self._add(vectors, ids)
+
+    def _add(self, embeddings: np.ndarray, ids: np.ndarray):
+        """Add vectors under their chunk ids."""
+        if self.index_type == 'hnsw':
+            # HNSW has no add_with_ids; sequential ids equal chunk ids
+            self.index.add(embeddings)
+        else:
+            self.index.add_with_ids(embeddings, ids)
+
+    def _flush_pending(self):
+        """Embed every pending chunk (and train IVF on what was collected)."""
+        while self._pending_texts:
+            self._embed_batch(self.batch_size)
+        if self._train_vectors:
+            self._train_index()
+
+    def checkpoint(self):
+        """Persist chunk store, index and progress so the build can resume."""
+        needs_training = self.index_type == 'ivf' or self.quantization != 'none'
+        if needs_training and (self.index is None or not self.index.is_trained):
+            # Still collecting the training sample; nothing durable to save yet
+            return
+        self._flush_pending()
+        self._since_checkpoint = 0
+        if self.index is None:
+            return
+
+        self.chunks.flush()
+        self.metadata.flush()
+        index_path = os.path.join(self.staging_path, "index.faiss")
+        faiss.write_index(self.index, index_path + '.tmp')
+        os.replace(index_path + '.tmp', index_path)
+        self.lexical.spill()
+        checkpoint = {
+            'index_meta': self.index_meta,
+            'count': len(self.chunks),
+            'files': self.files,
+            'bm25_runs': self.lexical.num_runs,
+            'bm25_terms': self.lexical.num_terms
+        }
+        if self.deduplicator is not None:
+            self.deduplicator.commit()
+            checkpoint['dedup_registered'] = self.deduplicator.registered
+
+        checkpoint_path = os.path.join(self.staging_path, self.CHECKPOINT_FILE)
+        with open(checkpoint_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+        os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+    def finish(self) -> Dict[str, Dict]:
+        """Finalize the build, install it in vector_db_path and return the file map."""
+        self._flush_pending()
+        self.chunks.close()
+        self.metadata.close()
+        if self.index is None:
+            if self.deduplicator is not None:
+                self.deduplicator.close()
+            shutil.rmtree(self.staging_path, ignore_errors=True)
+            return {}
+
+        self.index_meta['supports_updates'] = self.index_type != 'hnsw'
+        self.index_meta['count'] = int(self.index.ntotal)
+        self.index_meta['built_at'] = time.time()
+        self.lexical.write(self.staging_path, num_ids=len(self.chunks))
+        if self.deduplicator is not None:
+            self.index_meta['dedup'] = self.deduplicator.get_stats()
+            self.deduplicator.commit(version=self.index_meta['built_at'])
+            self.deduplicator.close()
+        self.rag_engine.install_index(self.index, self.index_meta, self.staging_path)
+        dedup_path = os.path.join(self.rag_engine.vector_db_path, self.DEDUP_FILE)
+        if self.deduplicator is not None:
+            # Positions are chunk ids, so incremental updates can keep using it
+            os.replace(os.path.join(self.staging_path, self.DEDUP_FILE), dedup_path)
+        elif os.path.exists(dedup_path):
+            os.remove(dedup_path)
+        shutil.rmtree(self.staging_path, ignore_errors=True)
+        return self.files
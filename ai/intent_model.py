@@ -1,5 +1,13 @@
 """
 Enhanced Intent Classification using PyTorch (DistilBERT) + Embeddings Similarity
+
+DistilBERT is opt-in: set INTENT_CLASSIFIER_MODE=distilbert and point
+INTENT_MODEL_CHECKPOINT at a fine-tuned checkpoint. It is then loaded on the
+first request that needs it rather than at import time.
+
+A logistic intent head trained by scripts/train_intent_head.py (saved at
+INTENT_HEAD_PATH) replaces the keyword + example-similarity scoring when
+present.
 """
 
 import warnings
@@ -16,13 +24,23 @@ warnings.filterwarnings('ignore', message='.*MISSING.*')
 os.environ['TRANSFORMERS_VERBOSITY'] = 'error'
 os.environ['TOKENIZERS_PARALLELISM'] = 'false'
 
+import hashlib
+import json
+import threading
 import torch
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-from sentence_transformers import SentenceTransformer
 import numpy as np
-from typing import Optional
+from typing import Dict, List, Optional, Sequence, Tuple
 import re
 
+from ai.model_registry import get_embedding_model, embedding_key, DEFAULT_EMBEDDING_MODEL
+from ai.encoded_message import EncodedMessage
+from ai.embedding_cache import encode_query, encode_texts
+from ai.intent_head import IntentHead
+
+def _keyword_regex(words: Sequence[str]):
+    """One compiled alternation matching any of words as a substring."""
+    return re.compile('|'.join(re.escape(word) for word in words))
+
 class IntentClassifier:
     """Enhanced intent classifier using DistilBERT + embeddings similarity."""
     
@@ -83,15 +101,76 @@ class IntentClassifier:
         ]
     }
     
-    def __init__(self):
-        """Initialize the intent classifier."""
+    # Minimum softmax confidence before a DistilBERT prediction is trusted
+    DISTILBERT_MIN_CONFIDENCE = 0.5
+    
+    # Minimum calibrated confidence before a trained intent head prediction is trusted
+    HEAD_MIN_CONFIDENCE = float(os.getenv('INTENT_HEAD_MIN_CONFIDENCE', '0.5'))
+    
+    # Keyword rules (substring matches on the lowercased message)
+    GREETING_WORDS = ['hi', 'hello', 'hey', 'good morning', 'good afternoon', 'good evening',
+                      'greetings', 'hi there', 'hello there', 'hey there', 'howdy', 'sup', 'hii',
+                      'how are you', 'what\'s up', 'hey there']
+    EMERGENCY_WORDS = ['emergency', 'urgent', 'critical', 'immediate', 'help now']
+    # Same words generate_response routes to the cancellation flow
+    CANCEL_WORDS = ['cancel', 'reschedule', 'change appointment']
+    # Keywords that boost an intent's similarity score
+    PATTERN_KEYWORDS = {
+        'appointment_booking': ['book', 'appointment', 'schedule', 'reserve', 'appoint'],
+        'doctor_info': ['doctor', 'physician', 'specialist'],
+        'services': ['service', 'facility', 'department', 'offer'],
+        'location': ['address', 'location', 'where', 'located'],
+        'timings': ['timing', 'time', 'opd', 'open', 'close', 'hour'],
+        'contact': ['contact', 'phone', 'call', 'email', 'number']
+    }
+    # Fallback rules, checked in order when no model stage is confident
+    FALLBACK_KEYWORDS = [
+        ('appointment_booking', ['book', 'appointment', 'schedule', 'reserve', 'appoint']),
+        ('doctor_info', ['doctor', 'physician', 'specialist']),
+        ('services', ['service', 'facility', 'department', 'offer']),
+        ('location', ['address', 'location', 'where', 'located']),
+        ('timings', ['timing', 'time', 'opd', 'open', 'close', 'hour']),
+        ('contact', ['contact', 'phone', 'call', 'email'])
+    ]
+    SYMPTOM_KEYWORDS = ['have', 'suffering', 'feeling', 'pain', 'problem', 'issue', 'symptom', 'disease']
+    # Symptom words alongside these are a booking, not a symptom query
+    SYMPTOM_EXCLUDE_WORDS = ['appointment', 'book', 'schedule']
+    
+    # Each rule compiled once, so a message is scanned once per rule
+    _DOCTOR_RE = re.compile(r'dr\.?\s+[A-Z][a-z]+', re.IGNORECASE)
+    _DATE_RE = re.compile(r'\d{4}-\d{2}-\d{2}')
+    _TIME_RE = re.compile(r'\d{1,2}:\d{2}')
+    _GREETING_RE = _keyword_regex(GREETING_WORDS)
+    _EMERGENCY_RE = _keyword_regex(EMERGENCY_WORDS)
+    _CANCEL_RE = _keyword_regex(CANCEL_WORDS)
+    _PATTERN_RES = {intent: _keyword_regex(words) for intent, words in PATTERN_KEYWORDS.items()}
+    _FALLBACK_RES = [(intent, _keyword_regex(words)) for intent, words in FALLBACK_KEYWORDS]
+    _SYMPTOM_RE = _keyword_regex(SYMPTOM_KEYWORDS)
+    _SYMPTOM_EXCLUDE_RE = _keyword_regex(SYMPTOM_EXCLUDE_WORDS)
+    
+    def __init__(self, mode: Optional[str] = None, checkpoint: Optional[str] = None):
+        """Initialize the intent classifier.
+
+        mode is 'embedding' (default) or 'distilbert'; checkpoint is the path
+        or hub id of a fine-tuned DistilBERT model. Both fall back to the
+        INTENT_CLASSIFIER_MODE and INTENT_MODEL_CHECKPOINT env vars.
+        """
+        self.mode = (mode or os.getenv('INTENT_CLASSIFIER_MODE', 'embedding')).lower()
+        self.checkpoint = checkpoint or os.getenv('INTENT_MODEL_CHECKPOINT') or None
         self.model = None
         self.tokenizer = None
+        self.id_to_intent = {}
+        self._distilbert_lock = threading.Lock()
+        self._distilbert_attempted = False
         self.embedding_model = None
+        self.model_name = DEFAULT_EMBEDDING_MODEL
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         self.loaded = False
         self.embeddings_loaded = False
         self.intent_embeddings = {}
+        self.example_matrix = None
+        self.example_labels = None
+        self.head: Optional[IntentHead] = None
         self._load_models()
     
     def _load_models(self):
@@ -101,145 +180,371 @@ class IntentClassifier:
             # Suppress warnings during model loading
             with warnings.catch_warnings():
                 warnings.simplefilter("ignore")
-                self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+                self.embedding_model = get_embedding_model(self.model_name)
                 self.embeddings_loaded = True
                 
-                # Pre-compute embeddings for intent examples
-                for intent, examples in self.INTENT_EXAMPLES.items():
-                    self.intent_embeddings[intent] = self.embedding_model.encode(examples)
+                # Intent example embeddings, from the on-disk cache when the examples are unchanged
+                self._load_example_matrix()
                 
                 print("✅ Embedding model loaded for intent classification")
         except Exception as e:
             print(f"⚠️ Warning: Could not load embedding model: {e}")
             self.embeddings_loaded = False
         
-        # Try to load DistilBERT (optional, for future fine-tuning)
-        try:
-            model_name = "distilbert-base-uncased"
-            # Suppress warnings during model loading
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-                self.model = AutoModelForSequenceClassification.from_pretrained(
-                    model_name,
-                    num_labels=len(self.INTENTS)
-                )
-                self.model.eval()
-                self.model.to(self.device)
-                self.loaded = True
-                print("✅ DistilBERT model loaded (for future fine-tuning)")
-        except Exception as e:
-            print(f"ℹ️ Note: DistilBERT not loaded: {e}")
+        if self.embeddings_loaded:
+            self._load_head()
+        
+        if self.mode == 'distilbert' and not self.checkpoint:
+            print("ℹ️ Note: DistilBERT mode requested but INTENT_MODEL_CHECKPOINT is not set")
             print("Using enhanced keyword + embedding-based classification")
-            self.loaded = False
     
-    def _calculate_similarity(self, text: str, intent: str) -> float:
-        """Calculate similarity score between text and intent examples."""
-        if not self.embeddings_loaded or intent not in self.intent_embeddings:
-            return 0.0
+    def _distilbert_enabled(self) -> bool:
+        """Check if DistilBERT is configured (explicit mode + fine-tuned checkpoint)."""
+        return self.mode == 'distilbert' and bool(self.checkpoint)
+    
+    def _ensure_distilbert(self) -> bool:
+        """Load the fine-tuned DistilBERT checkpoint on first use."""
+        if self.loaded:
+            return True
+        if not self._distilbert_enabled():
+            return False
         
-        try:
-            text_embedding = self.embedding_model.encode([text])
-            intent_embeddings = self.intent_embeddings[intent]
-            
-            # Calculate cosine similarity
-            similarities = np.dot(intent_embeddings, text_embedding.T).flatten()
-            max_similarity = float(np.max(similarities))
+        with self._distilbert_lock:
+            # Another thread may have finished (or failed) while we waited
+            if self.loaded or self._distilbert_attempted:
+                return self.loaded
+            self._distilbert_attempted = True
             
-            return max_similarity
-        except Exception:
-            return 0.0
+            try:
+                from transformers import AutoTokenizer, AutoModelForSequenceClassification
+                
+                # Suppress warnings during model loading
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    self.tokenizer = AutoTokenizer.from_pretrained(self.checkpoint)
+                    self.model = AutoModelForSequenceClassification.from_pretrained(self.checkpoint)
+                    self.model.eval()
+                    self.model.to(self.device)
+                
+                # Prefer the checkpoint's own label names, else assume INTENTS order
+                id2label = getattr(self.model.config, 'id2label', None) or {}
+                if id2label and all(label in self.INTENTS for label in id2label.values()):
+                    self.id_to_intent = {int(i): label for i, label in id2label.items()}
+                else:
+                    self.id_to_intent = dict(enumerate(self.INTENTS))
+                
+                self.loaded = True
+                print(f"✅ DistilBERT intent model loaded from {self.checkpoint}")
+            except Exception as e:
+                print(f"ℹ️ Note: DistilBERT not loaded: {e}")
+                print("Using enhanced keyword + embedding-based classification")
+                self.model = None
+                self.tokenizer = None
+                self.loaded = False
+        
+        return self.loaded
     
-    def classify(self, text: str, conversation_context: Optional[str] = None) -> str:
-        """Classify user intent with enhanced ML-based approach."""
-        text_lower = text.lower().strip()
+    def _classify_with_distilbert(self, text: str) -> Tuple[Optional[str], float]:
+        """Predict intent and confidence with the fine-tuned model (None if unsure/unavailable)."""
+        return self._classify_with_distilbert_batch([text])[0]
+    
+    def _classify_with_distilbert_batch(self, texts: Sequence[str],
+                                        batch_size: int = 64) -> List[Tuple[Optional[str], float]]:
+        """Predict (intent, confidence) for each text in padded batches (None where unsure/unavailable)."""
+        if not self._ensure_distilbert():
+            return [(None, 0.0)] * len(texts)
         
-        # Combine with conversation context if available
-        if conversation_context:
-            full_text = f"{conversation_context} {text_lower}"
-        else:
-            full_text = text_lower
+        predictions: List[Tuple[Optional[str], float]] = []
+        for start in range(0, len(texts), batch_size):
+            batch = list(texts[start:start + batch_size])
+            try:
+                inputs = self.tokenizer(batch, return_tensors='pt', padding=True, truncation=True, max_length=128)
+                inputs = {key: value.to(self.device) for key, value in inputs.items()}
+                with torch.no_grad():
+                    logits = self.model(**inputs).logits
+                confidences, label_ids = torch.max(torch.softmax(logits, dim=-1), dim=-1)
+                for confidence, label_id in zip(confidences.tolist(), label_ids.tolist()):
+                    if confidence < self.DISTILBERT_MIN_CONFIDENCE:
+                        predictions.append((None, 0.0))
+                    else:
+                        predictions.append((self.id_to_intent.get(int(label_id)), float(confidence)))
+            except Exception as e:
+                print(f"DistilBERT classification error: {e}")
+                predictions.extend([(None, 0.0)] * len(batch))
+        return predictions
+    
+    def _load_head(self):
+        """Load the trained intent head from INTENT_HEAD_PATH if it matches the encoder."""
+        head_path = os.getenv('INTENT_HEAD_PATH', './models/intent_head.npz')
+        if not head_path or not os.path.exists(head_path):
+            return
+        try:
+            head = IntentHead.load(head_path)
+        except Exception as e:
+            print(f"⚠️ Warning: Could not load intent head: {e}")
+            return
         
-        # Pattern-based detection (fast, high confidence)
-        has_doctor = bool(re.search(r'dr\.?\s+[A-Z][a-z]+', text, re.IGNORECASE))
-        has_date = bool(re.search(r'\d{4}-\d{2}-\d{2}', text))
-        has_time = bool(re.search(r'\d{1,2}:\d{2}', text))
+        encoder = embedding_key(self.model_name)
+        if head.encoder != encoder:
+            print(f"⚠️ Warning: Intent head was trained with '{head.encoder}' but the encoder is "
+                  f"'{encoder}'; retrain it with scripts/train_intent_head.py. Using keyword + similarity scoring")
+            return
+        unknown = [intent for intent in head.intents if intent not in self.INTENTS]
+        if unknown:
+            print(f"⚠️ Warning: Intent head predicts unknown intents {unknown}; ignoring it")
+            return
+        missing = [intent for intent in self.INTENTS if intent not in head.intents]
+        if missing:
+            print(f"⚠️ Warning: Intent head was trained without {missing}; messages of those intents "
+                  f"will be misclassified unless a rule catches them first")
+        self.head = head
+        print(f"✅ Intent head loaded from {head_path} ({len(head.intents)} intents, "
+              f"temperature {head.temperature:.2f})")
+    
+    def _example_cache_path(self) -> Optional[str]:
+        """File caching the example matrix for this model and example set (None if disabled).
+
+        The name hashes the embedding key (model + encoder backend) and every
+        example, so editing INTENT_EXAMPLES or switching models picks a new
+        file. Configured with INTENT_CACHE_DIR (empty disables it).
+        """
+        cache_dir = os.getenv('INTENT_CACHE_DIR', './data/intent_cache')
+        if not cache_dir:
+            return None
+        digest = hashlib.sha256(json.dumps({
+            'model': embedding_key(self.model_name),
+            'examples': [[intent, self.INTENT_EXAMPLES[intent]] for intent in self.INTENTS
+                         if intent in self.INTENT_EXAMPLES]
+        }).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(cache_dir, f"intent_examples_{digest}.npy")
+    
+    def _load_example_matrix(self):
+        """Load (or encode and cache) all example embeddings as one matrix with a label vector.
+
+        A cached matrix is memory-mapped in a single read, so workers skip
+        encoding the examples at startup; it is regenerated only when the
+        examples or the model change.
+        """
+        intents = [intent for intent in self.INTENTS if intent in self.INTENT_EXAMPLES]
+        examples = [example for intent in intents for example in self.INTENT_EXAMPLES[intent]]
+        labels = [self.INTENTS.index(intent) for intent in intents for _ in self.INTENT_EXAMPLES[intent]]
         
-        if has_doctor and has_date and has_time:
+        matrix = None
+        cache_path = self._example_cache_path()
+        if cache_path and os.path.exists(cache_path):
+            try:
+                matrix = np.load(cache_path, mmap_mode='r')
+                if matrix.shape[0] != len(examples):
+                    matrix = None
+            except Exception as e:
+                print(f"⚠️ Warning: Ignoring unreadable intent example cache: {e}")
+                matrix = None
+        if matrix is None:
+            # One batched encode for every example
+            matrix = np.asarray(self.embedding_model.encode(examples), dtype='float32')
+            if cache_path:
+                try:
+                    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                    with open(cache_path + '.tmp', 'wb') as f:
+                        np.save(f, matrix)
+                    os.replace(cache_path + '.tmp', cache_path)
+                except Exception as e:
+                    print(f"⚠️ Warning: Could not write intent example cache: {e}")
+        
+        self.example_matrix = matrix
+        self.example_labels = np.asarray(labels, dtype=np.int64)
+        start = 0
+        for intent in intents:
+            end = start + len(self.INTENT_EXAMPLES[intent])
+            self.intent_embeddings[intent] = matrix[start:end]
+            start = end
+    
+    def _embed(self, text: str, encoded: Optional[EncodedMessage] = None) -> np.ndarray:
+        """Message embedding, reusing the request's EncodedMessage when it matches the model."""
+        if encoded is not None and encoded.matches(self.model_name):
+            return encoded.vector
+        return encode_query(text, self.model_name)
+    
+    def predict_confidences(self, text: str, encoded: Optional[EncodedMessage] = None) -> Dict[str, float]:
+        """Calibrated probability of each intent from the trained head (empty without one)."""
+        if self.head is None:
+            return {}
+        probs = self.head.predict_proba(self._embed(text, encoded))
+        return {intent: float(prob) for intent, prob in zip(self.head.intents, probs)}
+    
+    def _similarity_scores(self, embeddings: np.ndarray) -> np.ndarray:
+        """Max example similarity per intent for a (n, dim) batch; intents without examples score 0.0."""
+        similarities = np.asarray(embeddings, dtype='float32') @ self.example_matrix.T
+        scores = np.zeros((len(similarities), len(self.INTENTS)), dtype='float32')
+        for label in np.unique(self.example_labels):
+            scores[:, label] = similarities[:, self.example_labels == label].max(axis=1)
+        return scores
+    
+    def _calculate_similarities(self, text: str, encoded: Optional[EncodedMessage] = None) -> np.ndarray:
+        """Score text against every intent at once (max similarity per intent)."""
+        if not self.embeddings_loaded or self.example_matrix is None:
+            return np.zeros(len(self.INTENTS), dtype='float32')
+        
+        try:
+            # Single encode + single matrix product against all examples
+            return self._similarity_scores(self._embed(text, encoded).reshape(1, -1))[0]
+        except Exception:
+            return np.zeros(len(self.INTENTS), dtype='float32')
+    
+    def _pattern_scores(self, text_lower: str) -> np.ndarray:
+        """1.0 for each intent whose boost keywords occur in the message, else 0.0."""
+        scores = np.zeros(len(self.INTENTS))
+        for index, intent in enumerate(self.INTENTS):
+            pattern = self._PATTERN_RES.get(intent)
+            if pattern is not None and pattern.search(text_lower):
+                scores[index] = 1.0
+        return scores
+    
+    def _rule_intent(self, text: str, text_lower: str) -> Optional[str]:
+        """High-priority rules: complete booking request, greeting, emergency, cancellation (None if none fire)."""
+        # Doctor + date + time is a complete booking request
+        if self._DOCTOR_RE.search(text) and self._DATE_RE.search(text) and self._TIME_RE.search(text):
             return 'appointment_booking'
         
         # Greeting detection (check first, high priority)
-        greeting_words = ['hi', 'hello', 'hey', 'good morning', 'good afternoon', 'good evening', 
-                         'greetings', 'hi there', 'hello there', 'hey there', 'howdy', 'sup', 'hii',
-                         'how are you', 'what\'s up', 'hey there']
-        if any(word in text_lower for word in greeting_words) or text_lower in greeting_words:
+        if self._GREETING_RE.search(text_lower):
             return 'greeting'
         
         # Emergency detection (high priority)
-        if any(word in text_lower for word in ['emergency', 'urgent', 'critical', 'immediate', 'help now']):
+        if self._EMERGENCY_RE.search(text_lower):
             return 'emergency'
         
-        # Use embedding similarity for better classification
-        if self.embeddings_loaded:
-            intent_scores = {}
-            for intent in self.INTENTS:
-                # Combine pattern matching and similarity
-                pattern_score = 0.0
-                similarity_score = self._calculate_similarity(text, intent)
-                
-                # Pattern matching boost
-                if intent == 'appointment_booking':
-                    pattern_score = 1.0 if any(word in text_lower for word in ['book', 'appointment', 'schedule', 'reserve', 'appoint']) else 0.0
-                elif intent == 'doctor_info':
-                    pattern_score = 1.0 if any(word in text_lower for word in ['doctor', 'physician', 'specialist']) else 0.0
-                elif intent == 'services':
-                    pattern_score = 1.0 if any(word in text_lower for word in ['service', 'facility', 'department', 'offer']) else 0.0
-                elif intent == 'location':
-                    pattern_score = 1.0 if any(word in text_lower for word in ['address', 'location', 'where', 'located']) else 0.0
-                elif intent == 'timings':
-                    pattern_score = 1.0 if any(word in text_lower for word in ['timing', 'time', 'opd', 'open', 'close', 'hour']) else 0.0
-                elif intent == 'contact':
-                    pattern_score = 1.0 if any(word in text_lower for word in ['contact', 'phone', 'call', 'email', 'number']) else 0.0
-                
-                # Combined score (pattern has higher weight)
-                intent_scores[intent] = (pattern_score * 0.7) + (similarity_score * 0.3)
-            
-            # Get intent with highest score
-            best_intent = max(intent_scores, key=intent_scores.get)
-            best_score = intent_scores[best_intent]
-            
-            # Only use ML result if confidence is high enough
-            if best_score > 0.3:
-                return best_intent
+        # Cancellation, ahead of every model stage (a booking look-alike otherwise)
+        if self._CANCEL_RE.search(text_lower):
+            return 'cancel_appointment'
+        return None
+    
+    def _keyword_fallback(self, text_lower: str) -> Tuple[str, float]:
+        """Keyword rules used when no model stage is confident; FAQ if nothing matches."""
+        for intent, pattern in self._FALLBACK_RES:
+            if pattern.search(text_lower):
+                return intent, 1.0
         
-        # Fallback to keyword-based classification
-        if any(word in text_lower for word in ['book', 'appointment', 'schedule', 'reserve', 'appoint']):
-            return 'appointment_booking'
+        # Symptom query detection (not just appointment booking)
+        if self._SYMPTOM_RE.search(text_lower) and not self._SYMPTOM_EXCLUDE_RE.search(text_lower):
+            return 'symptom_query', 1.0
         
-        if any(word in text_lower for word in ['doctor', 'physician', 'specialist']):
-            return 'doctor_info'
+        # Default to FAQ
+        return 'faq', 0.0
+    
+    def classify(self, text: str, conversation_context: Optional[str] = None,
+                 encoded: Optional[EncodedMessage] = None) -> str:
+        """Classify user intent with enhanced ML-based approach.
+
+        Pass the request's EncodedMessage to reuse its embedding instead of
+        encoding the text again.
+        """
+        return self.classify_with_confidence(text, conversation_context, encoded)[0]
+    
+    def classify_with_confidence(self, text: str, conversation_context: Optional[str] = None,
+                                 encoded: Optional[EncodedMessage] = None) -> Tuple[str, float]:
+        """Classify user intent and report how confident the deciding stage was.
+
+        Rule matches (booking pattern, greeting/emergency/cancel words, keyword
+        fallback) report 1.0 and the FAQ default 0.0. Model stages report
+        their own score: the trained head's calibrated probability, the
+        DistilBERT softmax probability, or the combined keyword + similarity
+        score.
+        """
+        text_lower = text.lower().strip()
+        
+        # Pattern-based detection (fast, high confidence)
+        rule_intent = self._rule_intent(text, text_lower)
+        if rule_intent:
+            return rule_intent, 1.0
+        
+        # Fine-tuned DistilBERT, only when explicitly configured
+        if self._distilbert_enabled():
+            predicted, confidence = self._classify_with_distilbert(text)
+            if predicted:
+                return predicted, confidence
         
-        if any(word in text_lower for word in ['service', 'facility', 'department', 'offer']):
-            return 'services'
+        # Trained head: one matrix-vector product, calibrated confidence
+        if self.head is not None:
+            try:
+                predicted, confidence = self.head.predict(self._embed(text, encoded))
+                if confidence >= self.HEAD_MIN_CONFIDENCE:
+                    return predicted, confidence
+            except Exception as e:
+                print(f"Intent head error: {e}")
         
-        if any(word in text_lower for word in ['address', 'location', 'where', 'located']):
-            return 'location'
+        # Without a head, combine keyword patterns (higher weight) with embedding similarity
+        elif self.embeddings_loaded:
+            similarities = self._calculate_similarities(text, encoded).astype(np.float64)
+            intent_scores = self._pattern_scores(text_lower) * 0.7 + similarities * 0.3
+            best = int(np.argmax(intent_scores))
+            
+            # Only use ML result if confidence is high enough
+            if intent_scores[best] > 0.3:
+                return self.INTENTS[best], float(intent_scores[best])
         
-        if any(word in text_lower for word in ['timing', 'time', 'opd', 'open', 'close', 'hour']):
-            return 'timings'
+        # Fallback to keyword-based classification
+        return self._keyword_fallback(text_lower)
+    
+    def classify_batch(self, texts: Sequence[str], contexts: Optional[Sequence[Optional[str]]] = None,
+                       batch_size: int = 256) -> List[Tuple[str, float]]:
+        """Classify many messages; returns (intent, confidence) per text like classify_with_confidence.
+
+        The rule fast paths run over the whole batch first. Only the texts
+        they leave unresolved are embedded, in one batched encode through the
+        persistent embedding cache (re-running an evaluation over the same
+        logs skips the model), and scored with a single matrix product
+        against the trained head or the example matrix. contexts, if given,
+        holds one conversation context per text. Meant for offline
+        relabelling and evaluation; pass a few thousand texts per call to
+        bound memory.
+        """
+        texts = list(texts)
+        if contexts is not None and len(contexts) != len(texts):
+            raise ValueError(f"Got {len(contexts)} contexts for {len(texts)} texts")
+        lowers = [text.lower().strip() for text in texts]
+        results: List[Optional[Tuple[str, float]]] = [None] * len(texts)
         
-        if any(word in text_lower for word in ['contact', 'phone', 'call', 'email']):
-            return 'contact'
+        # Pattern-based detection (fast, high confidence)
+        for i, (text, text_lower) in enumerate(zip(texts, lowers)):
+            rule_intent = self._rule_intent(text, text_lower)
+            if rule_intent:
+                results[i] = (rule_intent, 1.0)
+        pending = [i for i, result in enumerate(results) if result is None]
         
-        # Symptom query detection
-        symptom_keywords = ['have', 'suffering', 'feeling', 'pain', 'problem', 'issue', 'symptom', 'disease']
-        if any(keyword in text_lower for keyword in symptom_keywords):
-            # Check if it's a symptom query (not just appointment booking)
-            if not any(word in text_lower for word in ['appointment', 'book', 'schedule']):
-                return 'symptom_query'
+        # Fine-tuned DistilBERT, only when explicitly configured
+        if pending and self._distilbert_enabled():
+            predictions = self._classify_with_distilbert_batch([texts[i] for i in pending])
+            for i, (predicted, confidence) in zip(pending, predictions):
+                if predicted:
+                    results[i] = (predicted, confidence)
+            pending = [i for i in pending if results[i] is None]
         
-        # Default to FAQ
-        return 'faq'
+        # One batched encode for everything still unresolved
+        if pending and self.embeddings_loaded:
+            try:
+                embeddings = encode_texts([texts[i] for i in pending], self.model_name, batch_size=batch_size)
+                if self.head is not None:
+                    scores = self.head.predict_proba(embeddings)
+                    intents = self.head.intents
+                else:
+                    pattern_scores = np.vstack([self._pattern_scores(lowers[i]) for i in pending])
+                    scores = pattern_scores * 0.7 + self._similarity_scores(embeddings).astype(np.float64) * 0.3
+                    intents = self.INTENTS
+                best = np.argmax(scores, axis=1)
+                confidences = scores[np.arange(len(best)), best]
+                if self.head is not None:
+                    accepted = confidences >= self.HEAD_MIN_CONFIDENCE
+                else:
+                    accepted = confidences > 0.3
+                for i, label, confidence, ok in zip(pending, best, confidences, accepted):
+                    if ok:
+                        results[i] = (intents[label], float(confidence))
+            except Exception as e:
+                print(f"Batch intent scoring error: {e}")
+        
+        # Fallback to keyword-based classification
+        return [result or self._keyword_fallback(text_lower) for result, text_lower in zip(results, lowers)]
     
     def is_loaded(self) -> bool:
         """Check if model is loaded."""
@@ -0,0 +1,371 @@
+"""
+BM25 inverted index over chunk texts for lexical and hybrid retrieval
+"""
+
+import json
+import math
+import os
+import re
+import shutil
+from collections import Counter, defaultdict
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+_TOKEN = re.compile(r'\w+')
+_STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i if in is it its
+me my of on or our please the their there this to was we what when where which
+who will with you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens without stopwords; simple plurals are folded ('timings' -> 'timing')."""
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        if token in _STOPWORDS:
+            continue
+        if len(token) > 4 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class BM25Index:
+    """Read-only BM25 index addressed by chunk id.
+
+    Postings are stored term by term in flat arrays: the postings of term t
+    are ids[offsets[t]:offsets[t + 1]] with term frequencies in tf. Chunk
+    lengths live in doc_lengths (0 for ids that are not indexed). The arrays
+    are memory-mapped .npy files, so the index is shared by worker processes
+    like the FAISS index and chunk store.
+    """
+
+    TERMS_FILE = "bm25_terms.json"
+    ARRAY_FILES = ("bm25_offsets.npy", "bm25_ids.npy", "bm25_tf.npy", "bm25_doclen.npy")
+    FILE_NAMES = (TERMS_FILE,) + ARRAY_FILES
+
+    def __init__(self, terms: List[str], offsets: np.ndarray, ids: np.ndarray, tf: np.ndarray,
+                 doc_lengths: np.ndarray, k1: float = 1.5, b: float = 0.75):
+        """Wrap loaded postings arrays."""
+        self.vocabulary: Dict[str, int] = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.ids = ids
+        self.tf = tf
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        indexed = doc_lengths[doc_lengths > 0]
+        self.num_docs = int(len(indexed))
+        self.avg_length = float(indexed.mean()) if len(indexed) else 1.0
+
+    @classmethod
+    def exists(cls, directory: str) -> bool:
+        """Check if a BM25 index has been written to directory."""
+        return all(os.path.exists(os.path.join(directory, name)) for name in cls.FILE_NAMES)
+
+    @classmethod
+    def load(cls, directory: str) -> "BM25Index":
+        """Open the index in directory with the postings memory-mapped."""
+        with open(os.path.join(directory, cls.TERMS_FILE), 'r', encoding='utf-8') as f:
+            terms = json.load(f)
+        arrays = [np.load(os.path.join(directory, name), mmap_mode='r') for name in cls.ARRAY_FILES]
+        return cls(terms, *arrays)
+
+    def __len__(self) -> int:
+        return self.num_docs
+
+    def live_ids(self) -> np.ndarray:
+        """Chunk ids present in the index."""
+        return np.flatnonzero(np.asarray(self.doc_lengths) > 0)
+
+    def search(self, query: str, top_k: int = 3,
+               allowed_ids: Optional[np.ndarray] = None) -> List[Tuple[int, float, float]]:
+        """Return up to top_k (chunk id, BM25 score, normalized score) best-first.
+
+        The normalized score divides by the best score any chunk could get
+        for the query, giving a 0-1 relevance comparable across queries.
+        allowed_ids restricts the results to those chunk ids.
+        """
+        terms = set(tokenize(query))
+        if not terms or not self.num_docs:
+            return []
+
+        scores = np.zeros(len(self.doc_lengths), dtype='float32')
+        max_score = 0.0
+        for term in terms:
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = int(self.offsets[term_id]), int(self.offsets[term_id + 1])
+            ids = self.ids[start:end]
+            tf = self.tf[start:end].astype('float32')
+            df = end - start
+            idf = math.log(1.0 + (self.num_docs - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * self.doc_lengths[ids] / self.avg_length)
+            # Each id appears once per term, so fancy-index accumulation is safe
+            scores[ids] += idf * tf * (self.k1 + 1.0) / (tf + norm)
+            max_score += idf * (self.k1 + 1.0)
+
+        if allowed_ids is not None:
+            allowed = np.zeros(len(scores), dtype=bool)
+            allowed[allowed_ids[allowed_ids < len(scores)]] = True
+            scores[~allowed] = 0.0
+        matched = np.flatnonzero(scores)
+        if not len(matched) or max_score <= 0:
+            return []
+        if len(matched) > top_k:
+            matched = matched[np.argpartition(-scores[matched], top_k - 1)[:top_k]]
+        matched = matched[np.argsort(-scores[matched])]
+        return [(int(i), float(scores[i]), float(min(scores[i] / max_score, 1.0))) for i in matched]
+
+
+class BM25Builder:
+    """Accumulate postings chunk by chunk and write a BM25Index.
+
+    Postings are kept in memory until spill(), which writes them as a run of
+    flat arrays under spill_dir and frees them; write() merges the runs with
+    NumPy into memory-mapped output files. A streaming build that spills at
+    every checkpoint therefore holds only the vocabulary (term -> id) and the
+    postings added since the last spill. Without spill_dir everything stays
+    in memory until write().
+    """
+
+    VOCAB_FILE = "vocab.txt"
+    RUN_ARRAYS = ("terms", "offsets", "ids", "tf", "doc_ids", "doc_lengths")
+
+    def __init__(self, spill_dir: Optional[str] = None):
+        """Start an empty index (spilling runs to spill_dir, if given)."""
+        self.spill_dir = spill_dir
+        self._vocabulary: Dict[str, int] = {}
+        self._terms: List[str] = []
+        self._postings: Dict[int, Tuple[array, array]] = defaultdict(lambda: (array('i'), array('H')))
+        self._doc_lengths: Dict[int, int] = {}
+        self._runs = 0
+        self._saved_terms = 0
+        self._spilled_docs = 0
+        self._base_runs: List[Dict[str, np.ndarray]] = []
+
+    def __len__(self) -> int:
+        return self._spilled_docs + sum(len(run['doc_ids']) for run in self._base_runs) + len(self._doc_lengths)
+
+    @property
+    def num_runs(self) -> int:
+        """Runs spilled to disk so far."""
+        return self._runs
+
+    @property
+    def num_terms(self) -> int:
+        """Vocabulary size."""
+        return len(self._terms)
+
+    def add(self, chunk_id: int, text: str):
+        """Index one chunk under its id."""
+        tokens = tokenize(text)
+        # Empty chunks still count as indexed so live ids stay accurate
+        self._doc_lengths[chunk_id] = max(len(tokens), 1)
+        for term, count in Counter(tokens).items():
+            term_id = self._vocabulary.get(term)
+            if term_id is None:
+                term_id = self._vocabulary[term] = len(self._terms)
+                self._terms.append(term)
+            ids, tf = self._postings[term_id]
+            ids.append(chunk_id)
+            tf.append(min(count, 0xFFFF))
+
+    def add_many(self, chunks: Iterable[Tuple[int, str]]):
+        """Index (chunk id, text) pairs."""
+        for chunk_id, text in chunks:
+            self.add(chunk_id, text)
+
+    def add_index(self, index: BM25Index, exclude_ids: Iterable[int] = (),
+                  id_map: Optional[np.ndarray] = None):
+        """Start from the postings of an existing index instead of re-tokenizing its chunks.
+
+        Postings of exclude_ids are dropped and id_map (old id -> new id),
+        if given, renumbers the rest; it must preserve their order. Call it
+        before add(), with ids added later above every id kept from index.
+        """
+        if self._terms:
+            raise ValueError("add_index() must be called on an empty builder")
+        self._terms = sorted(index.vocabulary, key=index.vocabulary.get)
+        self._vocabulary = dict(index.vocabulary)
+
+        excluded = np.asarray(sorted({int(i) for i in exclude_ids}), dtype=np.int64)
+        ids = np.asarray(index.ids)
+        doc_ids = index.live_ids()
+        doc_ids = doc_ids[~np.isin(doc_ids, excluded)]
+        keep = ~np.isin(ids, excluded)
+        # Postings kept before each term's start give the filtered offsets
+        kept = np.zeros(len(ids) + 1, dtype=np.int64)
+        kept[1:] = np.cumsum(keep)
+        run = {
+            'terms': np.arange(len(self._terms), dtype=np.int32),
+            'offsets': kept[np.asarray(index.offsets)],
+            'ids': ids[keep],
+            'tf': np.asarray(index.tf)[keep],
+            'doc_ids': doc_ids,
+            'doc_lengths': np.asarray(index.doc_lengths)[doc_ids]
+        }
+        if id_map is not None:
+            run['ids'] = id_map[run['ids']].astype(np.int32)
+            run['doc_ids'] = id_map[doc_ids]
+        self._base_runs.append(run)
+
+    def _run_dir(self, run: int) -> str:
+        """Directory of one spilled run."""
+        return os.path.join(self.spill_dir, f"run_{run:05d}")
+
+    def _memory_run(self) -> Dict[str, np.ndarray]:
+        """The in-memory postings as run arrays (term ids ascending)."""
+        term_ids = np.asarray(sorted(self._postings), dtype=np.int32)
+        counts = [len(self._postings[term_id][0]) for term_id in term_ids.tolist()]
+        offsets = np.zeros(len(term_ids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        ids = np.empty(int(offsets[-1]), dtype=np.int32)
+        tf = np.empty(int(offsets[-1]), dtype=np.uint16)
+        for i, term_id in enumerate(term_ids.tolist()):
+            term_postings, term_tf = self._postings[term_id]
+            ids[offsets[i]:offsets[i + 1]] = np.frombuffer(term_postings, dtype=np.int32)
+            tf[offsets[i]:offsets[i + 1]] = np.frombuffer(term_tf, dtype=np.uint16)
+        return {
+            'terms': term_ids, 'offsets': offsets, 'ids': ids, 'tf': tf,
+            'doc_ids': np.fromiter(self._doc_lengths.keys(), dtype=np.int64, count=len(self._doc_lengths)),
+            'doc_lengths': np.fromiter(self._doc_lengths.values(), dtype=np.int32, count=len(self._doc_lengths))
+        }
+
+    def spill(self):
+        """Write the in-memory postings as a run under spill_dir and free them (no-op without spill_dir)."""
+        if self.spill_dir is None or not self._doc_lengths:
+            return
+        run_dir = self._run_dir(self._runs)
+        os.makedirs(run_dir, exist_ok=True)
+        for name, values in self._memory_run().items():
+            _save_array(os.path.join(run_dir, name + '.npy'), values)
+        # Terms are append-only; runs refer to them by id
+        with open(os.path.join(self.spill_dir, self.VOCAB_FILE), 'a', encoding='utf-8') as f:
+            f.writelines(term + '\n' for term in self._terms[self._saved_terms:])
+            f.flush()
+            os.fsync(f.fileno())
+        self._saved_terms = len(self._terms)
+        self._runs += 1
+        self._spilled_docs += len(self._doc_lengths)
+        self._postings.clear()
+        self._doc_lengths.clear()
+
+    def restore(self, runs: int, terms: int) -> bool:
+        """Reopen the first runs spilled runs and terms vocabulary entries of an earlier build.
+
+        Later runs (written after the checkpoint that recorded these counts)
+        are deleted. Returns False if the spilled state is incomplete, in
+        which case it is discarded and the builder is left empty.
+        """
+        if self.spill_dir is None:
+            return False
+        try:
+            with open(os.path.join(self.spill_dir, self.VOCAB_FILE), 'r', encoding='utf-8') as f:
+                vocabulary = [line.rstrip('\n') for _, line in zip(range(terms), f)]
+            spilled_docs = sum(len(np.load(os.path.join(self._run_dir(run), 'doc_ids.npy'), mmap_mode='r'))
+                               for run in range(runs))
+        except (OSError, ValueError):
+            vocabulary, spilled_docs = None, 0
+        if vocabulary is None or len(vocabulary) < terms:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            return False
+
+        # Drop runs and vocabulary written after the checkpoint
+        run = runs
+        while os.path.isdir(self._run_dir(run)):
+            shutil.rmtree(self._run_dir(run))
+            run += 1
+        vocab_path = os.path.join(self.spill_dir, self.VOCAB_FILE)
+        with open(vocab_path + '.tmp', 'w', encoding='utf-8') as f:
+            f.writelines(term + '\n' for term in vocabulary)
+        os.replace(vocab_path + '.tmp', vocab_path)
+
+        self._terms = vocabulary
+        self._vocabulary = {term: i for i, term in enumerate(vocabulary)}
+        self._saved_terms = len(vocabulary)
+        self._runs = runs
+        self._spilled_docs = spilled_docs
+        return True
+
+    def write(self, directory: str, num_ids: Optional[int] = None):
+        """Write the index files to directory (via temporary files and rename).
+
+        Spilled runs and the in-memory postings are merged term by term;
+        the output postings are written through memory maps, so peak memory
+        is one run rather than the whole index. num_ids sizes the doc-length
+        array; it defaults to the largest id + 1.
+        """
+        os.makedirs(directory, exist_ok=True)
+        runs = [{name: np.load(os.path.join(self._run_dir(run), name + '.npy'), mmap_mode='r')
+                 for name in self.RUN_ARRAYS} for run in range(self._runs)]
+        runs.extend(self._base_runs)
+        if self._doc_lengths:
+            runs.append(self._memory_run())
+
+        counts = np.zeros(len(self._terms), dtype=np.int64)
+        for run in runs:
+            # Term ids are unique within a run, so fancy-index accumulation is safe
+            counts[run['terms']] += np.diff(run['offsets'])
+        # Final term order is alphabetical, without terms whose postings were all dropped;
+        # rank maps a term id to its position
+        order = np.asarray(sorted(np.flatnonzero(counts).tolist(), key=self._terms.__getitem__), dtype=np.int64)
+        rank = np.zeros(len(self._terms), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts[order])
+        total = int(offsets[-1])
+
+        paths = {name: os.path.join(directory, name) for name in BM25Index.ARRAY_FILES}
+        if total:
+            ids = np.lib.format.open_memmap(paths['bm25_ids.npy'] + '.tmp', mode='w+', dtype=np.int32, shape=(total,))
+            tf = np.lib.format.open_memmap(paths['bm25_tf.npy'] + '.tmp', mode='w+', dtype=np.uint16, shape=(total,))
+        else:
+            ids, tf = np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.uint16)
+        filled = np.zeros(len(self._terms), dtype=np.int64)
+        max_id = -1
+        for run in runs:
+            term_ids = np.asarray(run['terms'], dtype=np.int64)
+            run_offsets = np.asarray(run['offsets'])
+            run_counts = np.diff(run_offsets)
+            # Each run's block for a term lands after the blocks of earlier runs
+            starts = offsets[rank[term_ids]] + filled[term_ids]
+            destination = np.repeat(starts - run_offsets[:-1], run_counts) + np.arange(int(run_offsets[-1]))
+            ids[destination] = run['ids']
+            tf[destination] = run['tf']
+            filled[term_ids] += run_counts
+            if len(run['doc_ids']):
+                max_id = max(max_id, int(np.max(run['doc_ids'])))
+
+        if num_ids is None:
+            num_ids = max_id + 1
+        doc_lengths = np.zeros(num_ids, dtype=np.int32)
+        for run in runs:
+            doc_lengths[run['doc_ids']] = run['doc_lengths']
+
+        terms_path = os.path.join(directory, BM25Index.TERMS_FILE)
+        with open(terms_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump([self._terms[term_id] for term_id in order.tolist()], f)
+        os.replace(terms_path + '.tmp', terms_path)
+        _save_array(paths['bm25_offsets.npy'], offsets)
+        _save_array(paths['bm25_doclen.npy'], doc_lengths)
+        if total:
+            ids.flush()
+            tf.flush()
+            del ids, tf
+            os.replace(paths['bm25_ids.npy'] + '.tmp', paths['bm25_ids.npy'])
+            os.replace(paths['bm25_tf.npy'] + '.tmp', paths['bm25_tf.npy'])
+        else:
+            _save_array(paths['bm25_ids.npy'], ids)
+            _save_array(paths['bm25_tf.npy'], tf)
+
+
+def _save_array(path: str, values: np.ndarray):
+    """np.save via a temporary file and rename."""
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, values)
+    os.replace(path + '.tmp', path)
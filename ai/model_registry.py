@@ -0,0 +1,95 @@
+"""
+Process-wide registry of shared embedding models
+"""
+
+import os
+import threading
+
+# Suppress HuggingFace verbosity
+os.environ['TRANSFORMERS_VERBOSITY'] = 'error'
+os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+
+import time
+from typing import Dict, Optional
+
+from ai.encoder_backends import DEFAULT_ENCODER_BACKEND, load_encoder, resolve_backend
+
+DEFAULT_EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+
+# Keyed by embedding_key(model_name, backend)
+_models: Dict[str, object] = {}
+_stats: Dict[str, Dict] = {}
+_backends: Dict[str, str] = {}
+_lock = threading.Lock()
+
+
+def get_backend(backend: Optional[str] = None) -> str:
+    """Backend that serves embeddings for a configured one (EMBEDDING_BACKEND by default)."""
+    backend = backend or DEFAULT_ENCODER_BACKEND
+    if backend not in _backends:
+        _backends[backend] = resolve_backend(backend)
+    return _backends[backend]
+
+
+def embedding_key(model_name: str = DEFAULT_EMBEDDING_MODEL, backend: Optional[str] = None) -> str:
+    """Identifier of the embeddings model_name produces on a backend.
+
+    Quantized backends produce slightly different vectors, so embedding
+    caches and index metadata use this key rather than the bare model name.
+    The full-precision 'torch' backend keeps the plain model name.
+    """
+    backend = get_backend(backend)
+    return model_name if backend == 'torch' else f"{model_name}@{backend}"
+
+
+def get_embedding_model(model_name: str = DEFAULT_EMBEDDING_MODEL, track_consumer: bool = True,
+                        backend: Optional[str] = None):
+    """Return the shared encoder for model_name, loading it on first use.
+
+    Every consumer in the process gets the same instance, so the weights are
+    held once and the load time is paid once. Loading is guarded by a lock so
+    concurrent first callers do not load the model twice; inference through
+    encode() is safe to call from multiple threads. Per-request lookups should
+    pass track_consumer=False so they do not count as extra consumers.
+    backend (EMBEDDING_BACKEND, see ENCODER_BACKENDS) picks the inference
+    runtime; every backend's encoder has the SentenceTransformer encode().
+    """
+    backend = get_backend(backend)
+    key = embedding_key(model_name, backend)
+    with _lock:
+        model = _models.get(key)
+        if model is not None:
+            if track_consumer:
+                _stats[key]['requests'] += 1
+            return model
+
+        start = time.perf_counter()
+        model, size_bytes = load_encoder(model_name, backend)
+        load_seconds = time.perf_counter() - start
+
+        _models[key] = model
+        _stats[key] = {
+            'backend': backend,
+            'load_seconds': load_seconds,
+            'size_bytes': size_bytes,
+            'requests': 1
+        }
+        print(f"✅ Embedding model '{model_name}' ({backend}) loaded in {load_seconds:.2f}s")
+        return model
+
+
+def get_registry_stats() -> Dict[str, Dict]:
+    """Report per-model load cost and what sharing has saved so far."""
+    with _lock:
+        report = {}
+        for model_name, stats in _stats.items():
+            reuses = stats['requests'] - 1
+            report[model_name] = {
+                'backend': stats['backend'],
+                'consumers': stats['requests'],
+                'load_seconds': round(stats['load_seconds'], 3),
+                'size_mb': round(stats['size_bytes'] / (1024 * 1024), 1),
+                'saved_load_seconds': round(stats['load_seconds'] * reuses, 3),
+                'saved_mb': round(stats['size_bytes'] * reuses / (1024 * 1024), 1)
+            }
+        return report
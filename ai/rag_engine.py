@@ -16,161 +16,1087 @@ warnings.filterwarnings('ignore', message='.*MISSING.*')
 os.environ['TRANSFORMERS_VERBOSITY'] = 'error'
 os.environ['TOKENIZERS_PARALLELISM'] = 'false'
 
+import json
 import pickle
+import shutil
+import threading
+import time
 import numpy as np
 import faiss
-from sentence_transformers import SentenceTransformer
-from typing import List, Optional
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
 
-class RAGEngine:
-    """Retrieval-Augmented Generation engine."""
+from ai.model_registry import get_embedding_model, embedding_key, DEFAULT_EMBEDDING_MODEL
+from ai.encoded_message import EncodedMessage
+from ai.embedding_cache import encode_query, encode_texts
+from ai.chunk_store import ChunkStore
+from ai.index_builder import StreamingIndexBuilder
+from ai.lexical_index import BM25Builder, BM25Index
+from ai.vector_store import VectorStore
+
+# Supported FAISS index types for build_index()
+INDEX_TYPES = ('flat', 'ivf', 'hnsw')
+
+# Vector compression for build_index(): none (float32), 8-bit scalar or product quantization
+QUANTIZATIONS = ('none', 'sq8', 'pq')
+
+# 'vector' (FAISS only), 'lexical' (BM25 only, no encoder) or 'hybrid' (both, fused)
+SEARCH_MODES = ('vector', 'lexical', 'hybrid')
+
+# Chunk metadata fields accepted by search(..., filters=...)
+FILTER_FIELDS = ('source', 'section', 'department')
+
+# Reciprocal rank fusion constant and per-list candidate multiplier for hybrid search
+RRF_K = 60
+HYBRID_CANDIDATES = 4
+
+class IndexSnapshot:
+    """One loaded version of the knowledge base.
+
+    Holds the FAISS index, chunk stores, BM25 index and metadata read from a
+    single directory. Searches take the engine's current snapshot once and
+    use it throughout, so a hot reload that swaps in a new snapshot never
+    mixes an old index with new chunk texts. Superseded snapshots are not
+    closed explicitly; their memory maps are released once the last
+    in-flight search drops its reference.
+    """
     
-    def __init__(self, vector_db_path: str = "./data/vector_db", model_name: str = "all-MiniLM-L6-v2"):
-        """Initialize RAG engine."""
-        self.vector_db_path = vector_db_path
-        # Suppress warnings during model loading
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            self.model = SentenceTransformer(model_name)
+    def __init__(self, path: str, version: Optional[str] = None):
+        """Load the knowledge base files in path.
+
+        The index and the chunk texts are memory-mapped; texts are read on
+        demand by id. Legacy documents.pkl stores are still loaded in full.
+        """
+        self.path = path
+        self.version = version
         self.index = None
+        self.index_meta = {}
         self.documents = []
+        self.chunk_metadata = None
+        self.lexical_index = None
+        # Full-precision vectors for re-ranking, kept alongside quantized indexes
+        self.vectors = None
+        # field -> lowercased value -> sorted chunk ids, built on first filtered search
+        self._filter_index = None
+        self._filter_lock = threading.Lock()
         self.loaded = False
-        self._load_vector_db()
-    
-    def _load_vector_db(self):
-        """Load FAISS index and documents."""
-        index_path = os.path.join(self.vector_db_path, "index.faiss")
-        documents_path = os.path.join(self.vector_db_path, "documents.pkl")
         
-        if os.path.exists(index_path) and os.path.exists(documents_path):
+        index_path = os.path.join(path, "index.faiss")
+        documents_path = os.path.join(path, "documents.pkl")
+        meta_path = os.path.join(path, "index_meta.json")
+        has_chunk_store = ChunkStore.exists(path)
+        
+        if os.path.exists(index_path) and (has_chunk_store or os.path.exists(documents_path)):
             try:
-                self.index = faiss.read_index(index_path)
-                with open(documents_path, 'rb') as f:
-                    self.documents = pickle.load(f)
+                self.index = self._read_index(index_path)
+                if has_chunk_store:
+                    self.documents = ChunkStore(path)
+                    if ChunkStore.exists(path, ChunkStore.METADATA_NAME):
+                        self.chunk_metadata = ChunkStore(path, ChunkStore.METADATA_NAME)
+                    if BM25Index.exists(path):
+                        self.lexical_index = BM25Index.load(path)
+                else:
+                    with open(documents_path, 'rb') as f:
+                        self.documents = pickle.load(f)
+                # Indexes built before index types existed have no metadata
+                if os.path.exists(meta_path):
+                    with open(meta_path, 'r', encoding='utf-8') as f:
+                        self.index_meta = json.load(f)
+                else:
+                    self.index_meta = {'index_type': 'flat', 'metric': 'l2',
+                                       'built_at': os.path.getmtime(index_path)}
+                if self.index_meta.get('quantization', 'none') != 'none' and VectorStore.exists(path):
+                    self.vectors = VectorStore(path, self.index_meta['dimension'])
                 self.loaded = True
-                print(f"✅ RAG engine loaded: {len(self.documents)} documents")
             except Exception as e:
                 print(f"⚠️ Error loading vector DB: {e}")
                 self.loaded = False
-        else:
+    
+    @staticmethod
+    def _read_index(index_path: str):
+        """Read a FAISS index memory-mapped (shared page cache), falling back to a full read."""
+        try:
+            return faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except Exception:
+            return faiss.read_index(index_path)
+    
+    def get_chunk_metadata(self, chunk_id: int) -> dict:
+        """Metadata recorded for a chunk at ingest (source, offsets, section...)."""
+        if self.chunk_metadata is None or not 0 <= chunk_id < len(self.chunk_metadata):
+            return {}
+        try:
+            return json.loads(self.chunk_metadata[chunk_id] or '{}')
+        except ValueError:
+            return {}
+    
+    def get_filter_index(self) -> Dict[str, Dict[str, np.ndarray]]:
+        """Chunk ids per metadata value, read once from the metadata store."""
+        with self._filter_lock:
+            if self._filter_index is None:
+                postings = {field: defaultdict(list) for field in FILTER_FIELDS}
+                if self.chunk_metadata is not None:
+                    for chunk_id, raw in enumerate(self.chunk_metadata):
+                        try:
+                            meta = json.loads(raw or '{}')
+                        except ValueError:
+                            continue
+                        for field in FILTER_FIELDS:
+                            if meta.get(field):
+                                postings[field][str(meta[field]).lower()].append(chunk_id)
+                self._filter_index = {
+                    field: {value: np.asarray(ids, dtype='int64') for value, ids in values.items()}
+                    for field, values in postings.items()
+                }
+            return self._filter_index
+    
+    def filter_ids(self, filters: Optional[dict]) -> Optional[np.ndarray]:
+        """Chunk ids matching every filter (a value or list of values per field), or None."""
+        if not filters:
+            return None
+        filter_index = self.get_filter_index()
+        allowed = None
+        for field, values in filters.items():
+            if field not in FILTER_FIELDS:
+                raise ValueError(f"Unknown filter field '{field}', expected one of {FILTER_FIELDS}")
+            if isinstance(values, str):
+                values = [values]
+            matches = [filter_index[field].get(str(value).lower()) for value in values]
+            ids = np.unique(np.concatenate([m for m in matches if m is not None] or [np.zeros(0, 'int64')]))
+            allowed = ids if allowed is None else np.intersect1d(allowed, ids, assume_unique=True)
+        return allowed
+    
+    def close(self):
+        """Release the memory maps (only once no search can still use this snapshot)."""
+        if isinstance(self.documents, ChunkStore):
+            self.documents.close()
+        if self.chunk_metadata is not None:
+            self.chunk_metadata.close()
+        if self.vectors is not None:
+            self.vectors.close()
+
+
+class RAGEngine:
+    """Retrieval-Augmented Generation engine.
+
+    Each build or update of the knowledge base is written to its own
+    directory under vector_db_path/versions/ and published by atomically
+    replacing the CURRENT pointer file. Searches check the pointer at most
+    every reload_interval seconds; a new version is loaded in a background
+    thread and swapped in, so other processes (e.g. app workers) pick up a
+    re-ingest without restarting or blocking in-flight searches.
+    """
+    
+    CURRENT_FILE = "CURRENT"
+    VERSIONS_DIR = "versions"
+    # Files of a version (or of the legacy single-directory layout)
+    INDEX_FILES = (("index.faiss", "index_meta.json", "documents.pkl") +
+                   ChunkStore.file_names(ChunkStore.DEFAULT_NAME) +
+                   ChunkStore.file_names(ChunkStore.METADATA_NAME) +
+                   BM25Index.FILE_NAMES + (VectorStore.FILE_NAME,))
+    
+    def __init__(self, vector_db_path: str = "./data/vector_db", model_name: str = DEFAULT_EMBEDDING_MODEL,
+                 nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                 search_mode: Optional[str] = None, reload_interval: Optional[float] = None,
+                 lexical_min_relevance: Optional[float] = None):
+        """Initialize RAG engine.
+
+        nprobe (IVF) and ef_search (HNSW) tune recall vs latency at query time;
+        they default to the RAG_NPROBE / RAG_EF_SEARCH env vars. search_mode
+        (RAG_SEARCH_MODE, default 'vector') is one of SEARCH_MODES; 'lexical'
+        never loads the encoder, and other modes fall back to it if the
+        encoder cannot be loaded. lexical_min_relevance
+        (RAG_LEXICAL_MIN_RELEVANCE, default 0.1) is the cut-off for the
+        normalized BM25 score, which is not comparable to a cosine. reload_interval (RAG_RELOAD_INTERVAL,
+        default 5 seconds; 0 disables) throttles checks for a new version.
+        With a quantized index, rerank_factor * top_k candidates
+        (RAG_RERANK_FACTOR, default 4; 1 disables) are re-scored against the
+        full-precision vectors.
+        """
+        self.vector_db_path = vector_db_path
+        self.model_name = model_name
+        self.search_mode = search_mode or os.getenv('RAG_SEARCH_MODE', 'vector')
+        if self.search_mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode {self.search_mode!r}; expected one of {SEARCH_MODES}")
+        self.model = None
+        if self.search_mode != 'lexical':
+            try:
+                # Shared with the intent classifier via the model registry
+                self.model = get_embedding_model(model_name)
+            except Exception as e:
+                print(f"⚠️ Embedding model unavailable ({e}); RAG search will be lexical only")
+        self.nprobe = nprobe or int(os.getenv('RAG_NPROBE', '8'))
+        self.ef_search = ef_search or int(os.getenv('RAG_EF_SEARCH', '64'))
+        self.rerank_factor = max(int(os.getenv('RAG_RERANK_FACTOR', '4')), 1)
+        if lexical_min_relevance is None:
+            lexical_min_relevance = float(os.getenv('RAG_LEXICAL_MIN_RELEVANCE', '0.1'))
+        self.lexical_min_relevance = lexical_min_relevance
+        if reload_interval is None:
+            reload_interval = float(os.getenv('RAG_RELOAD_INTERVAL', '5'))
+        self.reload_interval = reload_interval
+        self.keep_versions = max(int(os.getenv('RAG_KEEP_VERSIONS', '3')), 1)
+        self._snapshot = IndexSnapshot(vector_db_path)
+        self._reload_lock = threading.Lock()
+        self._reloading = None
+        self._failed_version = None
+        self._last_reload_check = time.monotonic()
+        self.reloads = 0
+        self._load_vector_db()
+    
+    # Views of the current snapshot, for callers that read engine state directly
+    @property
+    def index(self):
+        return self._snapshot.index
+    
+    @property
+    def index_meta(self) -> dict:
+        return self._snapshot.index_meta
+    
+    @property
+    def documents(self):
+        return self._snapshot.documents
+    
+    @property
+    def chunk_metadata(self):
+        return self._snapshot.chunk_metadata
+    
+    @property
+    def lexical_index(self):
+        return self._snapshot.lexical_index
+    
+    @property
+    def loaded(self) -> bool:
+        return self._snapshot.loaded
+    
+    @property
+    def current_version(self) -> Optional[str]:
+        """Name of the loaded version directory (None for the legacy layout)."""
+        return self._snapshot.version
+    
+    def _read_current_version(self) -> Optional[str]:
+        """Version named by the CURRENT pointer, or None if there is none."""
+        try:
+            with open(os.path.join(self.vector_db_path, self.CURRENT_FILE), 'r', encoding='utf-8') as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+    
+    def _version_path(self, version: Optional[str]) -> str:
+        """Directory holding a version (the legacy layout keeps files in vector_db_path)."""
+        if version is None:
+            return self.vector_db_path
+        return os.path.join(self.vector_db_path, self.VERSIONS_DIR, version)
+    
+    def _open_snapshot(self, version: Optional[str]) -> IndexSnapshot:
+        """Load a version and apply the search parameters to it."""
+        snapshot = IndexSnapshot(self._version_path(version), version)
+        self._apply_search_params(snapshot)
+        return snapshot
+    
+    def _load_vector_db(self):
+        """Load the published version (or the legacy layout) and make it current."""
+        snapshot = self._open_snapshot(self._read_current_version())
+        self._snapshot = snapshot
+        if snapshot.loaded:
+            quantization = snapshot.index_meta.get('quantization', 'none')
+            print(f"✅ RAG engine loaded: {len(snapshot.documents)} documents "
+                  f"({snapshot.index_meta.get('index_type', 'flat')}"
+                  f"{'/' + quantization if quantization != 'none' else ''} index, {self.active_search_mode} search"
+                  f"{', version ' + snapshot.version if snapshot.version else ''})")
+            built_with = snapshot.index_meta.get('encoder', self.model_name)
+            if self.model is not None and built_with != embedding_key(self.model_name):
+                print(f"⚠️ Index was embedded with '{built_with}' but queries use '{embedding_key(self.model_name)}'; "
+                      f"re-run ingestion for best accuracy")
+        elif not os.path.exists(os.path.join(snapshot.path, "index.faiss")):
             print("ℹ️ Vector database not found. Run data ingestion first.")
-            self.loaded = False
     
-    def search(self, query: str, top_k: int = 3, min_relevance: float = 0.3) -> str:
-        """Search for relevant documents with relevance scoring and filtering."""
-        if not self.loaded or self.index is None or len(self.documents) == 0:
-            return ""
-        
+    def check_for_update(self, background: bool = True) -> bool:
+        """Load and swap in a newer published version, if there is one.
+
+        With background=True the version is loaded in a separate thread and
+        this call returns immediately; searches keep using the current
+        snapshot until the new one is ready. Returns True if a reload started.
+        """
+        version = self._read_current_version()
+        if version is None or version == self._snapshot.version or version == self._failed_version:
+            return False
+        with self._reload_lock:
+            if self._reloading is not None:
+                return False
+            self._reloading = version
+        if background:
+            threading.Thread(target=self._reload, args=(version,), name='rag-reload', daemon=True).start()
+        else:
+            self._reload(version)
+        return True
+    
+    def _reload(self, version: str):
+        """Load a version and atomically make it the current snapshot."""
         try:
-            # Encode query
-            query_embedding = self.model.encode([query])
-            query_embedding = query_embedding.astype('float32')
-            
-            # Search with more results for filtering
-            k = min(top_k * 2, len(self.documents))  # Get more results for filtering
-            distances, indices = self.index.search(query_embedding, k)
-            
-            # Calculate relevance scores (normalize distances to similarity scores)
-            # FAISS returns L2 distances, convert to similarity (lower distance = higher similarity)
-            max_distance = np.max(distances[0]) if len(distances[0]) > 0 else 1.0
-            relevance_scores = []
-            
+            snapshot = self._open_snapshot(version)
+            if snapshot.loaded:
+                # A single reference assignment: searches see either version, never a mix
+                self._snapshot = snapshot
+                self.reloads += 1
+                print(f"🔄 RAG index reloaded: version {version} ({len(snapshot.documents)} documents)")
+            else:
+                self._failed_version = version
+                print(f"⚠️ Could not load RAG index version {version}; still serving the previous one")
+        finally:
+            with self._reload_lock:
+                self._reloading = None
+    
+    def _current_snapshot(self) -> IndexSnapshot:
+        """The snapshot a search should use (checking for a new version at most every reload_interval)."""
+        if self.reload_interval > 0:
+            now = time.monotonic()
+            if now - self._last_reload_check >= self.reload_interval:
+                self._last_reload_check = now
+                try:
+                    self.check_for_update()
+                except Exception as e:
+                    print(f"⚠️ RAG reload check failed: {e}")
+        return self._snapshot
+    
+    def _new_version_dir(self) -> Tuple[str, str]:
+        """Create an empty directory for a new version and return (version, path)."""
+        version = f"v{time.time_ns()}"
+        path = self._version_path(version)
+        os.makedirs(path)
+        return version, path
+    
+    def _publish_version(self, version: str):
+        """Point CURRENT at version, load it here and drop old versions."""
+        pointer = os.path.join(self.vector_db_path, self.CURRENT_FILE)
+        with open(pointer + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(pointer + '.tmp', pointer)
+        
+        self._load_vector_db()
+        self._remove_legacy_files()
+        self._prune_versions()
+    
+    def _remove_legacy_files(self):
+        """Delete index files left in vector_db_path by the single-directory layout."""
+        for file_name in self.INDEX_FILES:
+            path = os.path.join(self.vector_db_path, file_name)
+            if os.path.exists(path):
+                os.remove(path)
+    
+    def _prune_versions(self):
+        """Delete all but the newest keep_versions versions (never the current one).
+
+        Processes still serving a removed version keep working: their files
+        are memory-mapped and stay readable until unmapped.
+        """
+        versions_dir = os.path.join(self.vector_db_path, self.VERSIONS_DIR)
+        current = self._read_current_version()
+        versions = sorted(name for name in os.listdir(versions_dir) if name.startswith('v'))
+        for version in versions[:-self.keep_versions]:
+            if version != current:
+                shutil.rmtree(os.path.join(versions_dir, version), ignore_errors=True)
+    
+    def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        """Apply query-time recall/latency knobs to the loaded index.
+
+        nprobe is the number of IVF lists visited per query; ef_search is the
+        HNSW candidate list size. Both are ignored for a flat index.
+        """
+        if nprobe is not None:
+            self.nprobe = nprobe
+        if ef_search is not None:
+            self.ef_search = ef_search
+        self._apply_search_params(self._snapshot)
+    
+    def _apply_search_params(self, snapshot: IndexSnapshot):
+        """Set nprobe / efSearch on a snapshot's index."""
+        if snapshot.index is None:
+            return
+        
+        index_type = snapshot.index_meta.get('index_type', 'flat')
+        if index_type == 'ivf':
+            ivf = faiss.extract_index_ivf(snapshot.index)
+            ivf.nprobe = min(self.nprobe, ivf.nlist)
+        elif index_type == 'hnsw':
+            hnsw_index = faiss.downcast_index(snapshot.index)
+            hnsw_index.hnsw.efSearch = self.ef_search
+    
+    def _create_index(self, dimension: int, num_vectors: int, index_type: str,
+                      nlist: Optional[int] = None, hnsw_m: int = 32,
+                      quantization: str = 'none', pq_m: Optional[int] = None):
+        """Create an empty inner-product FAISS index of the requested type and its metadata.
+
+        Vectors are L2-normalized before they are added or searched, so inner
+        product scores are absolute cosine similarities. quantization 'sq8'
+        stores one byte per dimension (4x smaller than float32); 'pq' splits
+        vectors into pq_m sub-vectors (default: 8 dimensions each) coded with
+        up to 8 bits, about 32x smaller. Both need training on num_vectors
+        sample vectors.
+        """
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization '{quantization}', expected one of {QUANTIZATIONS}")
+        
+        meta = {'index_type': index_type, 'dimension': dimension, 'metric': 'ip',
+                'quantization': quantization}
+        metric = faiss.METRIC_INNER_PRODUCT
+        sq8 = faiss.ScalarQuantizer.QT_8bit
+        if quantization == 'pq':
+            if pq_m is None:
+                pq_m = max(dimension // 8, 1)
+            while dimension % pq_m:
+                pq_m -= 1
+            # 2**nbits centroids per sub-quantizer, keeping >= 39 training points each
+            pq_nbits = max(1, min(8, int(np.log2(max(num_vectors, 1) / 39))))
+            meta['pq_m'] = pq_m
+            meta['pq_nbits'] = pq_nbits
+        
+        if index_type == 'ivf':
+            # ~4*sqrt(n) lists, but keep >= 39 training points per centroid
+            if nlist is None:
+                nlist = int(4 * np.sqrt(num_vectors))
+            nlist = max(1, min(nlist, num_vectors // 39))
+            quantizer = faiss.IndexFlatIP(dimension)
+            if quantization == 'sq8':
+                index = faiss.IndexIVFScalarQuantizer(quantizer, dimension, nlist, sq8, metric)
+            elif quantization == 'pq':
+                index = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, pq_nbits, metric)
+            else:
+                index = faiss.IndexIVFFlat(quantizer, dimension, nlist, metric)
+            meta['nlist'] = nlist
+        elif index_type == 'hnsw':
+            if quantization == 'sq8':
+                index = faiss.IndexHNSWSQ(dimension, sq8, hnsw_m, metric)
+            elif quantization == 'pq':
+                index = faiss.IndexHNSWPQ(dimension, pq_m, hnsw_m, pq_nbits, metric)
+            else:
+                index = faiss.IndexHNSWFlat(dimension, hnsw_m, metric)
+            meta['hnsw_m'] = hnsw_m
+        else:
+            if quantization == 'pq':
+                # IndexPQ rejects search parameters (ID filters); a single
+                # inverted list is the same scan over PQ codes and accepts them
+                return faiss.IndexIVFPQ(faiss.IndexFlatIP(dimension), dimension, 1, pq_m, pq_nbits, metric), meta
+            if quantization == 'sq8':
+                codes = faiss.IndexScalarQuantizer(dimension, sq8, metric)
+            else:
+                codes = faiss.IndexFlatIP(dimension)
+            # ID-mapped so chunks can be added/removed by chunk id later
+            index = faiss.IndexIDMap2(codes)
+        return index, meta
+    
+    @staticmethod
+    def _normalize(embeddings: np.ndarray) -> np.ndarray:
+        """Return a float32, L2-normalized copy of a (n, dim) embedding matrix."""
+        embeddings = np.array(embeddings, dtype='float32', copy=True)
+        faiss.normalize_L2(embeddings)
+        return embeddings
+    
+    def get_chunk_metadata(self, chunk_id: int) -> dict:
+        """Metadata recorded for a chunk at ingest (source, offsets, section...)."""
+        return self._snapshot.get_chunk_metadata(chunk_id)
+    
+    @property
+    def active_search_mode(self) -> str:
+        """Search mode actually in effect given what is loaded."""
+        return self._search_mode_for(self._snapshot)
+    
+    def _search_mode_for(self, snapshot: IndexSnapshot) -> str:
+        """Search mode usable with a snapshot (lexical needs its BM25 index, vector the encoder)."""
+        if snapshot.lexical_index is None:
+            return 'vector'
+        if self.model is None:
+            return 'lexical'
+        return self.search_mode
+    
+    def _encode_query(self, query: str, encoded: Optional[EncodedMessage] = None) -> np.ndarray:
+        """Return the normalized query embedding as a (1, dim) float32 matrix.
+
+        Reuses a precomputed EncodedMessage when it was made with this model.
+        """
+        if encoded is not None and encoded.matches(self.model_name):
+            return self._normalize(encoded.matrix)
+        query_embedding = encode_query(query, self.model_name)
+        return self._normalize(query_embedding.reshape(1, -1))
+    
+    @staticmethod
+    def _scores_from_distances(snapshot: IndexSnapshot, distances: np.ndarray) -> np.ndarray:
+        """Convert raw FAISS results into cosine similarities."""
+        if snapshot.index_meta.get('metric', 'l2') == 'ip':
+            return distances
+        # Legacy L2 index over unit vectors: ||a - b||^2 = 2 - 2 cos
+        return 1.0 - distances / 2.0
+    
+    def filter_values(self, field: str) -> List[str]:
+        """Distinct (lowercased) values of a filterable metadata field."""
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"Unknown filter field '{field}', expected one of {FILTER_FIELDS}")
+        return sorted(self._snapshot.get_filter_index()[field])
+    
+    def _search_params(self, snapshot: IndexSnapshot, selector):
+        """FAISS search parameters restricting the search to selector's ids."""
+        ivf = faiss.try_extract_index_ivf(snapshot.index)
+        if ivf is not None:
+            return faiss.SearchParametersIVF(sel=selector, nprobe=min(self.nprobe, ivf.nlist))
+        if snapshot.index_meta.get('index_type', 'flat') == 'hnsw':
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=self.ef_search)
+        return faiss.SearchParameters(sel=selector)
+    
+    @staticmethod
+    def _result(snapshot: IndexSnapshot, idx: int, score: float) -> dict:
+        """Result entry for a chunk id."""
+        return {
+            'text': snapshot.documents[idx],
+            'score': float(score),
+            'index': int(idx),
+            'metadata': snapshot.get_chunk_metadata(int(idx))
+        }
+    
+    def _search_vectors(self, snapshot: IndexSnapshot, query_embeddings: np.ndarray, top_k: int,
+                        min_relevance: float, allowed_ids: Optional[np.ndarray] = None):
+        """Search normalized query vectors; return one result list per query.
+
+        Asks FAISS for exactly top_k neighbours and applies min_relevance to
+        the (already sorted) cosine scores. With allowed_ids, an ID selector
+        makes FAISS skip every other vector instead of filtering afterwards.
+        Quantized indexes return rerank_factor * top_k candidates that are
+        re-scored exactly against the full-precision vectors.
+        """
+        rerank = snapshot.vectors is not None and self.rerank_factor > 1
+        k = min(top_k * self.rerank_factor if rerank else top_k, snapshot.index.ntotal)
+        params = None
+        if allowed_ids is not None:
+            k = min(k, len(allowed_ids))
+            selector = faiss.IDSelectorBatch(allowed_ids)
+            params = self._search_params(snapshot, selector)
+        if k <= 0:
+            return [[] for _ in range(len(query_embeddings))]
+        distances, indices = snapshot.index.search(query_embeddings, k, params=params)
+        if rerank:
+            scores, indices = self._rerank(snapshot, query_embeddings, indices, top_k)
+        else:
+            scores = self._scores_from_distances(snapshot, distances)
+        
+        all_results = []
+        for row_scores, row_indices in zip(scores, indices):
             results = []
-            for i, idx in enumerate(indices[0]):
-                if 0 <= idx < len(self.documents):
-                    distance = distances[0][i]
-                    # Convert distance to similarity score (0-1 range)
-                    # Using exponential decay for better scoring
-                    similarity = np.exp(-distance / (max_distance + 1e-6))
-                    relevance_scores.append(similarity)
-                    
-                    # Only include results above minimum relevance threshold
-                    if similarity >= min_relevance:
-                        results.append({
-                            'text': self.documents[idx],
-                            'score': similarity,
-                            'index': idx
-                        })
-            
-            # Sort by relevance score (highest first)
-            results.sort(key=lambda x: x['score'], reverse=True)
-            
-            # Take top_k results
-            top_results = results[:top_k]
-            
-            # Return only the text, filtered by relevance
-            return "\n".join([r['text'] for r in top_results]) if top_results else ""
+            for score, idx in zip(row_scores, row_indices):
+                # Results come back best-first, so stop at the first one below threshold
+                if score < min_relevance:
+                    break
+                if 0 <= idx < len(snapshot.documents):
+                    results.append(self._result(snapshot, idx, score))
+            all_results.append(results)
+        return all_results
+    
+    @staticmethod
+    def _rerank(snapshot: IndexSnapshot, query_embeddings: np.ndarray, indices: np.ndarray,
+                top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Re-score candidate ids by exact cosine similarity; return the best top_k per query.
+
+        Rows are padded with -inf scores and -1 ids when there are fewer
+        candidates than top_k.
+        """
+        scores = np.full((len(indices), top_k), -np.inf, dtype='float32')
+        reranked = np.full((len(indices), top_k), -1, dtype='int64')
+        for row, (query, candidates) in enumerate(zip(query_embeddings, indices)):
+            candidates = candidates[(candidates >= 0) & (candidates < len(snapshot.vectors))]
+            if not len(candidates):
+                continue
+            exact = snapshot.vectors.get(candidates) @ query
+            order = np.argsort(-exact)[:top_k]
+            scores[row, :len(order)] = exact[order]
+            reranked[row, :len(order)] = candidates[order]
+        return scores, reranked
+    
+    def _search_lexical(self, snapshot: IndexSnapshot, query: str, top_k: int,
+                        allowed_ids: Optional[np.ndarray] = None) -> List[dict]:
+        """BM25 search; 'score' is the normalized (0-1) BM25 score, cut off at lexical_min_relevance.
+
+        The normalization divides by a bound no chunk actually reaches (every
+        query term at saturating frequency), so good matches typically score
+        0.1-0.5 and the cosine min_relevance does not apply here.
+        """
+        results = []
+        for idx, bm25, relevance in snapshot.lexical_index.search(query, top_k, allowed_ids):
+            if relevance < self.lexical_min_relevance:
+                continue
+            if 0 <= idx < len(snapshot.documents):
+                result = self._result(snapshot, idx, relevance)
+                result['bm25'] = bm25
+                results.append(result)
+        return results
+    
+    def _fuse(self, snapshot: IndexSnapshot, query_embedding: np.ndarray, vector_results: List[dict],
+              lexical_results: List[dict], top_k: int) -> List[dict]:
+        """Reciprocal rank fusion of the vector and BM25 result lists.
+
+        Results are ordered by 'fused_score', sum(1 / (RRF_K + rank)) over
+        the lists they appear in (about 0.016 per list). 'score' stays the
+        cosine similarity, computed for chunks only BM25 found, and the
+        per-list relevances are kept as 'vector_score' and 'lexical_score'.
+        """
+        fused = {}
+        for source, results in (('vector_score', vector_results), ('lexical_score', lexical_results)):
+            for rank, result in enumerate(results, start=1):
+                entry = fused.setdefault(result['index'], dict(result, fused_score=0.0))
+                entry['fused_score'] += 1.0 / (RRF_K + rank)
+                entry[source] = result['score']
+                if 'bm25' in result:
+                    entry['bm25'] = result['bm25']
+        ranked = sorted(fused.values(), key=lambda r: r['fused_score'], reverse=True)[:top_k]
+        lexical_only = [r['index'] for r in ranked if 'vector_score' not in r]
+        cosines = self._cosine_scores(snapshot, query_embedding, lexical_only) if lexical_only else {}
+        for result in ranked:
+            result['score'] = result['vector_score'] if 'vector_score' in result else cosines.get(result['index'], 0.0)
+        return ranked
+    
+    def _cosine_scores(self, snapshot: IndexSnapshot, query_embedding: np.ndarray,
+                       ids: List[int]) -> Dict[int, float]:
+        """Exact cosine similarity of the query to a few chunk ids.
+
+        Read from the full-precision vectors when the index is quantized,
+        reconstructed from flat and HNSW indexes, and for IVF found with a
+        search restricted to those ids over every list. Ids whose vector
+        cannot be read are left out.
+        """
+        query = np.asarray(query_embedding, dtype='float32').reshape(1, -1)
+        id_array = np.asarray(ids, dtype='int64')
+        if snapshot.vectors is not None:
+            id_array = id_array[id_array < len(snapshot.vectors)]
+            return dict(zip(id_array.tolist(), (snapshot.vectors.get(id_array) @ query[0]).tolist()))
+        ivf = faiss.try_extract_index_ivf(snapshot.index)
+        if ivf is not None:
+            params = faiss.SearchParametersIVF(sel=faiss.IDSelectorBatch(id_array), nprobe=ivf.nlist)
+            distances, indices = snapshot.index.search(query, len(id_array), params=params)
+            scores = self._scores_from_distances(snapshot, distances)
+            return {int(idx): float(score) for idx, score in zip(indices[0], scores[0]) if idx >= 0}
+        cosines = {}
+        for idx in ids:
+            try:
+                cosines[idx] = float(snapshot.index.reconstruct(idx) @ query[0])
+            except RuntimeError:
+                continue
+        return cosines
+    
+    def _search_query(self, snapshot: IndexSnapshot, query: str, query_embedding: Optional[np.ndarray],
+                      top_k: int, min_relevance: float, allowed_ids: Optional[np.ndarray] = None) -> List[dict]:
+        """Run one query through the active search mode."""
+        mode = self._search_mode_for(snapshot) if query_embedding is not None else 'lexical'
+        if mode == 'vector':
+            return self._search_vectors(snapshot, query_embedding, top_k, min_relevance, allowed_ids)[0]
+        if mode == 'lexical':
+            return self._search_lexical(snapshot, query, top_k, allowed_ids)
+        candidates = top_k * HYBRID_CANDIDATES
+        return self._fuse(snapshot, query_embedding,
+                          self._search_vectors(snapshot, query_embedding, candidates, min_relevance, allowed_ids)[0],
+                          self._search_lexical(snapshot, query, candidates, allowed_ids), top_k)
+    
+    def search(self, query: str, top_k: int = 3, min_relevance: float = 0.3,
+               encoded: Optional[EncodedMessage] = None, filters: Optional[dict] = None) -> str:
+        """Search for relevant documents and return their text.
+
+        min_relevance is an absolute cosine similarity threshold for vector
+        results; BM25 results use lexical_min_relevance instead. filters
+        restricts candidates by chunk metadata, e.g. {'department': 'Cardiology'}
+        or {'source': ['a.txt', 'b.txt']} (see FILTER_FIELDS; case-insensitive,
+        fields are ANDed).
+        """
+        results = self.search_with_scores(query, top_k=top_k, min_relevance=min_relevance, encoded=encoded,
+                                          filters=filters)
+        return "\n".join([r['text'] for r in results]) if results else ""
+    
+    def search_with_scores(self, query: str, top_k: int = 3, min_relevance: float = 0.3,
+                           encoded: Optional[EncodedMessage] = None, filters: Optional[dict] = None):
+        """Search and return results with relevance scores.
+
+        Vector results score by cosine similarity and lexical results by
+        normalized BM25. Hybrid results keep the cosine in 'score' and are
+        ordered by their reciprocal rank fusion 'fused_score'.
+        """
+        snapshot = self._current_snapshot()
+        if not snapshot.loaded or snapshot.index is None or len(snapshot.documents) == 0:
+            return []
+        
+        try:
+            allowed_ids = snapshot.filter_ids(filters)
+            if allowed_ids is not None and not len(allowed_ids):
+                return []
+            query_embedding = None
+            if self._search_mode_for(snapshot) != 'lexical':
+                try:
+                    # Encode query (or reuse the request's embedding)
+                    query_embedding = self._encode_query(query, encoded)
+                except Exception as e:
+                    if snapshot.lexical_index is None:
+                        raise
+                    print(f"⚠️ Query encoding failed ({e}); using lexical search")
+            return self._search_query(snapshot, query, query_embedding, top_k, min_relevance, allowed_ids)
         
         except Exception as e:
             print(f"RAG search error: {e}")
-            return ""
+            return []
     
-    def search_with_scores(self, query: str, top_k: int = 3, min_relevance: float = 0.3):
-        """Search and return results with relevance scores."""
-        if not self.loaded or self.index is None or len(self.documents) == 0:
+    def search_batch(self, queries: List[str], top_k: int = 3, min_relevance: float = 0.3,
+                     filters: Optional[dict] = None) -> List[List[dict]]:
+        """Search many queries at once; return one scored result list per query.
+
+        All queries are encoded in one forward pass and looked up with a
+        single FAISS search over the stacked matrix (BM25 runs per query).
+        """
+        if not queries:
             return []
+        snapshot = self._current_snapshot()
+        if not snapshot.loaded or snapshot.index is None or len(snapshot.documents) == 0:
+            return [[] for _ in queries]
         
         try:
-            query_embedding = self.model.encode([query])
-            query_embedding = query_embedding.astype('float32')
-            
-            k = min(top_k * 2, len(self.documents))
-            distances, indices = self.index.search(query_embedding, k)
-            
-            max_distance = np.max(distances[0]) if len(distances[0]) > 0 else 1.0
-            results = []
-            
-            for i, idx in enumerate(indices[0]):
-                if 0 <= idx < len(self.documents):
-                    distance = distances[0][i]
-                    similarity = np.exp(-distance / (max_distance + 1e-6))
-                    
-                    if similarity >= min_relevance:
-                        results.append({
-                            'text': self.documents[idx],
-                            'score': float(similarity),
-                            'index': idx
-                        })
-            
-            results.sort(key=lambda x: x['score'], reverse=True)
-            return results[:top_k]
+            allowed_ids = snapshot.filter_ids(filters)
+            if allowed_ids is not None and not len(allowed_ids):
+                return [[] for _ in queries]
+            mode = self._search_mode_for(snapshot)
+            if mode == 'lexical':
+                return [self._search_lexical(snapshot, query, top_k, allowed_ids) for query in queries]
+            query_embeddings = self._normalize(encode_texts(queries, self.model_name))
+            if mode == 'vector':
+                return self._search_vectors(snapshot, query_embeddings, top_k, min_relevance, allowed_ids)
+            candidates = top_k * HYBRID_CANDIDATES
+            vector_results = self._search_vectors(snapshot, query_embeddings, candidates, min_relevance, allowed_ids)
+            return [self._fuse(snapshot, query_embedding, results,
+                               self._search_lexical(snapshot, query, candidates, allowed_ids), top_k)
+                    for query, query_embedding, results in zip(queries, query_embeddings, vector_results)]
         
         except Exception as e:
-            print(f"RAG search error: {e}")
-            return []
+            print(f"RAG batch search error: {e}")
+            return [[] for _ in queries]
     
-    def build_index(self, documents: List[str]):
-        """Build FAISS index from documents."""
+    def evaluate_quantization(self, k: int = 10, sample_size: int = 200, seed: int = 0) -> Optional[dict]:
+        """Measure recall@k and memory of the loaded quantized index.
+
+        sample_size stored chunk vectors are used as queries; their exact
+        nearest neighbours (brute force over the full-precision vectors,
+        excluding the query chunk itself) are compared with what the
+        quantized index returns, with and without re-ranking. Returns None
+        if the index is not quantized.
+        """
+        snapshot = self._snapshot
+        if snapshot.vectors is None or not len(snapshot.vectors):
+            return None
+        
+        if snapshot.lexical_index is not None:
+            live = snapshot.lexical_index.live_ids()
+            live = live[live < len(snapshot.vectors)]
+        else:
+            live = np.arange(len(snapshot.vectors))
+        k = min(k, len(live) - 1)
+        if k <= 0:
+            return None
+        rng = np.random.RandomState(seed)
+        query_ids = rng.choice(live, size=min(sample_size, len(live)), replace=False)
+        queries = snapshot.vectors.get(query_ids)
+        
+        # Ground truth: exact top k + 1 (the query itself ranks first), a block of vectors at a time
+        exact = np.empty((len(queries), 0), dtype='int64')
+        exact_scores = np.empty((len(queries), 0), dtype='float32')
+        for start in range(0, len(live), 65536):
+            block = live[start:start + 65536]
+            scores = np.hstack([exact_scores, queries @ snapshot.vectors.get(block).T])
+            ids = np.hstack([exact, np.broadcast_to(block, (len(queries), len(block)))])
+            order = np.argsort(-scores, axis=1)[:, :k + 1]
+            exact_scores = np.take_along_axis(scores, order, axis=1)
+            exact = np.take_along_axis(ids, order, axis=1)
+        
+        _, approx = snapshot.index.search(queries, k + 1)
+        _, candidates = snapshot.index.search(queries, min((k + 1) * self.rerank_factor, snapshot.index.ntotal))
+        _, reranked = self._rerank(snapshot, queries, candidates, k + 1)
+        
+        def recall(found: np.ndarray) -> float:
+            hits = 0
+            for query_id, truth, result in zip(query_ids, exact, found):
+                truth = [i for i in truth if i != query_id][:k]
+                result = [i for i in result if i != query_id][:k]
+                hits += len(set(truth) & set(result))
+            return hits / (len(query_ids) * k)
+        
+        index_path = os.path.join(snapshot.path, "index.faiss")
+        return {
+            'quantization': snapshot.index_meta.get('quantization'),
+            'k': k,
+            'queries': int(len(query_ids)),
+            'recall': recall(approx),
+            'recall_reranked': recall(reranked),
+            'rerank_factor': self.rerank_factor,
+            'index_bytes': os.path.getsize(index_path),
+            'float32_bytes': int(snapshot.index.ntotal) * snapshot.vectors.dimension * 4,
+            'vectors_bytes': os.path.getsize(os.path.join(snapshot.path, VectorStore.FILE_NAME))
+        }
+    
+    def build_index(self, documents: List[str], index_type: str = 'flat',
+                    nlist: Optional[int] = None, hnsw_m: int = 32, quantization: str = 'none'):
+        """Build FAISS index from documents.
+
+        index_type is 'flat' (exact brute force), 'ivf' (inverted lists over a
+        trained k-means quantizer) or 'hnsw' (graph-based). quantization
+        ('none', 'sq8' or 'pq') compresses the vectors held by the index; the
+        full-precision vectors are then written to disk for re-ranking. The
+        choices are saved in index_meta.json and honoured when the index is
+        loaded. Large corpora should stream through streaming_builder() instead.
+        """
         if not documents:
             print("No documents to index")
             return
         
-        print(f"Building RAG index for {len(documents)} documents...")
-        
-        # Generate embeddings
-        embeddings = self.model.encode(documents, show_progress_bar=True)
-        embeddings = embeddings.astype('float32')
+        print(f"Building RAG index ({index_type}, quantization {quantization}) for {len(documents)} documents...")
         
-        # Create FAISS index
-        dimension = embeddings.shape[1]
-        self.index = faiss.IndexFlatL2(dimension)
-        self.index.add(embeddings)
+        builder = self.streaming_builder(index_type=index_type, nlist=nlist, hnsw_m=hnsw_m,
+                                         quantization=quantization, resume=False)
+        builder.add_file('documents', None, documents)
+        builder.finish()
         
-        # Save
-        self.documents = documents
+        print(f"RAG index built and saved: {len(documents)} documents")
+        return list(range(len(documents)))
+    
+    def streaming_builder(self, index_type: str = 'flat', batch_size: int = 256,
+                          checkpoint_every: int = 2048, resume: bool = True, **kwargs) -> StreamingIndexBuilder:
+        """Return a bounded-memory, resumable builder that installs into this engine."""
+        return StreamingIndexBuilder(self, index_type=index_type, batch_size=batch_size,
+                                     checkpoint_every=checkpoint_every, resume=resume, **kwargs)
+    
+    @staticmethod
+    def _write_index_files(path: str, index, index_meta: dict):
+        """Write index.faiss and index_meta.json into a version directory (via temporary files)."""
+        index_path = os.path.join(path, "index.faiss")
+        meta_path = os.path.join(path, "index_meta.json")
+        faiss.write_index(index, index_path + '.tmp')
+        os.replace(index_path + '.tmp', index_path)
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(index_meta, f, indent=2)
+        os.replace(meta_path + '.tmp', meta_path)
+    
+    def install_index(self, index, index_meta: dict, chunk_dir: str):
+        """Publish a finished index with the stores built in chunk_dir as a new version.
+
+        The files are moved into a fresh version directory and CURRENT is
+        switched to it in one rename, so no reader ever sees a partial build.
+        """
         os.makedirs(self.vector_db_path, exist_ok=True)
+        version, path = self._new_version_dir()
+        try:
+            for store_name in (ChunkStore.DEFAULT_NAME, ChunkStore.METADATA_NAME):
+                if ChunkStore.exists(chunk_dir, store_name):
+                    for file_name in ChunkStore.file_names(store_name):
+                        os.replace(os.path.join(chunk_dir, file_name), os.path.join(path, file_name))
+            if BM25Index.exists(chunk_dir):
+                for file_name in BM25Index.FILE_NAMES:
+                    os.replace(os.path.join(chunk_dir, file_name), os.path.join(path, file_name))
+            if VectorStore.exists(chunk_dir):
+                os.replace(os.path.join(chunk_dir, VectorStore.FILE_NAME), os.path.join(path, VectorStore.FILE_NAME))
+            self._write_index_files(path, index, index_meta)
+        except Exception:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        
+        self._publish_version(version)
+    
+    def supports_updates(self) -> bool:
+        """Check if the saved index can be updated in place by chunk id."""
+        return self.loaded and bool(self.index_meta.get('supports_updates'))
+    
+    def _copy_version(self, snapshot: IndexSnapshot, target: str):
+        """Populate a new version directory from the snapshot's one by hard links.
+
+        Chunk and vector store data files (.bin) are then appended to in
+        place: readers of the old version only address the bytes its
+        offsets (and index ids) cover, so the shared file can grow under
+        them. A .bin file that is already longer than the old version uses
+        (a failed or rolled-back update appended to it) is copied up to that
+        length instead, so those bytes are never shared by two versions.
+        """
+        for file_name in self.INDEX_FILES:
+            source_path = os.path.join(snapshot.path, file_name)
+            if not os.path.exists(source_path):
+                continue
+            target_path = os.path.join(target, file_name)
+            used = self._used_bytes(snapshot, file_name) if file_name.endswith('.bin') else None
+            if used is None or os.path.getsize(source_path) == used:
+                try:
+                    os.link(source_path, target_path)
+                    continue
+                except OSError:
+                    pass
+            if used is None:
+                shutil.copyfile(source_path, target_path)
+                continue
+            with open(source_path, 'rb') as src, open(target_path, 'wb') as dst:
+                while used > 0:
+                    block = src.read(min(used, 1 << 20))
+                    if not block:
+                        break
+                    dst.write(block)
+                    used -= len(block)
+
+    @staticmethod
+    def _used_bytes(snapshot: IndexSnapshot, file_name: str) -> int:
+        """Bytes of a chunk or vector store data file that the snapshot's version addresses."""
+        num_chunks = len(snapshot.documents)
+        if file_name == VectorStore.FILE_NAME:
+            return num_chunks * snapshot.index_meta['dimension'] * 4
+        offsets_file = file_name[:-len('.bin')] + '_offsets.npy'
+        return int(np.load(os.path.join(snapshot.path, offsets_file), mmap_mode='r')[-1])
+    
+    def update_index(self, added_documents: List[str], removed_ids: Iterable[int] = (),
+                     batch_size: int = 256, metadata: Optional[List[dict]] = None) -> List[int]:
+        """Incrementally add and remove chunks without rebuilding the index.
+
+        Removed ids are dropped from the FAISS index (their text stays in the
+        append-only chunk store until compact_index() or the next full
+        build); added chunks are embedded, appended to the chunk store and
+        added under their new ids. The BM25 index, if present, keeps its
+        stored postings minus the removed ids and only tokenizes the added
+        chunks. The result is published as a new version whose chunk and
+        vector data files share storage with the old one, so an update costs
+        the added chunks plus rewriting the FAISS index and the BM25 arrays,
+        not a copy of the corpus. Returns the ids assigned to added_documents.
+        """
+        if not self.supports_updates():
+            raise ValueError("Loaded index does not support incremental updates; run a full build")
         
-        index_path = os.path.join(self.vector_db_path, "index.faiss")
-        documents_path = os.path.join(self.vector_db_path, "documents.pkl")
+        snapshot = self._snapshot
+        # The serving copy is a read-only memory map; update a writable one
+        index = faiss.read_index(os.path.join(snapshot.path, "index.faiss"))
+        version, path = self._new_version_dir()
+        try:
+            self._copy_version(snapshot, path)
+            
+            removed_ids = np.asarray(list(removed_ids), dtype='int64')
+            if len(removed_ids):
+                removed = index.remove_ids(removed_ids)
+                print(f"Removed {removed} chunks from RAG index")
+            
+            new_ids: List[int] = []
+            if added_documents:
+                new_ids = list(ChunkStore.append(path, added_documents))
+                if ChunkStore.exists(path, ChunkStore.METADATA_NAME):
+                    if metadata is None:
+                        metadata = [{} for _ in added_documents]
+                    ChunkStore.append(path, (json.dumps(entry) for entry in metadata),
+                                      name=ChunkStore.METADATA_NAME)
+                # Embed in fixed-size batches to keep memory flat
+                for start in range(0, len(added_documents), batch_size):
+                    batch = added_documents[start:start + batch_size]
+                    embeddings = self._normalize(encode_texts(batch, self.model_name))
+                    if snapshot.vectors is not None:
+                        VectorStore.append(path, embeddings)
+                    index.add_with_ids(embeddings, np.asarray(new_ids[start:start + batch_size], dtype='int64'))
+                print(f"Added {len(new_ids)} chunks to RAG index")
+            
+            if snapshot.lexical_index is not None:
+                builder = BM25Builder()
+                builder.add_index(snapshot.lexical_index, exclude_ids=removed_ids.tolist())
+                builder.add_many(zip(new_ids, added_documents))
+                builder.write(path, num_ids=len(snapshot.documents) + len(new_ids))
+            
+            index_meta = dict(snapshot.index_meta)
+            index_meta['count'] = int(index.ntotal)
+            index_meta['built_at'] = time.time()
+            self._write_index_files(path, index, index_meta)
+        except Exception:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
         
-        faiss.write_index(self.index, index_path)
-        with open(documents_path, 'wb') as f:
-            pickle.dump(documents, f)
+        self._publish_version(version)
+        return new_ids
+    
+    def dead_chunk_ratio(self) -> float:
+        """Share of stored chunks that were removed from the index but not yet compacted."""
+        snapshot = self._snapshot
+        if not snapshot.loaded or not len(snapshot.documents):
+            return 0.0
+        return 1.0 - snapshot.index.ntotal / len(snapshot.documents)
+    
+    def compact_index(self, batch_size: int = 4096) -> np.ndarray:
+        """Drop removed chunks from the stores and renumber the live ones 0..n-1.
+
+        The chunk texts, metadata, full-precision vectors and BM25 postings
+        of live chunks are copied to a new version and the FAISS ids are
+        renumbered in place, so nothing is re-embedded or re-tokenized.
+        Returns id_map (old id -> new id, -1 for removed chunks); chunk ids
+        held elsewhere (e.g. the ingest manifest) must be mapped with it.
+        """
+        if not self.supports_updates():
+            raise ValueError("Loaded index does not support incremental updates; run a full build")
         
-        self.loaded = True
-        print(f"RAG index built and saved: {len(documents)} documents")
+        snapshot = self._snapshot
+        index = faiss.read_index(os.path.join(snapshot.path, "index.faiss"))
+        live = np.sort(self._index_ids(index))
+        id_map = np.full(len(snapshot.documents), -1, dtype='int64')
+        id_map[live] = np.arange(len(live))
+        version, path = self._new_version_dir()
+        try:
+            for store_name in (ChunkStore.DEFAULT_NAME, ChunkStore.METADATA_NAME):
+                if ChunkStore.exists(snapshot.path, store_name):
+                    store = ChunkStore(snapshot.path, store_name)
+                    try:
+                        ChunkStore.write(path, (store[chunk_id] for chunk_id in live.tolist()), name=store_name).close()
+                    finally:
+                        store.close()
+            if snapshot.vectors is not None:
+                open(os.path.join(path, VectorStore.FILE_NAME), 'wb').close()
+                for start in range(0, len(live), batch_size):
+                    VectorStore.append(path, snapshot.vectors.get(live[start:start + batch_size]))
+            if snapshot.lexical_index is not None:
+                builder = BM25Builder()
+                stale = snapshot.lexical_index.live_ids()
+                builder.add_index(snapshot.lexical_index, exclude_ids=stale[id_map[stale] < 0].tolist(),
+                                  id_map=id_map)
+                builder.write(path, num_ids=len(live))
+            self._remap_index_ids(index, id_map)
+            
+            index_meta = dict(snapshot.index_meta)
+            index_meta['count'] = int(index.ntotal)
+            index_meta['built_at'] = time.time()
+            self._write_index_files(path, index, index_meta)
+        except Exception:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        
+        print(f"🧹 Compacted RAG index: {len(id_map) - len(live)} removed chunks dropped, {len(live)} kept")
+        self._publish_version(version)
+        return id_map
+    
+    @staticmethod
+    def _index_ids(index) -> np.ndarray:
+        """Chunk ids stored in an updatable (ID-mapped or IVF) FAISS index."""
+        if hasattr(index, 'id_map'):
+            return faiss.vector_to_array(index.id_map).astype('int64')
+        ivf = faiss.extract_index_ivf(index)
+        lists = [faiss.rev_swig_ptr(ivf.invlists.get_ids(list_no), ivf.invlists.list_size(list_no)).copy()
+                 for list_no in range(ivf.nlist) if ivf.invlists.list_size(list_no)]
+        return np.concatenate(lists).astype('int64') if lists else np.zeros(0, dtype='int64')
+    
+    @staticmethod
+    def _remap_index_ids(index, id_map: np.ndarray):
+        """Rewrite the ids of an updatable FAISS index through id_map (in place)."""
+        if hasattr(index, 'id_map'):
+            ids = faiss.vector_to_array(index.id_map)
+            faiss.copy_array_to_vector(id_map[ids].astype('int64'), index.id_map)
+            index.construct_rev_map()
+            return
+        ivf = faiss.extract_index_ivf(index)
+        for list_no in range(ivf.nlist):
+            size = ivf.invlists.list_size(list_no)
+            if size:
+                # A view onto the inverted list's id array
+                ids = faiss.rev_swig_ptr(ivf.invlists.get_ids(list_no), size)
+                ids[:] = id_map[ids]
+    
+    @property
+    def index_version(self):
+        """Identifier of the loaded knowledge base build (changes on re-ingest)."""
+        return self.index_meta.get('built_at')
     
     def is_loaded(self) -> bool:
         """Check if RAG engine is loaded."""
         return self.loaded
-
@@ -0,0 +1,65 @@
+"""
+Memory-mapped full-precision vector store for re-ranking quantized search results
+"""
+
+import os
+from typing import Optional
+
+import numpy as np
+
+
+class VectorStore:
+    """Read-only float32 vectors addressed by chunk id.
+
+    Row i of vectors.bin is the normalized embedding of chunk i. Quantized
+    FAISS indexes keep only compact codes in memory; this file stays on disk
+    and is memory-mapped, so re-ranking a handful of candidates per query
+    only pages in the rows it touches. Like the chunk store the file is
+    append-only: rows of removed chunks stay until the index is compacted
+    or rebuilt.
+    """
+
+    FILE_NAME = "vectors.bin"
+
+    def __init__(self, directory: str, dimension: int):
+        """Open an existing vector store."""
+        self.directory = directory
+        self.dimension = dimension
+        path = os.path.join(directory, self.FILE_NAME)
+        rows = os.path.getsize(path) // (4 * dimension)
+        self._vectors: Optional[np.ndarray] = None
+        if rows:
+            self._vectors = np.memmap(path, dtype='float32', mode='r', shape=(rows, dimension))
+
+    @classmethod
+    def exists(cls, directory: str) -> bool:
+        """Check if a vector store has been written to directory."""
+        return os.path.exists(os.path.join(directory, cls.FILE_NAME))
+
+    @classmethod
+    def append(cls, directory: str, vectors: np.ndarray):
+        """Append rows for the next chunk ids and make them durable."""
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, cls.FILE_NAME), 'ab') as f:
+            f.write(np.ascontiguousarray(vectors, dtype='float32').tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    @classmethod
+    def truncate(cls, directory: str, dimension: int, keep: int):
+        """Drop every row after the first keep (only for stores no reader has mapped)."""
+        path = os.path.join(directory, cls.FILE_NAME)
+        if os.path.exists(path):
+            with open(path, 'r+b') as f:
+                f.truncate(keep * dimension * 4)
+
+    def __len__(self) -> int:
+        return 0 if self._vectors is None else len(self._vectors)
+
+    def get(self, chunk_ids: np.ndarray) -> np.ndarray:
+        """Vectors of chunk_ids as an in-memory (n, dimension) array."""
+        return np.asarray(self._vectors[np.asarray(chunk_ids, dtype='int64')])
+
+    def close(self):
+        """Release the memory map."""
+        self._vectors = None
@@ -27,6 +27,11 @@ from ai.rag_engine import RAGEngine
 from ai.entity_extractor import EntityExtractor
 from ai.conversation_memory import ConversationMemory
 from ai.symptom_mapper import SymptomMapper
+from ai.model_registry import get_registry_stats
+from ai.encoded_message import EncodedMessage
+from ai.embedding_cache import query_embedding_cache, get_disk_cache
+from ai.embedding_batcher import get_batcher_stats
+from ai.answer_cache import SemanticAnswerCache
 from database.db import init_db, get_db_connection
 from database.schema import create_tables
 from database.availability import AvailabilityChecker
@@ -48,8 +53,48 @@ entity_extractor = EntityExtractor()
 conversation_memory = ConversationMemory(session_timeout_minutes=30)
 symptom_mapper = SymptomMapper()
 availability_checker = AvailabilityChecker()
+_answer_cache_ttl = os.getenv('ANSWER_CACHE_TTL_SECONDS', '3600')
+answer_cache = SemanticAnswerCache(
+    max_entries=int(os.getenv('ANSWER_CACHE_SIZE', '256')),
+    max_distance=float(os.getenv('ANSWER_CACHE_MAX_DISTANCE', '0.08')),
+    ttl_seconds=float(_answer_cache_ttl) if _answer_cache_ttl else None
+)
 print("✅ AI components loaded")
 
+# Department names generate_response answers with a doctor list from the database
+KNOWN_DEPARTMENTS = ['cardiology', 'orthopedics', 'pediatrics', 'general medicine', 'emergency',
+                     'endocrinology', 'dermatology', 'gastroenterology', 'ophthalmology', 'neurology', 'urology', 'ent']
+
+def is_answer_cacheable(intent, user_message, is_follow_up, entities):
+    """Check if a turn is generic enough to be served from the answer cache.
+
+    Only turns that generate_response answers from the static RAG / FAQ
+    branches qualify (the cache key is just the embedding and intent).
+    Anything that depends on extracted entities, symptoms or database rows
+    (doctors, departments, services, overview) is always answered fresh.
+    """
+    if is_follow_up or not answer_cache.is_cacheable_intent(intent):
+        return False
+    if any(entities.get(key) for key in ('doctor', 'date', 'time', 'department')):
+        return False
+    user_lower = user_message.lower().strip()
+    # Never cache anything that looks like a booking, cancellation or doctor-specific turn
+    if any(word in user_lower for word in ['book', 'appointment', 'cancel', 'reschedule', 'doctor']):
+        return False
+    if re.search(r'\bdr\.?\s+[A-Z][a-z]+', user_message, re.IGNORECASE):
+        return False
+    # Department doctor lists, symptom recommendations and name searches
+    if any(re.search(r'\b' + re.escape(dept) + r'\b', user_lower) for dept in KNOWN_DEPARTMENTS):
+        return False
+    if symptom_mapper.get_recommended_department(user_message):
+        return False
+    if len(user_lower.split()) == 1 and user_lower.isalpha():
+        return False
+    # Hospital overview is built from the database
+    if any(phrase in user_lower for phrase in ['hospital information', 'hospital info', 'about hospital', 'about the hospital', 'overview', 'details', 'all information', 'everything about']):
+        return False
+    return True
+
 @app.route('/')
 def index():
     """Main chat interface."""
@@ -74,9 +119,13 @@ def chat():
         last_intent = conversation_memory.get_last_intent(session_id)
         last_entities = conversation_memory.get_last_entities(session_id)
         
+        # Encoded at most once and shared by every semantic stage below
+        encoded_message = EncodedMessage(user_message, model_name=rag_engine.model_name)
+        
         # 1. Enhanced Intent Classification (with conversation context)
         try:
-            intent = intent_classifier.classify(user_message, conversation_context=conversation_summary)
+            intent = intent_classifier.classify(user_message, conversation_context=conversation_summary,
+                                               encoded=encoded_message)
         except Exception as e:
             print(f"Intent classification error: {e}")
             # Fallback to simple classification
@@ -96,6 +145,36 @@ def chat():
             print(f"Entity extraction error: {e}")
             entities = {'doctor': None, 'date': None, 'time': None, 'department': None}
         
+        # Semantic answer cache: paraphrases of recent generic questions skip
+        # RAG and response generation
+        use_answer_cache = is_answer_cacheable(intent, user_message, is_follow_up, entities)
+        if use_answer_cache:
+            # The reply is only stored if the knowledge base is still this version
+            knowledge_version = rag_engine.index_version
+            try:
+                answer_cache.sync_knowledge_version(knowledge_version)
+                cached_reply = answer_cache.lookup(encoded_message.vector, intent)
+            except Exception as e:
+                print(f"Answer cache error: {e}")
+                cached_reply = None
+            
+            if cached_reply:
+                try:
+                    conversation_memory.add_message(session_id, 'user', user_message, intent, entities)
+                    conversation_memory.add_message(session_id, 'assistant', cached_reply, intent, None)
+                except Exception as e:
+                    print(f"Memory storage error: {e}")
+                
+                return jsonify({
+                    'reply': cached_reply,
+                    'intent': intent,
+                    'entities': entities,
+                    'session_id': session_id,
+                    'is_follow_up': is_follow_up,
+                    'cached': True,
+                    'success': True
+                })
+        
         # 3. Enhanced RAG Search with relevance filtering
         context = ""
         try:
@@ -119,8 +198,14 @@ def chat():
             )
             
             if not skip_rag:
+                # Department questions only search that department's chunks
+                rag_filters = None
+                department = entities.get('department')
+                if department and department.lower() in rag_engine.filter_values('department'):
+                    rag_filters = {'department': department}
                 # Use enhanced RAG with relevance scoring
-                context = rag_engine.search(user_message, top_k=2, min_relevance=0.3)
+                context = rag_engine.search(user_message, top_k=2, min_relevance=0.3, encoded=encoded_message,
+                                            filters=rag_filters)
         except Exception as e:
             print(f"RAG search error: {e}")
             context = ""
@@ -141,6 +226,14 @@ def chat():
             print(f"Response generation error: {e}")
             traceback.print_exc()
             response = "I apologize, but I'm having trouble processing your request. Could you please rephrase it?"
+            use_answer_cache = False
+        
+        if use_answer_cache:
+            try:
+                answer_cache.store(encoded_message.vector, intent, user_message, response,
+                                   knowledge_version=knowledge_version)
+            except Exception as e:
+                print(f"Answer cache error: {e}")
         
         # Store conversation in memory
         try:
@@ -161,6 +254,7 @@ def chat():
             'entities': entities,
             'session_id': session_id,
             'is_follow_up': is_follow_up,
+            'cached': False,
             'success': True
         })
     
@@ -295,9 +389,22 @@ def health():
     return jsonify({
         'status': 'healthy',
         'rag_loaded': rag_engine.is_loaded(),
-        'intent_model_loaded': intent_classifier.is_loaded()
+        'rag_search_mode': rag_engine.active_search_mode,
+        'rag_index_version': rag_engine.current_version,
+        'intent_model_loaded': intent_classifier.is_loaded(),
+        'embedding_models': get_registry_stats(),
+        'query_embedding_cache': query_embedding_cache.get_stats(),
+        'embedding_batcher': get_batcher_stats(),
+        'disk_embedding_cache': get_disk_cache().get_stats() if get_disk_cache() else None,
+        'answer_cache': answer_cache.get_stats()
     })
 
+@app.route('/api/answer-cache/invalidate', methods=['POST'])
+def invalidate_answer_cache():
+    """Drop cached chat replies (call after re-ingesting the knowledge base)."""
+    answer_cache.invalidate()
+    return jsonify({'success': True, 'answer_cache': answer_cache.get_stats()})
+
 @app.route('/api/cancel', methods=['POST'])
 def cancel_appointment():
     """Cancel an appointment - Enhanced with error handling."""
@@ -484,9 +591,7 @@ def generate_response(intent, entities, context, user_message, conversation_cont
     
     # Check if user is asking about a department by name
     user_lower = user_message.lower().strip()
-    departments = ['cardiology', 'orthopedics', 'pediatrics', 'general medicine', 'emergency', 
-                   'endocrinology', 'dermatology', 'gastroenterology', 'ophthalmology', 'neurology', 'urology', 'ent']
-    for dept in departments:
+    for dept in KNOWN_DEPARTMENTS:
         pattern = r'\b' + re.escape(dept) + r'\b'
         if re.search(pattern, user_lower) and len(user_lower) < 50 and not booking_keywords and not entities.get('doctor'):
             return get_doctors_by_department(dept.title())
@@ -0,0 +1,77 @@
+"""
+Compare embedding backends against the full-precision reference.
+Reports parity (cosine similarity to the reference embeddings, nearest
+neighbour agreement) and encode latency for each backend.
+"""
+
+import argparse
+import os
+import sys
+
+# Fix Windows console encoding for emojis
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai.encoder_backends import ENCODER_BACKENDS, compare_encoders
+from ai.model_registry import DEFAULT_EMBEDDING_MODEL
+from ai.intent_model import IntentClassifier
+from ai.rag_engine import RAGEngine
+
+def sample_texts(vector_db_path: str, limit: int):
+    """Intent examples (short queries) plus knowledge base chunks (passages)."""
+    texts = [example for examples in IntentClassifier.INTENT_EXAMPLES.values() for example in examples]
+    # Lexical mode opens the chunk store without loading an encoder
+    rag_engine = RAGEngine(vector_db_path=vector_db_path, search_mode='lexical', reload_interval=0)
+    for chunk_id in range(min(len(rag_engine.documents), max(limit - len(texts), 0))):
+        texts.append(rag_engine.documents[chunk_id])
+    return texts[:limit]
+
+def main():
+    """Run the parity check and latency comparison."""
+    parser = argparse.ArgumentParser(description="Compare embedding backends against the full-precision model.")
+    parser.add_argument('--backends', nargs='+', choices=ENCODER_BACKENDS, default=list(ENCODER_BACKENDS),
+                        help="Backends to compare (the 'torch' reference always runs)")
+    parser.add_argument('--limit', type=int, default=500, help="Maximum number of sample texts")
+    parser.add_argument('--batch-size', type=int, default=32, help="Texts per encode batch")
+    parser.add_argument('--repeats', type=int, default=3, help="Timed runs per backend (best is reported)")
+    parser.add_argument('--min-cosine', type=float, default=0.99,
+                        help="Fail if any text's cosine similarity to the reference is below this")
+    args = parser.parse_args()
+
+    vector_db_path = os.getenv("VECTOR_DB_PATH", "./data/vector_db")
+    texts = sample_texts(vector_db_path, args.limit)
+    print(f"🧪 Comparing encoder backends for '{DEFAULT_EMBEDDING_MODEL}' on {len(texts)} texts")
+    print("=" * 50)
+
+    try:
+        report = compare_encoders(DEFAULT_EMBEDDING_MODEL, texts, backends=args.backends,
+                                  batch_size=args.batch_size, repeats=args.repeats)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    print(f"{'backend':<11} {'size MB':>8} {'batch ms/text':>14} {'query ms':>9} {'speedup':>8} "
+          f"{'cos mean':>9} {'cos min':>8} {'NN agree':>9}")
+    failed = []
+    for backend, stats in report.items():
+        if 'error' in stats:
+            print(f"{backend:<11} skipped: {stats['error']}")
+            continue
+        print(f"{backend:<11} {stats['size_mb']:>8} {stats['batch_ms_per_text']:>14} {stats['query_ms']:>9} "
+              f"{stats.get('query_speedup', 1.0):>7}x {stats['cosine_mean']:>9} {stats['cosine_min']:>8} "
+              f"{stats['nearest_neighbour_agreement']:>9}")
+        if stats['cosine_min'] < args.min_cosine:
+            failed.append(backend)
+
+    if failed:
+        print(f"\n❌ Parity check failed (cosine < {args.min_cosine}) for: {', '.join(failed)}")
+        sys.exit(1)
+    print(f"\n✅ All backends within cosine {args.min_cosine} of the reference embeddings")
+
+if __name__ == "__main__":
+    main()
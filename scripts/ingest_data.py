@@ -3,34 +3,53 @@ Data ingestion script for hospital documents.
 Builds RAG index from hospital knowledge base.
 """
 
+import argparse
+import hashlib
+import json
 import os
+import re
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from typing import List
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import sqlite3
 import PyPDF2
 
 # Add parent directory to path
 sys.path.append(str(Path(__file__).parent.parent))
 
-from ai.rag_engine import RAGEngine
+from ai.rag_engine import RAGEngine, QUANTIZATIONS
+from ai.chunker import get_chunker
+from ai.dedup import NearDuplicateFilter
+from ai.index_builder import StreamingIndexBuilder
+
+def _read_pdf(pdf_path: str) -> str:
+    """Extract text from a PDF file, raising on errors."""
+    pages = []
+    with open(pdf_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        for page in pdf_reader.pages:
+            pages.append(page.extract_text() + "\n")
+    return "".join(pages)
+
+def _read_text_file(file_path: str) -> str:
+    """Read a text file, raising on errors."""
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return file.read()
 
 def extract_text_from_pdf(pdf_path: str) -> str:
     """Extract text from a PDF file."""
-    text = ""
     try:
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
+        return _read_pdf(pdf_path)
     except Exception as e:
         print(f"Error reading PDF {pdf_path}: {e}")
-    return text
+        return ""
 
 def extract_text_from_file(file_path: str) -> str:
     """Extract text from a text file."""
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            return file.read()
+        return _read_text_file(file_path)
     except Exception as e:
         print(f"Error reading file {file_path}: {e}")
         return ""
@@ -47,6 +66,150 @@ def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]
     
     return chunks
 
+# Supported file extensions
+PDF_EXTENSIONS = ['.pdf']
+TEXT_EXTENSIONS = ['.txt', '.md']
+
+MANIFEST_FILE = "manifest.json"
+
+# 'tokens' = sentence/heading chunks sized to the model's token budget,
+# 'words' = legacy 500-word windows (chunk_text)
+CHUNKERS = ('tokens', 'words')
+
+def iter_hospital_files(data_path: str):
+    """Yield every supported document under the data directory."""
+    for file_path in sorted(Path(data_path).rglob('*')):
+        if file_path.is_file() and file_path.suffix.lower() in PDF_EXTENSIONS + TEXT_EXTENSIONS:
+            yield file_path
+
+def split_into_chunks(text: str, chunker: str = 'tokens') -> List[Dict]:
+    """Chunk a document; each chunk is a dict with 'text' plus offset/section metadata."""
+    if not text.strip():
+        return []
+    if chunker == 'words':
+        return [{'text': chunk} for chunk in chunk_text(text)]
+    return get_chunker().chunk(text)
+
+# Hospital database next to the app, independent of the working directory
+DEFAULT_DATABASE_PATH = str(Path(__file__).parent.parent / "database" / "hospital.db")
+
+# Departments the app ships with; used to tag sections when the database is unavailable
+DEFAULT_DEPARTMENTS = ['Cardiology', 'Orthopedics', 'Pediatrics', 'General Medicine', 'Emergency',
+                       'Endocrinology', 'Dermatology', 'Gastroenterology', 'Ophthalmology', 'Neurology',
+                       'Urology', 'ENT']
+
+def load_department_names(db_path: str = DEFAULT_DATABASE_PATH) -> List[str]:
+    """Department names for tagging chunks, read from an existing hospital database.
+
+    The database is opened read-only and never created or seeded here; if it
+    does not exist or cannot be read, the built-in department list is used.
+    """
+    if not os.path.exists(db_path):
+        print(f"ℹ️ Note: No hospital database at {db_path}; tagging sections with the built-in department list")
+        return list(DEFAULT_DEPARTMENTS)
+    try:
+        conn = sqlite3.connect(f"file:{Path(db_path).resolve().as_posix()}?mode=ro", uri=True)
+        try:
+            names = [row[0] for row in conn.execute('SELECT name FROM departments')]
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"⚠️ Could not read departments from {db_path} ({e}); using the built-in department list")
+        return list(DEFAULT_DEPARTMENTS)
+    return names or list(DEFAULT_DEPARTMENTS)
+
+def department_for_section(section: Optional[str], departments: List[str]) -> Optional[str]:
+    """Department a section heading belongs to, e.g. 'ENT (EAR, NOSE, THROAT)' -> 'ENT'."""
+    if not section:
+        return None
+    # Longest names first so 'General Medicine' wins over a shorter overlap
+    for name in sorted(departments, key=len, reverse=True):
+        if re.search(r'\b' + re.escape(name.lower()) + r'\b', section.lower()):
+            return name
+    return None
+
+def chunk_metadata(rel_path: str, chunks: List[Dict], departments: Optional[List[str]] = None) -> List[Dict]:
+    """Per-chunk metadata to store alongside the texts (source file, offsets, section, department)."""
+    metadata = []
+    for chunk in chunks:
+        entry = {key: value for key, value in chunk.items() if key != 'text'}
+        entry['source'] = rel_path
+        department = department_for_section(chunk.get('section'), departments or [])
+        if department:
+            entry['department'] = department
+        metadata.append(entry)
+    return metadata
+
+def _extract_file_job(path: str, chunker: str = 'tokens') -> Tuple[str, List[Dict], float, Optional[str]]:
+    """Process-pool job: extract and chunk one file, timing it and capturing errors."""
+    start = time.perf_counter()
+    try:
+        if Path(path).suffix.lower() in PDF_EXTENSIONS:
+            text = _read_pdf(path)
+        else:
+            text = _read_text_file(path)
+        chunks = split_into_chunks(text, chunker)
+        error = None
+    except Exception as e:
+        chunks = []
+        error = f"{type(e).__name__}: {e}"
+    return path, chunks, time.perf_counter() - start, error
+
+def extract_chunks_parallel(file_paths: Iterable[Path], workers: Optional[int] = None,
+                            chunker: str = 'tokens') -> Iterator[Tuple[Path, List[Dict]]]:
+    """Extract and chunk files in a process pool, yielding (path, chunks) as each finishes.
+
+    workers defaults to INGEST_WORKERS or the CPU count; 1 runs in-process.
+    Chunks are dicts as returned by split_into_chunks(). Prints per-file
+    timings and a summary of failed files at the end.
+    """
+    file_paths = [Path(p) for p in file_paths]
+    if workers is None:
+        workers = int(os.getenv("INGEST_WORKERS", "0")) or os.cpu_count() or 1
+    workers = max(1, min(workers, len(file_paths) or 1))
+    
+    errors = []
+    total_chunks = 0
+    start = time.perf_counter()
+    
+    def report(path: str, chunks: List[Dict], seconds: float, error: Optional[str]):
+        nonlocal total_chunks
+        if error:
+            errors.append((path, error))
+            print(f"  ❌ {path} ({seconds:.2f}s): {error}")
+        else:
+            total_chunks += len(chunks)
+            print(f"  📄 {path}: {len(chunks)} chunks in {seconds:.2f}s")
+    
+    if workers == 1:
+        for file_path in file_paths:
+            path, chunks, seconds, error = _extract_file_job(str(file_path), chunker)
+            report(path, chunks, seconds, error)
+            yield file_path, chunks
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_extract_file_job, str(p), chunker): p for p in file_paths}
+            for future in as_completed(futures):
+                path, chunks, seconds, error = future.result()
+                report(path, chunks, seconds, error)
+                yield futures[future], chunks
+    
+    elapsed = time.perf_counter() - start
+    print(f"Extracted {total_chunks} chunks from {len(file_paths) - len(errors)}/{len(file_paths)} files "
+          f"in {elapsed:.2f}s using {workers} worker(s)")
+    if errors:
+        print(f"⚠️ {len(errors)} file(s) failed:")
+        for path, error in errors:
+            print(f"  - {path}: {error}")
+
+def file_sha256(file_path: Path) -> str:
+    """Hash a file's raw content."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
 def load_hospital_data(data_path: str) -> List[str]:
     """Load all documents from the hospital data directory."""
     documents = []
@@ -57,50 +220,286 @@ def load_hospital_data(data_path: str) -> List[str]:
         data_dir.mkdir(parents=True, exist_ok=True)
         return documents
     
-    # Supported file extensions
-    pdf_extensions = ['.pdf']
-    text_extensions = ['.txt', '.md']
-    
-    for file_path in data_dir.rglob('*'):
-        if file_path.is_file():
-            file_ext = file_path.suffix.lower()
-            
-            if file_ext in pdf_extensions:
-                text = extract_text_from_pdf(str(file_path))
-                if text.strip():
-                    chunks = chunk_text(text)
-                    documents.extend(chunks)
-            
-            elif file_ext in text_extensions:
-                text = extract_text_from_file(str(file_path))
-                if text.strip():
-                    chunks = chunk_text(text)
-                    documents.extend(chunks)
+    for _, chunks in extract_chunks_parallel(iter_hospital_files(data_path)):
+        documents.extend(chunk['text'] for chunk in chunks)
     
     return documents
 
+def make_deduplicator(threshold: Optional[float]) -> Optional[NearDuplicateFilter]:
+    """Near-duplicate filter for ingest, or None when disabled (threshold <= 0)."""
+    if threshold is not None and threshold <= 0:
+        return None
+    return NearDuplicateFilter(threshold=threshold)
+
+def report_quantization(rag_engine: RAGEngine, k: int = 10):
+    """Print recall@k and memory of a quantized index against float32 vectors."""
+    stats = rag_engine.evaluate_quantization(k=k)
+    if stats is None:
+        return
+    kb = 1024
+    print(f"📉 {stats['quantization']} index: {stats['index_bytes'] / kb:,.0f} KB in memory vs "
+          f"{stats['float32_bytes'] / kb:,.0f} KB of float32 vectors "
+          f"({stats['float32_bytes'] / max(stats['index_bytes'], 1):.1f}x compression; "
+          f"{stats['vectors_bytes'] / kb:,.0f} KB full-precision vectors on disk)")
+    print(f"   recall@{stats['k']} over {stats['queries']} sample queries: {stats['recall']:.3f} "
+          f"({stats['recall_reranked']:.3f} after re-ranking {stats['rerank_factor']}x candidates)")
+
+def load_manifest(vector_db_path: str) -> Dict:
+    """Load the ingest manifest (file hash -> chunk ids), or an empty one."""
+    manifest_path = os.path.join(vector_db_path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {'index_version': None, 'files': {}}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(vector_db_path: str, manifest: Dict):
+    """Write the ingest manifest next to the index."""
+    manifest_path = os.path.join(vector_db_path, MANIFEST_FILE)
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+def full_ingest(data_path: str, rag_engine: RAGEngine, index_type: str,
+                workers: Optional[int] = None, batch_size: int = 256,
+                checkpoint_every: int = 2048, chunker: str = 'tokens',
+                dedup_threshold: Optional[float] = None, quantization: str = 'none',
+                departments: Optional[List[str]] = None) -> bool:
+    """Re-chunk and re-embed every document and record a fresh manifest.
+
+    Files stream through extraction, near-duplicate removal, batched
+    embedding and the index with bounded memory; progress is checkpointed and
+    an interrupted run resumes from the last checkpoint, skipping files that
+    were already indexed.
+    """
+    data_dir = Path(data_path)
+    if not data_dir.exists():
+        print(f"Data directory {data_path} does not exist. Creating it...")
+        data_dir.mkdir(parents=True, exist_ok=True)
+    
+    current = {}
+    for file_path in iter_hospital_files(data_path):
+        current[str(file_path.relative_to(data_dir))] = (file_path, file_sha256(file_path))
+    
+    builder = rag_engine.streaming_builder(index_type=index_type, batch_size=batch_size,
+                                           checkpoint_every=checkpoint_every, resume=True,
+                                           deduplicator=make_deduplicator(dedup_threshold),
+                                           quantization=quantization)
+    done = builder.completed_files
+    # A checkpoint is only reusable if none of its files changed since
+    if any(rel_path not in current or current[rel_path][1] != entry['sha256']
+           for rel_path, entry in done.items()):
+        print("ℹ️ Files changed since the last checkpoint; starting the build over")
+        if builder.deduplicator is not None:
+            builder.deduplicator.close()
+        builder = rag_engine.streaming_builder(index_type=index_type, batch_size=batch_size,
+                                               checkpoint_every=checkpoint_every, resume=False,
+                                               deduplicator=make_deduplicator(dedup_threshold),
+                                               quantization=quantization)
+        done = builder.completed_files
+    
+    if departments is None:
+        departments = load_department_names()
+    todo = [file_path for rel_path, (file_path, _) in current.items() if rel_path not in done]
+    print(f"Building RAG index ({index_type}, quantization {quantization}) from {len(todo)} files "
+          f"({len(done)} already indexed)...")
+    for file_path, chunks in extract_chunks_parallel(todo, workers, chunker):
+        rel_path = str(file_path.relative_to(data_dir))
+        builder.add_file(rel_path, current[rel_path][1], [chunk['text'] for chunk in chunks],
+                         metadata=chunk_metadata(rel_path, chunks, departments))
+    
+    files = builder.finish()
+    if builder.deduplicator is not None:
+        print(builder.deduplicator.report())
+    total_chunks = sum(len(entry['chunk_ids']) for entry in files.values())
+    if total_chunks == 0:
+        print("No documents found. Please add PDFs or text files to the data directory.")
+        return False
+    
+    print(f"RAG index built and saved: {total_chunks} document chunks")
+    report_quantization(rag_engine)
+    save_manifest(rag_engine.vector_db_path, {
+        'index_version': rag_engine.index_version,
+        'files': files
+    })
+    return True
+
+def incremental_ingest(data_path: str, rag_engine: RAGEngine, workers: Optional[int] = None,
+                       batch_size: int = 256, chunker: str = 'tokens',
+                       dedup_threshold: Optional[float] = None,
+                       departments: Optional[List[str]] = None,
+                       compact_threshold: float = 0.3) -> bool:
+    """Embed only added/changed files and drop chunks of changed/deleted ones.
+
+    Files whose duplicate chunks were dropped in favour of a changed or
+    deleted file are re-ingested too, so their content is never lost. Once
+    removed chunks make up compact_threshold of the stored ones, the index
+    is compacted and the manifest's chunk ids renumbered (0 disables).
+    """
+    data_dir = Path(data_path)
+    manifest = load_manifest(rag_engine.vector_db_path)
+    old_files = manifest.get('files', {})
+    
+    current = {}
+    for file_path in iter_hospital_files(data_path):
+        current[str(file_path.relative_to(data_dir))] = (file_path, file_sha256(file_path))
+    
+    removed_ids = []
+    changed = []
+    for rel_path, entry in old_files.items():
+        if rel_path not in current or current[rel_path][1] != entry['sha256']:
+            removed_ids.extend(entry['chunk_ids'])
+    for rel_path, (file_path, sha256) in current.items():
+        if rel_path not in old_files or old_files[rel_path]['sha256'] != sha256:
+            changed.append(rel_path)
+    
+    # Re-ingest files that relied on a changed/deleted file for their duplicates
+    stale = set(changed) | {rel_path for rel_path in old_files if rel_path not in current}
+    dependents = True
+    while dependents:
+        dependents = [rel_path for rel_path, entry in old_files.items()
+                      if rel_path in current and rel_path not in stale
+                      and stale.intersection(entry.get('duplicates_of', ()))]
+        for rel_path in dependents:
+            stale.add(rel_path)
+            changed.append(rel_path)
+            removed_ids.extend(old_files[rel_path]['chunk_ids'])
+    
+    deleted = [rel_path for rel_path in old_files if rel_path not in current]
+    print(f"Changed/added files: {len(changed)}, deleted files: {len(deleted)}, "
+          f"unchanged files: {len(current) - len(changed)}")
+    
+    if not changed and not removed_ids:
+        print("Knowledge base is up to date.")
+        return True
+    
+    deduplicator = make_deduplicator(dedup_threshold)
+    if deduplicator is not None:
+        # New chunks are checked against the chunks that stay. The database
+        # committed with the current index version already holds them, so
+        # only the removed chunks are dropped; otherwise it is rebuilt
+        dedup_path = os.path.join(rag_engine.vector_db_path, StreamingIndexBuilder.DEDUP_FILE)
+        if deduplicator.reopen(dedup_path, rag_engine.index_version, len(rag_engine.documents)):
+            deduplicator.remove(removed_ids)
+        else:
+            print("ℹ️ No duplicate-detection database for this index version; rebuilding it")
+            for rel_path, entry in old_files.items():
+                if rel_path in current and rel_path not in changed:
+                    for chunk_id in entry['chunk_ids']:
+                        deduplicator.add(rag_engine.documents[chunk_id], rel_path, position=chunk_id)
+    
+    if departments is None:
+        departments = load_department_names()
+    added_documents = []
+    file_chunk_counts = []
+    file_duplicates = {}
+    changed_paths = [current[rel_path][0] for rel_path in changed]
+    added_metadata = []
+    for file_path, chunks in extract_chunks_parallel(changed_paths, workers, chunker):
+        rel_path = str(file_path.relative_to(data_dir))
+        if deduplicator is not None:
+            kept, file_duplicates[rel_path] = deduplicator.filter([chunk['text'] for chunk in chunks], rel_path)
+            chunks = [chunks[i] for i in kept]
+        added_documents.extend(chunk['text'] for chunk in chunks)
+        added_metadata.extend(chunk_metadata(rel_path, chunks, departments))
+        file_chunk_counts.append((rel_path, len(chunks)))
+    if deduplicator is not None:
+        print(deduplicator.report())
+    
+    new_ids = rag_engine.update_index(added_documents, removed_ids, batch_size=batch_size,
+                                      metadata=added_metadata)
+    
+    files = {rel_path: entry for rel_path, entry in old_files.items()
+             if rel_path in current and rel_path not in changed}
+    position = 0
+    for rel_path, count in file_chunk_counts:
+        files[rel_path] = {
+            'sha256': current[rel_path][1],
+            'chunk_ids': new_ids[position:position + count]
+        }
+        if file_duplicates.get(rel_path):
+            files[rel_path]['duplicates_of'] = sorted(file_duplicates[rel_path])
+        position += count
+    
+    if compact_threshold > 0 and rag_engine.dead_chunk_ratio() >= compact_threshold:
+        id_map = rag_engine.compact_index()
+        for entry in files.values():
+            entry['chunk_ids'] = id_map[entry['chunk_ids']].tolist()
+        if deduplicator is not None:
+            deduplicator.remap(id_map)
+    
+    if deduplicator is not None:
+        deduplicator.commit(version=rag_engine.index_version)
+        deduplicator.close()
+    
+    save_manifest(rag_engine.vector_db_path, {
+        'index_version': rag_engine.index_version,
+        'files': files
+    })
+    return True
+
 def main():
     """Main ingestion function."""
+    parser = argparse.ArgumentParser(description="Build the RAG index from hospital documents.")
+    parser.add_argument('--incremental', action='store_true',
+                        default=os.getenv("INGEST_INCREMENTAL", "").lower() in ('1', 'true', 'yes'),
+                        help="Only embed added/changed files (falls back to a full build if needed)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Extraction worker processes (default: INGEST_WORKERS or CPU count)")
+    parser.add_argument('--batch-size', type=int, default=int(os.getenv("INGEST_BATCH_SIZE", "256")),
+                        help="Chunks embedded per batch")
+    parser.add_argument('--checkpoint-every', type=int, default=int(os.getenv("INGEST_CHECKPOINT_EVERY", "2048")),
+                        help="Checkpoint a full build every N chunks")
+    parser.add_argument('--chunker', choices=CHUNKERS, default=os.getenv("INGEST_CHUNKER", "tokens"),
+                        help="tokens: sentence/heading chunks within the model's token limit; words: legacy 500-word windows")
+    parser.add_argument('--dedup-threshold', type=float,
+                        default=float(os.getenv("INGEST_DEDUP_THRESHOLD", "0.8")),
+                        help="Drop chunks whose estimated Jaccard similarity to a kept chunk is at least this (0 disables)")
+    parser.add_argument('--quantization', choices=QUANTIZATIONS, default=os.getenv("RAG_QUANTIZATION", "none"),
+                        help="Compress index vectors: sq8 (8-bit scalar, ~4x) or pq (product quantization, ~32x); "
+                             "full-precision vectors stay on disk for re-ranking")
+    parser.add_argument('--compact-threshold', type=float,
+                        default=float(os.getenv("INGEST_COMPACT_THRESHOLD", "0.3")),
+                        help="Compact the index after an incremental update once this share of stored chunks "
+                             "has been removed (0 disables)")
+    parser.add_argument('--db-path', default=os.getenv("INGEST_DATABASE_PATH", DEFAULT_DATABASE_PATH),
+                        help="Existing hospital database to read department names from (opened read-only)")
+    parser.add_argument('--departments', nargs='+', default=None,
+                        help="Department names for tagging chunks (skips the database)")
+    args = parser.parse_args()
+    
     data_path = os.getenv("HOSPITAL_DATA_PATH", "./data/hospital_knowledge")
     vector_db_path = os.getenv("VECTOR_DB_PATH", "./data/vector_db")
+    index_type = os.getenv("RAG_INDEX_TYPE", "flat")
     
     print("🏥 Hospital AI Chatbot - Data Ingestion")
     print("=" * 50)
     
-    # Load documents
     print(f"\nLoading documents from {data_path}...")
-    documents = load_hospital_data(data_path)
+    rag_engine = RAGEngine(vector_db_path=vector_db_path)
+    departments = args.departments or load_department_names(args.db_path)
     
-    if not documents:
-        print("No documents found. Please add PDFs or text files to the data directory.")
-        return
+    incremental = args.incremental
+    if incremental:
+        manifest = load_manifest(vector_db_path)
+        if not rag_engine.supports_updates():
+            print("ℹ️ Existing index cannot be updated in place; running a full build")
+            incremental = False
+        elif manifest.get('index_version') != rag_engine.index_version:
+            print("ℹ️ Manifest does not match the current index; running a full build")
+            incremental = False
     
-    print(f"Loaded {len(documents)} document chunks")
+    if incremental:
+        success = incremental_ingest(data_path, rag_engine, args.workers, batch_size=args.batch_size,
+                                     chunker=args.chunker, dedup_threshold=args.dedup_threshold,
+                                     departments=departments, compact_threshold=args.compact_threshold)
+    else:
+        success = full_ingest(data_path, rag_engine, index_type, args.workers,
+                              batch_size=args.batch_size, checkpoint_every=args.checkpoint_every,
+                              chunker=args.chunker, dedup_threshold=args.dedup_threshold,
+                              quantization=args.quantization, departments=departments)
     
-    # Build RAG index
-    print(f"\nBuilding RAG index...")
-    rag_engine = RAGEngine(vector_db_path=vector_db_path)
-    rag_engine.build_index(documents)
+    if not success:
+        return
     
     print("\n✅ Data ingestion completed successfully!")
     print(f"RAG index saved to: {vector_db_path}")
@@ -0,0 +1,90 @@
+"""
+Train the logistic intent head used by IntentClassifier.
+Combines IntentClassifier.INTENT_EXAMPLES with an optional labelled file,
+embeds everything with the configured encoder and saves a small .npz head.
+"""
+
+import argparse
+import os
+import sys
+from collections import Counter
+
+# Fix Windows console encoding for emojis
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai.embedding_cache import encode_texts
+from ai.intent_head import IntentHead, load_labelled_examples
+from ai.intent_model import IntentClassifier
+from ai.model_registry import DEFAULT_EMBEDDING_MODEL, embedding_key
+
+def training_examples(labelled_path: str):
+    """Built-in intent examples plus the labelled file's (text, intent) pairs."""
+    examples = [(text, intent) for intent, texts in IntentClassifier.INTENT_EXAMPLES.items() for text in texts]
+    if labelled_path and os.path.exists(labelled_path):
+        labelled = load_labelled_examples(labelled_path)
+        unknown = sorted({intent for _, intent in labelled if intent not in IntentClassifier.INTENTS})
+        if unknown:
+            print(f"⚠️ Skipping examples with unknown intents: {', '.join(unknown)}")
+        examples.extend((text, intent) for text, intent in labelled if intent in IntentClassifier.INTENTS)
+        print(f"📄 Loaded {len(labelled)} labelled examples from {labelled_path}")
+    elif labelled_path:
+        print(f"ℹ️ Note: {labelled_path} not found; training on the built-in examples only")
+    return examples
+
+def main():
+    """Embed the training set, fit the head and save it."""
+    parser = argparse.ArgumentParser(description="Train the logistic intent head over sentence embeddings.")
+    parser.add_argument('--data', default=os.getenv('INTENT_TRAINING_FILE', './data/intent_training.jsonl'),
+                        help="Labelled .jsonl ({\"text\", \"intent\"} per line) or .csv (text,intent) file")
+    parser.add_argument('--output', default=os.getenv('INTENT_HEAD_PATH', './models/intent_head.npz'),
+                        help="Where to write the trained head")
+    parser.add_argument('--epochs', type=int, default=500, help="Gradient descent steps")
+    parser.add_argument('--learning-rate', type=float, default=1.0, help="Gradient descent step size")
+    parser.add_argument('--l2', type=float, default=1e-3, help="L2 regularization strength")
+    parser.add_argument('--folds', type=int, default=5,
+                        help="Cross-validation folds used to calibrate confidences and estimate accuracy")
+    parser.add_argument('--allow-missing-intents', action='store_true',
+                        help="Train even if some intents have no examples (the head can never predict them)")
+    args = parser.parse_args()
+
+    examples = training_examples(args.data)
+    counts = Counter(intent for _, intent in examples)
+    print(f"🧪 Training intent head on {len(examples)} examples: "
+          + ", ".join(f"{intent}={count}" for intent, count in sorted(counts.items())))
+
+    # The head runs before the keyword fallback, so an intent it never saw gets
+    # confidently mislabelled as its nearest neighbour
+    missing = [intent for intent in IntentClassifier.INTENTS if intent not in counts]
+    if missing:
+        print(f"❌ No training examples for: {', '.join(missing)}")
+        print("   The head could never predict these intents. Add them to the labelled file "
+              f"({args.data}) or pass --allow-missing-intents.")
+        if not args.allow_missing_intents:
+            sys.exit(1)
+        print("⚠️ Training anyway (--allow-missing-intents)")
+
+    encoder = embedding_key(DEFAULT_EMBEDDING_MODEL)
+    embeddings = encode_texts([text for text, _ in examples], DEFAULT_EMBEDDING_MODEL)
+    head = IntentHead.train(embeddings, [intent for _, intent in examples], encoder=encoder,
+                            epochs=args.epochs, learning_rate=args.learning_rate, l2=args.l2,
+                            folds=args.folds)
+    head.save(args.output)
+
+    meta = head.meta
+    if meta['cv_folds'] > 1:
+        print(f"📊 {meta['cv_folds']}-fold cross-validated accuracy {meta['cv_accuracy']:.1%}; "
+              f"NLL {meta['cv_nll_uncalibrated']} -> {meta['cv_nll']} after calibration "
+              f"(temperature {meta['temperature']}, ECE {meta['cv_ece']})")
+    else:
+        print("ℹ️ Note: An intent has a single example, so cross-validation was skipped; "
+              "confidences are not calibrated")
+    print(f"✅ Saved intent head for '{encoder}' to {args.output} ({os.path.getsize(args.output) / 1024:.1f} KB)")
+
+if __name__ == "__main__":
+    main()